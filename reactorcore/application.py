@@ -70,6 +70,9 @@ class Application(web.Application):
         self.service.cache = self._get_instance_from_name(
             conf["cache"]["backend"]
         )
+        self.service.ratelimit = self._get_instance_from_name(
+            conf["ratelimit"]["backend"]
+        )
 
         # possible extended services
         for service_name, service in services.items():
@@ -9,11 +9,14 @@ class Env(object):
 
 
 class Event:
+    ID = "id"
     DATA = "data"
     GROUP = "group"
     HANDLER = "handler"
     READY_AFTER = "ready_after"
     CREATED_AT = "created_at"
+    ATTEMPTS = "attempts"
+    PRIORITY = "priority"
 
 
 class Jobs(object):
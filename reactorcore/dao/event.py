@@ -4,24 +4,404 @@ import logging
 import json
 import time
 import copy
+from collections import OrderedDict
 
 from tornado import concurrent
-from redis.exceptions import RedisError
+from tornado import gen
+from redis.exceptions import RedisError, ResponseError
 
+from reactorcore import application
+from reactorcore import constants
+from reactorcore import metrics
 from reactorcore import models
 from reactorcore import util
 from reactorcore.dao import redis
+from reactorcore.dao import spool
+from reactorcore.timer import TimerWheel
 
 logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+# Short field names for the stored event payload. The payload lives in a hash
+# keyed by event id, so the schedule zset only carries the id.
+COMPACT_FIELDS = {
+    constants.Event.DATA: "d",
+    constants.Event.GROUP: "g",
+    constants.Event.HANDLER: "h",
+    constants.Event.READY_AFTER: "r",
+    constants.Event.CREATED_AT: "c",
+    constants.Event.ATTEMPTS: "a",
+    constants.Event.PRIORITY: "p",
+}
+
+EXPANDED_FIELDS = {v: k for k, v in COMPACT_FIELDS.items()}
+
+# event priorities, each has its own lane (schedule zset), popped in this order
+PRIORITIES = (constants.Jobs.HIGH, constants.Jobs.NORMAL, constants.Jobs.LOW)
+
+# default share of each lane when popping a limited number of events
+PRIORITY_WEIGHTS = {
+    constants.Jobs.HIGH: 6,
+    constants.Jobs.NORMAL: 3,
+    constants.Jobs.LOW: 1,
+}
+
+# the stream backend claims stalled events with XAUTOCLAIM, new in Redis 6.2
+STREAM_REDIS_VERSION = (6, 2)
+
+"""
+Insert an event id into the schedule and its payload into the data hash.
+For grouped events the group key holds the score shared by the whole group.
+With a dedup key, the event is only inserted if the key is not set yet
+(the key holds the id of the event that claimed it).
+
+With a batching policy the group key is a hash of the member ids (and `_f`,
+the time the first one arrived) and it is scheduled in place of its members,
+see batch_ready_at for its score.
+
+Returns {1, score} when inserted, {0, existing event id} for a duplicate.
+
+KEYS: schedule zset, data hash, group key or "", dedup key or ""
+ARGV: event id, payload, score for a new event/group, dedup TTL seconds,
+      and for a batching policy: now, min wait, max wait, max batch
+"""
+CREATE_EVENT_SCRIPT = """
+if KEYS[4] ~= '' then
+    if not redis.call('SET', KEYS[4], ARGV[1], 'NX', 'EX', ARGV[4]) then
+        return {0, redis.call('GET', KEYS[4])}
+    end
+end
+if KEYS[3] ~= '' and #ARGV > 4 then
+    local now = tonumber(ARGV[5])
+    redis.call('HSETNX', KEYS[3], '_f', ARGV[5])
+    redis.call('HSET', KEYS[3], ARGV[1], 1)
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    local first = tonumber(redis.call('HGET', KEYS[3], '_f'))
+    local ready_at = math.max(
+        first + tonumber(ARGV[3]) - now, now + tonumber(ARGV[6]))
+    if tonumber(ARGV[7]) > 0 then
+        ready_at = math.min(ready_at, first + tonumber(ARGV[7]))
+    end
+    local max_batch = tonumber(ARGV[8])
+    if max_batch > 0 and redis.call('HLEN', KEYS[3]) - 1 >= max_batch then
+        ready_at = now
+    end
+    redis.call('ZADD', KEYS[1], ready_at, KEYS[3])
+    return {1, tostring(ready_at)}
+end
+local score = ARGV[3]
+if KEYS[3] ~= '' then
+    local existing = redis.call('GET', KEYS[3])
+    if existing then
+        score = existing
+    else
+        redis.call('SET', KEYS[3], score)
+    end
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], score, ARGV[1])
+return {1, score}
+"""
+
+"""
+Take ripe entries off the schedule lanes, replacing batches (keys starting
+with the batch prefix) by their member ids, and deleting them.
+Returns the event ids, and the set of those that came from a batch.
+
+take_ripe_lanes takes up to its quota of entries from each lane, in order
+(-1 for all), entries left over by a lane go to the next ones, and what is
+still left at the end to the lanes that have more, in order.
+"""
+TAKE_RIPE_EVENTS_LUA = """
+local function take_ripe(schedule, min_score, max_score, limit, prefix)
+    local scheduled = redis.call(
+        'ZRANGEBYSCORE', schedule, min_score, max_score, 'LIMIT', 0, limit)
+    for i = 1, #scheduled, 1000 do
+        redis.call('ZREM', schedule,
+            unpack(scheduled, i, math.min(i + 999, #scheduled)))
+    end
+    local ids, batched = {}, {}
+    for _, id in ipairs(scheduled) do
+        if string.sub(id, 1, #prefix) == prefix then
+            for _, member in ipairs(redis.call('HKEYS', id)) do
+                if member ~= '_f' then
+                    ids[#ids + 1] = member
+                    batched[member] = true
+                end
+            end
+            redis.call('DEL', id)
+        else
+            ids[#ids + 1] = id
+        end
+    end
+    return ids, batched, #scheduled
+end
+
+local function take_ripe_lanes(lanes, min_score, max_score, quotas, prefix)
+    local ids, batched = {}, {}
+    local function take(lane, limit)
+        local lane_ids, lane_batched, taken = take_ripe(
+            lane, min_score, max_score, limit, prefix)
+        for _, id in ipairs(lane_ids) do
+            ids[#ids + 1] = id
+        end
+        for id in pairs(lane_batched) do
+            batched[id] = true
+        end
+        return taken
+    end
+
+    local left = 0
+    for i, lane in ipairs(lanes) do
+        local quota = tonumber(quotas[i])
+        if quota < 0 then
+            take(lane, -1)
+        elseif quota + left > 0 then
+            left = quota + left - take(lane, quota + left)
+        end
+    end
+    for _, lane in ipairs(lanes) do
+        if left <= 0 then
+            break
+        end
+        left = left - take(lane, left)
+    end
+    return ids, batched
+end
+"""
+
+"""
+Get and remove ripe events in one swoop, fetching the payloads in bulk.
+Returns a flat list of id, payload pairs (payload is nil for unknown ids).
+Members of a batch that have been cancelled are left out.
+
+KEYS: data hash, schedule lanes
+ARGV: min score, max score, batch key prefix,
+      then the max number of schedule entries per lane (-1 for all)
+"""
+POP_EVENTS_SCRIPT = (
+    TAKE_RIPE_EVENTS_LUA
+    + """
+local ids, batched = take_ripe_lanes(
+    {unpack(KEYS, 2)}, ARGV[1], ARGV[2], {unpack(ARGV, 4)}, ARGV[3])
+local res = {}
+for i = 1, #ids, 1000 do
+    local chunk = {unpack(ids, i, math.min(i + 999, #ids))}
+    local payloads = redis.call('HMGET', KEYS[1], unpack(chunk))
+    redis.call('HDEL', KEYS[1], unpack(chunk))
+    for j = 1, #chunk do
+        if payloads[j] or not batched[chunk[j]] then
+            res[#res + 1] = chunk[j]
+            res[#res + 1] = payloads[j]
+        end
+    end
+end
+return res
+"""
+)
+
+"""
+Move a scheduled event to a new score, only if it is still scheduled, and
+store its payload out of its group (see EventDao.leave_group), only if the
+payload is still the one it was worked out from.
+Returns 1 when moved, 0 when not scheduled, -1 when the payload changed.
+
+KEYS: data hash, schedule lanes
+ARGV: event id, new score, stored payload or "", new payload
+"""
+RESCHEDULE_EVENT_SCRIPT = """
+if (redis.call('HGET', KEYS[1], ARGV[1]) or '') ~= ARGV[3] then
+    return -1
+end
+for i = 2, #KEYS do
+    if redis.call('ZSCORE', KEYS[i], ARGV[1]) then
+        redis.call('ZADD', KEYS[i], ARGV[2], ARGV[1])
+        if ARGV[4] ~= ARGV[3] then
+            redis.call('HSET', KEYS[1], ARGV[1], ARGV[4])
+        end
+        return 1
+    end
+end
+return 0
+"""
+
+"""
+Move dead events back to the schedule, only those still in the dead set.
+Returns the number of events moved.
+
+KEYS: dead zset, dead data hash, data hash, schedule lanes
+ARGV: score, then event id, payload, lane number triples
+"""
+REDRIVE_EVENTS_SCRIPT = """
+local moved = 0
+for i = 2, #ARGV, 3 do
+    if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HDEL', KEYS[2], ARGV[i])
+        redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1])
+        redis.call('ZADD', KEYS[3 + tonumber(ARGV[i + 2])], ARGV[1], ARGV[i])
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+"""
+Move ripe events from the schedule to the stream, in one swoop.
+Group keys of the moved events are deleted.
+Returns the number of events moved.
+
+KEYS: data hash, stream, schedule lanes
+ARGV: min score, max score, batch key prefix,
+      then the max number of schedule entries per lane (-1 for all)
+"""
+FEED_EVENTS_SCRIPT = (
+    TAKE_RIPE_EVENTS_LUA
+    + """
+local ids = take_ripe_lanes(
+    {unpack(KEYS, 3)}, ARGV[1], ARGV[2], {unpack(ARGV, 4)}, ARGV[3])
+for _, id in ipairs(ids) do
+    local payload = redis.call('HGET', KEYS[1], id)
+    if not payload and string.sub(id, 1, 1) == '{' then
+        -- legacy record, the whole JSON event is the zset member
+        payload = id
+        id = ''
+    end
+    if payload then
+        redis.call('XADD', KEYS[2], '*', 'id', id, 'payload', payload)
+        local d = cjson.decode(payload)
+        local group = d['g'] or d['group']
+        if type(group) == 'string' then
+            redis.call('DEL', group)
+        end
+    end
+end
+for i = 1, #ids, 1000 do
+    redis.call('HDEL', KEYS[1], unpack(ids, i, math.min(i + 999, #ids)))
+end
+return #ids
+"""
+)
+
+
+def lane_quotas(limit, weights=None):
+    """
+    Split `limit` (-1 for no limit) over the lanes, in PRIORITIES order,
+    by their weights (`conf["events"]["priority_weights"]`)
+    """
+    if limit < 0:
+        return [-1] * len(PRIORITIES)
+
+    weights = weights or PRIORITY_WEIGHTS
+    total = sum(weights[p] for p in PRIORITIES)
+    quotas = [limit * weights[p] // total for p in PRIORITIES]
+    # the rounding goes to the first lane
+    quotas[0] += limit - sum(quotas)
+    return quotas
+
+
+def batch_ready_at(first, now, ready_after, count, batching):
+    """
+    When a batch of grouped events becomes ripe: `ready_after` seconds after
+    the first event arrived, pushed back to `min_wait` seconds after the last
+    one, but no later than `max_wait` seconds after the first one.
+    Right away once it holds `max_batch` events.
+    Mirrors CREATE_EVENT_SCRIPT.
+    """
+    ready_at = max(first + ready_after, now + batching.get("min_wait", 0))
+    if batching.get("max_wait"):
+        ready_at = min(ready_at, first + batching["max_wait"])
+    if batching.get("max_batch") and count >= batching["max_batch"]:
+        ready_at = now
+    return ready_at
 
 
 class EventDao(redis.RedisSource):
+    ID_SIZE = 12
+
+    # seconds a dedup key is remembered, unless given with the event
+    DEDUP_TTL = 60 * 60
+
+    # tries to reschedule an event whose payload changes meanwhile
+    RESCHEDULE_ATTEMPTS = 3
+
     def __init__(self):
         super(EventDao, self).__init__(name="EVENT", cls=self.__class__)
         self.prefix = "event:"
+        self.schedule_key = "event"
+        self.data_key = self.prefix + "data"
+        self.dead_key = self.prefix + "dead"
+        self.dead_data_key = self.prefix + "dead:data"
+        self.batch_prefix = self.prefix + "batch:"
+
+        self._create_script = self.client.register_script(
+            CREATE_EVENT_SCRIPT
+        )
+        self._pop_script = self.client.register_script(POP_EVENTS_SCRIPT)
+        self._reschedule_script = self.client.register_script(
+            RESCHEDULE_EVENT_SCRIPT
+        )
+        self._redrive_script = self.client.register_script(
+            REDRIVE_EVENTS_SCRIPT
+        )
+
+        spool.register_replayer("event", self._replay_events)
+
+    def lane_key(self, priority):
+        """
+        Schedule zset for events of `priority`,
+        normal ones stay in the original schedule
+        """
+        if not priority or priority == constants.Jobs.NORMAL:
+            return self.schedule_key
+        return "{}:{}".format(self.schedule_key, priority)
+
+    @property
+    def lanes(self):
+        return [self.lane_key(p) for p in PRIORITIES]
+
+    def _lane_quotas(self, limit):
+        return lane_quotas(limit, conf["events"].get("priority_weights"))
+
+    @staticmethod
+    def encode(event):
+        """
+        Serialize an event payload with short keys, skipping empty fields
+        """
+        d = event.to_dict()
+        compact = {
+            COMPACT_FIELDS[k]: v
+            for k, v in d.items()
+            if k in COMPACT_FIELDS and v is not None
+        }
+        return json.dumps(compact, separators=(",", ":"))
+
+    @staticmethod
+    def decode(event_id, payload):
+        d = {
+            EXPANDED_FIELDS.get(k, k): v
+            for k, v in json.loads(payload).items()
+        }
+        d[constants.Event.ID] = event_id
+        return d
+
+    @staticmethod
+    def leave_group(payload):
+        """
+        The payload of an event out of its group, the rest of it byte for
+        byte: Lua's cjson would turn empty lists into objects and round
+        numbers
+        """
+        d = json.loads(payload, object_pairs_hook=OrderedDict)
+        group = d.pop(COMPACT_FIELDS[constants.Event.GROUP], None)
+        group = d.pop(constants.Event.GROUP, None) or group
+        if group is None:
+            return payload
+        return json.dumps(d, separators=(",", ":"))
 
     @concurrent.run_on_executor
-    def create_event(self, e, group_by=None):
+    def create_event(
+        self, e, group_by=None, dedup_key=None, dedup_ttl=None, batching=None
+    ):
         """
         Create an event that will eventually expire and be processed
         by an event handler.
@@ -30,6 +410,15 @@ class EventDao(redis.RedisSource):
         be used to bundle multiple events to be processed at once.
         (Example: user gets one combined email about comments on their
          post in the last hour)
+
+        "batching" is the batching policy of the handler, a dict with
+        "max_batch", "min_wait" and "max_wait", for grouped events
+        (see batch_ready_at)
+
+        "dedup_key" is any client-supplied unique string, an event with
+        a dedup key seen in the last "dedup_ttl" seconds is not inserted.
+        (Example: API request retries creating the same event)
+        The returned event then carries the id of the original event.
         """
 
         logger.debug("Creating event %s", e.to_dict())
@@ -40,74 +429,353 @@ class EventDao(redis.RedisSource):
 
         # copy the event object to avoid mutating the original
         event = models.Event(
+            id=util.gen_random_string(size=self.ID_SIZE),
             handler=e.handler,
             ready_after=e.ready_after,
             data=copy.deepcopy(e.data),
+            priority=e.priority,
         )
 
-        # for grouped events
-        existing_score = None
+        keys = [self.lane_key(event.priority), self.data_key, "", ""]
+        batch_args = []
 
-        group = None
+        # groups don't span lanes
+        lane_suffix = "" if keys[0] == self.schedule_key else ":" + e.priority
 
-        if group_by:
+        if group_by and batching:
             """
-            Check if an event of this type had been created.
-            If so - it has not expired yet, so assign the same score to this new event,
-            to make sure all events of the same type expire at once (grouping)
+            The batch is scheduled as a whole, its time moves
+            as events arrive, within the bounds of the policy
             """
-            group = "event:group:{}-{}-{}".format(
-                str(group_by), event.handler, event.ready_after
+            event.group = "{}{}-{}-{}{}".format(
+                self.batch_prefix,
+                str(group_by),
+                event.handler,
+                event.ready_after,
+                lane_suffix,
             )
-
-            existing_score = self.client.get(group)
-            if existing_score:
-                logger.debug(
-                    "Events for group %s already exists with score %s",
-                    group,
-                    existing_score,
-                )
-                event.score = existing_score
-            else:
-                event.score = time.time() + event.ready_after
-                logger.debug(
-                    "NEW score for events in group %s: %s", group, event.score
-                )
+            keys[2] = event.group
+            batch_args = [
+                time.time(),
+                batching.get("min_wait", 0),
+                batching.get("max_wait", 0),
+                batching.get("max_batch", 0),
+            ]
+        elif group_by:
+            """
+            If an event of this type had been created and has not expired yet,
+            the new event gets the same score, to make sure all events
+            of the same type expire at once (grouping)
+            """
+            event.group = "event:group:{}-{}-{}{}".format(
+                str(group_by), event.handler, event.ready_after, lane_suffix
+            )
+            keys[2] = event.group
         else:
-            # we are not grouping this event
-            event.score = time.time() + event.ready_after
             logger.debug("New UNGROUPED event: %s", event.to_dict())
 
+        if dedup_key:
+            keys[3] = self.prefix + "dedup:" + str(dedup_key)
+            dedup_ttl = dedup_ttl or conf["events"].get(
+                "dedup_ttl", self.DEDUP_TTL
+            )
+
         event.created_at = str(util.utc_time())
 
-        data = event.to_dict()
-        if group_by:
-            data["group"] = group
+        args = [
+            event.id,
+            self.encode(event),
+            time.time() + event.ready_after,
+            int(dedup_ttl or 0),
+        ] + batch_args
+
+        if spool.is_enabled() and not spool.breaker.allow():
+            # Redis is down, don't wait for it
+            self._spool_event(keys, args)
+            return event
 
         try:
-            json_data = json.dumps(data)
-            self.client.zadd("event", json_data, event.score)
-
-            if group_by:
-                """
-                If this is a new event group - save the score.
-                This will help us quickly identify later events
-                that fall into the same group - they will expire at once.
-                """
-                if not existing_score:
-                    logger.debug(
-                        "Creating event group %s with score %s",
-                        group,
-                        event.score,
-                    )
-                    self.client.set(group, event.score)
+            inserted, res = self._create_script(keys=keys, args=args)
         except RedisError as ex:
             logger.critical("Error creating event %s, %s", ex.message, event)
+            spool.breaker.failure()
+            if spool.is_enabled():
+                self._spool_event(keys, args)
+            return event
+
+        spool.breaker.success()
+
+        if inserted:
+            event.score = float(res)
+            logger.debug("Event %s scheduled with score %s", event.id, res)
+        else:
+            logger.info(
+                "Skipping duplicate event for dedup key %s, original %s",
+                dedup_key,
+                res,
+            )
+            event.id = res
+
+        if dedup_key:
+            metrics.registry.counter(
+                "events.dedup.misses" if inserted else "events.dedup.hits"
+            ).incr()
 
         return event
 
+    def _spool_event(self, keys, args):
+        """
+        Keep the event on disk, it is created when the spool is replayed
+        (dedup keys are checked then)
+        """
+        logger.warning("Spooling event %s", args[0])
+        spool.get_spool().append("event", {"keys": keys, "args": args})
+
+    def _replay_events(self, records):
+        pipe = self.client.pipeline(transaction=False)
+        for record in records:
+            self._create_script(
+                keys=record["keys"], args=record["args"], client=pipe
+            )
+        pipe.execute()
+
+    @concurrent.run_on_executor
+    def cancel_event(self, event_id):
+        """
+        Remove a scheduled event, returns True if it was still scheduled
+        """
+        assert event_id
+
+        removed = 0
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            for lane in self.lanes:
+                pipe.zrem(lane, event_id)
+            pipe.hdel(self.data_key, event_id)
+            # batched events are not in the schedule themselves,
+            # the batch leaves them out once it's popped
+            removed = pipe.execute()[-1]
+        except RedisError as ex:
+            logger.critical(
+                "Error cancelling event %s: %s", event_id, ex.message
+            )
+
+        logger.debug("Cancelled event %s: %s", event_id, bool(removed))
+        return bool(removed)
+
+    @concurrent.run_on_executor
+    def reschedule_event(self, event_id, ready_after):
+        """
+        Make a scheduled event ripe `ready_after` seconds from now.
+        A grouped event leaves its group, so that popping it early doesn't
+        delete the group key of the other events.
+        Returns True if the event was still scheduled,
+        False for batched events, that go with their batch.
+        """
+        assert event_id
+        assert ready_after is not None
+
+        updated = 0
+        try:
+            for _ in range(self.RESCHEDULE_ATTEMPTS):
+                payload = self.client.hget(self.data_key, event_id) or ""
+                updated = self._reschedule_script(
+                    keys=[self.data_key] + self.lanes,
+                    args=[
+                        event_id,
+                        time.time() + ready_after,
+                        payload,
+                        self.leave_group(payload) if payload else "",
+                    ],
+                )
+                if updated >= 0:
+                    break
+            else:
+                updated = 0
+                logger.critical(
+                    "Event %s kept changing, not rescheduled", event_id
+                )
+        except RedisError as ex:
+            logger.critical(
+                "Error rescheduling event %s: %s", event_id, ex.message
+            )
+
+        logger.debug("Rescheduled event %s: %s", event_id, bool(updated))
+        return bool(updated)
+
+    @staticmethod
+    def retry_group(group):
+        """
+        Group name for retried events, so that popping them doesn't
+        delete the group key of newer events of the same group
+        """
+        if not group or group.endswith(":retry"):
+            return group
+        return group + ":retry"
+
+    @concurrent.run_on_executor
+    def retry_events(self, events, ready_after):
+        """
+        Schedule the events of a failed handler call again, to be ripe
+        `ready_after` seconds from now, all at once.
+        Returns False if they could not be stored.
+        """
+        score = time.time() + ready_after
+
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            for event in events:
+                event.id = event.id or util.gen_random_string(
+                    size=self.ID_SIZE
+                )
+                event.group = self.retry_group(event.group)
+                pipe.hset(self.data_key, event.id, self.encode(event))
+                pipe.zadd(self.lane_key(event.priority), **{event.id: score})
+            pipe.execute()
+        except RedisError as ex:
+            logger.critical(
+                "Error retrying %d events: %s", len(events), ex.message
+            )
+            return False
+
+        logger.debug("Retrying %d events at %s", len(events), score)
+        return True
+
+    @concurrent.run_on_executor
+    def dead_letter_events(self, events):
+        """
+        Move events that failed too many times to the dead set.
+        Returns False if they could not be stored.
+        """
+        now = time.time()
+
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            for event in events:
+                event.id = event.id or util.gen_random_string(
+                    size=self.ID_SIZE
+                )
+                pipe.hset(self.dead_data_key, event.id, self.encode(event))
+                pipe.zadd(self.dead_key, **{event.id: now})
+            pipe.execute()
+        except RedisError as ex:
+            logger.critical(
+                "Error storing %d dead events: %s", len(events), ex.message
+            )
+            return False
+
+        return True
+
+    def _get_dead_events(self, event_ids=None, limit=100):
+        if event_ids is None:
+            event_ids = self.client.zrange(self.dead_key, 0, limit - 1)
+        if not event_ids:
+            return []
+
+        payloads = self.client.hmget(self.dead_data_key, event_ids)
+        return [
+            models.Event() << self.decode(event_id, payload)
+            for event_id, payload in zip(event_ids, payloads)
+            if payload
+        ]
+
+    @concurrent.run_on_executor
+    def get_dead_events(self, limit=100):
+        """
+        The oldest `limit` dead events
+        """
+        try:
+            return self._get_dead_events(limit=limit)
+        except RedisError as ex:
+            logger.critical("Error getting dead events: %s", ex.message)
+            return []
+
+    @concurrent.run_on_executor
+    def redrive_dead_events(self, event_ids=None, limit=1000):
+        """
+        Schedule dead events again, ripe now and with a clean slate of
+        attempts: the given ones, or else the oldest `limit`.
+        Returns the number of events scheduled.
+        """
+        try:
+            events = self._get_dead_events(event_ids=event_ids, limit=limit)
+            if not events:
+                return 0
+
+            lanes = self.lanes
+            args = [time.time()]
+            for event in events:
+                event.attempts = None
+                args.extend(
+                    [
+                        event.id,
+                        self.encode(event),
+                        lanes.index(self.lane_key(event.priority)) + 1,
+                    ]
+                )
+
+            return self._redrive_script(
+                keys=[self.dead_key, self.dead_data_key, self.data_key]
+                + lanes,
+                args=args,
+            )
+        except RedisError as ex:
+            logger.critical("Error redriving dead events: %s", ex.message)
+            return 0
+
+    @concurrent.run_on_executor
+    def get_backlog(self):
+        """
+        Number of scheduled and ripe events,
+        and the age in seconds of the oldest ripe event
+        """
+        return self._get_backlog()
+
+    def _get_backlog(self):
+        """
+        Totals, and the same per lane, eg. "high.oldest_ripe_age"
+        """
+        now = time.time()
+        fields = ("pending", "ripe", "oldest_ripe_age")
+        backlog = {"dead": None}
+        for name in fields:
+            backlog[name] = None
+            for priority in PRIORITIES:
+                backlog[priority + "." + name] = None
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for lane in self.lanes:
+                pipe.zcard(lane)
+                pipe.zcount(lane, 0, now)
+                pipe.zrange(lane, 0, 0, withscores=True)
+            pipe.zcard(self.dead_key)
+            res = pipe.execute()
+        except RedisError as ex:
+            logger.critical("Error getting event backlog: %s", ex)
+            return backlog
+
+        backlog.update({"pending": 0, "ripe": 0, "dead": res[-1]})
+        for i, priority in enumerate(PRIORITIES):
+            pending, ripe, oldest = res[i * 3 : i * 3 + 3]
+            backlog[priority + ".pending"] = pending
+            backlog[priority + ".ripe"] = ripe
+            backlog["pending"] += pending
+            backlog["ripe"] += ripe
+
+            if oldest and oldest[0][1] <= now:
+                age = now - oldest[0][1]
+                backlog[priority + ".oldest_ripe_age"] = age
+                backlog["oldest_ripe_age"] = max(
+                    backlog["oldest_ripe_age"], age
+                )
+        return backlog
+
     @concurrent.run_on_executor
-    def pop_ready_events(self):
+    def pop_ready_events(self, limit=-1):
+        """
+        Get and remove up to `limit` ripe events, oldest first (-1 for all)
+        """
         min_score = 0
         max_score = time.time()
 
@@ -115,13 +783,12 @@ class EventDao(redis.RedisSource):
 
         data = None
         try:
-            # get and remove ripe events in one swoop
-            pipe = self.client.pipeline(transaction=True)
-            pipe.zrangebyscore("event", min_score, max_score)
-            pipe.zremrangebyscore("event", min_score, max_score)
-
-            # returns array of results - one for each command in the pipe
-            data, _ = pipe.execute()
+            # get and remove ripe events with their payloads in one swoop
+            data = self._pop_script(
+                keys=[self.data_key] + self.lanes,
+                args=[min_score, max_score, self.batch_prefix]
+                + self._lane_quotas(limit),
+            )
         except RedisError as ex:
             logger.critical("Error getting events: %s", ex)
 
@@ -130,24 +797,33 @@ class EventDao(redis.RedisSource):
             return []
 
         events = []
-        logger.info("Found %d ripe events", len(data))
+        logger.info("Found %d ripe events", len(data) / 2)
 
         # unique event groups - they expire at the same time
         # and to be deleted once we send these events off to a farm upstate
         event_groups = set()
 
-        for rec in data:
-            # load JSON string from Redis
-            d = json.loads(rec)
-            # create an event object from the JSON dictionary we have
+        for event_id, payload in zip(data[::2], data[1::2]):
+            if payload:
+                d = self.decode(event_id, payload)
+            elif event_id.startswith("{"):
+                # legacy record, the whole JSON event is the zset member
+                d = json.loads(event_id)
+            else:
+                logger.error("No payload found for event %s", event_id)
+                continue
+
+            # create an event object from the dictionary we have
             event = models.Event() << d
+            event.popped_at = max_score
             logger.debug("Found event: %s", event.to_dict())
             events.append(event)
 
             # unique group key for this event, if grouped
-            group = d.get("group")
-            # add event group (to be deleted later)
-            if group:
+            group = d.get(constants.Event.GROUP)
+            # add event group (to be deleted later),
+            # batches are deleted when popped
+            if group and not group.startswith(self.batch_prefix):
                 logger.debug(
                     "Adding group %s to the set of GROUPS TO BE DELETED", group
                 )
@@ -161,3 +837,464 @@ class EventDao(redis.RedisSource):
                 logger.critical("Error deleting event groups", ex)
 
         return events
+
+
+class StreamEventDao(EventDao):
+    """
+    Events are scheduled like with EventDao, ripe events are then moved
+    to a stream that is read through a consumer group,
+    for at-least-once delivery
+    """
+
+    def __init__(self):
+        super(StreamEventDao, self).__init__()
+        self.stream_key = self.prefix + "stream"
+        self.consumer_group = conf["events"].get("consumer_group", "reactor")
+        self._has_group = False
+
+        self._feed_script = self.client.register_script(FEED_EVENTS_SCRIPT)
+
+    def _ensure_group(self):
+        if self._has_group:
+            return
+
+        version = self.client.info("server")["redis_version"]
+        if tuple(map(int, version.split(".")[:2])) < STREAM_REDIS_VERSION:
+            raise ResponseError(
+                "The stream backend needs Redis >= %s, got %s"
+                % (".".join(map(str, STREAM_REDIS_VERSION)), version)
+            )
+
+        try:
+            self.client.execute_command(
+                "XGROUP",
+                "CREATE",
+                self.stream_key,
+                self.consumer_group,
+                "0",
+                "MKSTREAM",
+            )
+        except ResponseError as ex:
+            # the group exists already
+            if "BUSYGROUP" not in str(ex):
+                raise
+
+        self._has_group = True
+
+    def _load_entries(self, entries):
+        """
+        Make events from stream entries, each event gets
+        the stream entry id it came with in `stream_id`
+        """
+        events = []
+        now = time.time()
+        for entry_id, fields in entries or []:
+            if not fields:
+                # deleted from the stream while pending
+                continue
+
+            fields = dict(zip(fields[::2], fields[1::2]))
+            event = models.Event() << self.decode(
+                fields["id"] or None, fields["payload"]
+            )
+            event.stream_id = entry_id
+            event.popped_at = now
+            events.append(event)
+
+        return events
+
+    @concurrent.run_on_executor
+    def feed_ready_events(self, limit=-1):
+        """
+        Move ripe events from the schedule to the stream
+        """
+        moved = 0
+        try:
+            moved = self._feed_script(
+                keys=[self.data_key, self.stream_key] + self.lanes,
+                args=[0, time.time(), self.batch_prefix]
+                + self._lane_quotas(limit),
+            )
+        except RedisError as ex:
+            logger.critical("Error feeding events to stream: %s", ex)
+
+        if moved:
+            logger.info("Moved %d ripe events to stream", moved)
+        return moved
+
+    @concurrent.run_on_executor
+    def read_events(self, consumer, count):
+        """
+        Read new events from the stream for `consumer`,
+        they stay pending until acknowledged
+        """
+        data = None
+        try:
+            self._ensure_group()
+            data = self.client.execute_command(
+                "XREADGROUP",
+                "GROUP",
+                self.consumer_group,
+                consumer,
+                "COUNT",
+                count,
+                "STREAMS",
+                self.stream_key,
+                ">",
+            )
+        except RedisError as ex:
+            logger.critical("Error reading events from stream: %s", ex)
+
+        if not data:
+            return []
+
+        # one stream: [[stream key, entries]]
+        events = self._load_entries(data[0][1])
+        logger.info("Read %d events from stream", len(events))
+        return events
+
+    @concurrent.run_on_executor
+    def claim_stalled_events(self, consumer, min_idle, count):
+        """
+        Claim events that have been pending for more than `min_idle` seconds
+        """
+        data = None
+        try:
+            self._ensure_group()
+            data = self.client.execute_command(
+                "XAUTOCLAIM",
+                self.stream_key,
+                self.consumer_group,
+                consumer,
+                int(min_idle * 1000),
+                "0-0",
+                "COUNT",
+                count,
+            )
+        except RedisError as ex:
+            logger.critical("Error claiming stalled events: %s", ex)
+
+        if not data:
+            return []
+
+        # [next start id, entries, (deleted ids)]
+        return self._load_entries(data[1])
+
+    def _get_backlog(self):
+        """
+        Like EventDao, with the number of events in the stream
+        and of those pending acknowledgement
+        """
+        backlog = super(StreamEventDao, self)._get_backlog()
+        backlog.update({"stream": None, "unacknowledged": None})
+
+        try:
+            self._ensure_group()
+            pipe = self.client.pipeline(transaction=False)
+            pipe.execute_command("XLEN", self.stream_key)
+            pipe.execute_command(
+                "XPENDING", self.stream_key, self.consumer_group
+            )
+            stream, pending = pipe.execute()
+        except RedisError as ex:
+            logger.critical("Error getting event stream backlog: %s", ex)
+            return backlog
+
+        backlog["stream"] = stream
+        # [count, smallest id, greatest id, consumers]
+        backlog["unacknowledged"] = pending[0]
+        return backlog
+
+    @concurrent.run_on_executor
+    def ack_events(self, stream_ids):
+        """
+        Acknowledge processed events and remove them from the stream
+        """
+        if not stream_ids:
+            return
+
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.execute_command(
+                    "XACK", self.stream_key, self.consumer_group, *stream_ids
+                )
+                pipe.execute_command("XDEL", self.stream_key, *stream_ids)
+                pipe.execute()
+        except RedisError as ex:
+            logger.critical(
+                "Error acknowledging %d events: %s", len(stream_ids), ex
+            )
+
+
+class TimerEventDao(object):
+    """
+    In-process event store, for single node installs and benchmarks.
+    Honors `ready_after`, grouping and dedup keys like EventDao,
+    with pending events kept in a timing wheel.
+    Events are lost when the process exits.
+    """
+
+    ID_SIZE = EventDao.ID_SIZE
+    DEDUP_TTL = EventDao.DEDUP_TTL
+
+    # seconds, resolution of the timing wheel
+    TICK = 0.1
+
+    def __init__(self):
+        tick = conf["events"].get("tick", self.TICK)
+        self.wheel = TimerWheel(tick=tick)
+
+        # group key => score shared by the group
+        self.groups = {}
+
+        # batch key => batch {"key", "first", "events": {event id => event}},
+        # batches are scheduled in the wheel as a whole
+        self.batches = {}
+        # event id => batch key
+        self.batched = {}
+
+        # dedup key => event id, expired with their own wheel
+        self.dedup_keys = {}
+        self.dedup_wheel = TimerWheel(tick=1)
+
+        # event id => dead event, oldest first
+        self.dead = OrderedDict()
+
+        # priority => events out of the wheel, not popped yet
+        self.ripe = {p: [] for p in PRIORITIES}
+
+    def _is_duplicate(self, dedup_key, dedup_ttl, event_id):
+        now = time.time()
+        for key in self.dedup_wheel.advance(now):
+            self.dedup_keys.pop(key, None)
+
+        if dedup_key in self.dedup_keys:
+            return True
+
+        self.dedup_keys[dedup_key] = event_id
+        self.dedup_wheel.add(
+            now
+            + (dedup_ttl or conf["events"].get("dedup_ttl", self.DEDUP_TTL)),
+            dedup_key,
+            dedup_key,
+        )
+        return False
+
+    @gen.coroutine
+    def create_event(
+        self, e, group_by=None, dedup_key=None, dedup_ttl=None, batching=None
+    ):
+        logger.debug("Creating event %s", e.to_dict())
+
+        assert e.ready_after is not None
+        assert e.handler
+        assert e.data
+
+        # copy the event object to avoid mutating the original
+        event = models.Event(
+            id=util.gen_random_string(size=self.ID_SIZE),
+            handler=e.handler,
+            ready_after=e.ready_after,
+            data=copy.deepcopy(e.data),
+            created_at=str(util.utc_time()),
+            priority=e.priority,
+        )
+
+        # groups don't span lanes
+        lane_suffix = (
+            ":" + e.priority
+            if e.priority and e.priority != constants.Jobs.NORMAL
+            else ""
+        )
+
+        if dedup_key:
+            is_duplicate = self._is_duplicate(dedup_key, dedup_ttl, event.id)
+            metrics.registry.counter(
+                "events.dedup.hits" if is_duplicate else "events.dedup.misses"
+            ).incr()
+
+            if is_duplicate:
+                logger.info(
+                    "Skipping duplicate event for dedup key %s", dedup_key
+                )
+                event.id = self.dedup_keys[dedup_key]
+                raise gen.Return(event)
+
+        now = time.time()
+        event.score = now + event.ready_after
+
+        if group_by and batching:
+            event.group = "event:batch:{}-{}-{}{}".format(
+                str(group_by), event.handler, event.ready_after, lane_suffix
+            )
+            self._add_to_batch(event, now, batching)
+            raise gen.Return(event)
+
+        if group_by:
+            # all events of a group expire at once
+            event.group = "event:group:{}-{}-{}{}".format(
+                str(group_by), event.handler, event.ready_after, lane_suffix
+            )
+            event.score = self.groups.setdefault(event.group, event.score)
+
+        self.wheel.add(event.score, event.id, event)
+        raise gen.Return(event)
+
+    def _add_to_batch(self, event, now, batching):
+        batch = self.batches.get(event.group)
+        if batch is None:
+            batch = {"key": event.group, "first": now, "events": OrderedDict()}
+            self.batches[event.group] = batch
+
+        batch["events"][event.id] = event
+        self.batched[event.id] = event.group
+
+        event.score = batch_ready_at(
+            batch["first"],
+            now,
+            event.ready_after,
+            len(batch["events"]),
+            batching,
+        )
+        self.wheel.add(event.score, event.group, batch)
+
+    @gen.coroutine
+    def cancel_event(self, event_id):
+        assert event_id
+
+        batch_key = self.batched.pop(event_id, None)
+        if batch_key is not None:
+            del self.batches[batch_key]["events"][event_id]
+            raise gen.Return(True)
+
+        raise gen.Return(self.wheel.cancel(event_id) is not None)
+
+    @gen.coroutine
+    def reschedule_event(self, event_id, ready_after):
+        assert event_id
+        assert ready_after is not None
+
+        if event_id in self.batched:
+            # goes with its batch
+            raise gen.Return(False)
+
+        event = self.wheel.cancel(event_id)
+        if event is None:
+            raise gen.Return(False)
+
+        # out of its group, see EventDao.reschedule_event
+        event.group = None
+        event.score = time.time() + ready_after
+        self.wheel.add(event.score, event.id, event)
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def retry_events(self, events, ready_after):
+        score = time.time() + ready_after
+        for event in events:
+            event.id = event.id or util.gen_random_string(size=self.ID_SIZE)
+            event.group = EventDao.retry_group(event.group)
+            event.score = score
+            self.wheel.add(score, event.id, event)
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def dead_letter_events(self, events):
+        for event in events:
+            event.id = event.id or util.gen_random_string(size=self.ID_SIZE)
+            self.dead[event.id] = event
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def get_dead_events(self, limit=100):
+        raise gen.Return(self.dead.values()[:limit])
+
+    @gen.coroutine
+    def redrive_dead_events(self, event_ids=None, limit=1000):
+        if event_ids is None:
+            event_ids = self.dead.keys()[:limit]
+
+        now = time.time()
+        moved = 0
+        for event_id in event_ids:
+            event = self.dead.pop(event_id, None)
+            if event is None:
+                continue
+            event.attempts = None
+            event.score = now
+            self.wheel.add(now, event.id, event)
+            moved += 1
+        raise gen.Return(moved)
+
+    @gen.coroutine
+    def get_backlog(self):
+        # events still in the wheel are only known to be ripe once popped
+        backlog = {p + ".ripe": len(events) for p, events in self.ripe.items()}
+        ripe = sum(backlog.values())
+        backlog.update(
+            {
+                "pending": len(self.wheel) + ripe,
+                "ripe": ripe,
+                "oldest_ripe_age": None,
+                "dead": len(self.dead),
+            }
+        )
+        raise gen.Return(backlog)
+
+    def _take_ripe(self, limit):
+        """
+        Take ripe events lane by lane, like EventDao (see take_ripe_lanes)
+        """
+        events = []
+
+        def take(priority, n):
+            lane = self.ripe[priority]
+            if n < 0:
+                n = len(lane)
+            events.extend(lane[:n])
+            self.ripe[priority] = lane[n:]
+            return min(n, len(lane))
+
+        left = 0
+        quotas = lane_quotas(limit, conf["events"].get("priority_weights"))
+        for priority, quota in zip(PRIORITIES, quotas):
+            if quota < 0:
+                take(priority, -1)
+            elif quota + left > 0:
+                left = quota + left - take(priority, quota + left)
+
+        for priority in PRIORITIES:
+            if left <= 0:
+                break
+            left -= take(priority, left)
+
+        return events
+
+    @gen.coroutine
+    def pop_ready_events(self, limit=-1):
+        now = time.time()
+        for item in self.wheel.advance(now):
+            if isinstance(item, dict):
+                # a batch
+                del self.batches[item["key"]]
+                for event_id in item["events"]:
+                    del self.batched[event_id]
+                items = item["events"].values()
+            else:
+                items = [item]
+
+            for event in items:
+                self.ripe[event.priority or constants.Jobs.NORMAL].append(
+                    event
+                )
+
+        events = self._take_ripe(limit)
+
+        for event in events:
+            event.popped_at = now
+            if event.group:
+                self.groups.pop(event.group, None)
+
+        if events:
+            logger.info("Found %d ripe events", len(events))
+        raise gen.Return(events)
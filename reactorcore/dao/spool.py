@@ -0,0 +1,333 @@
+"""
+Local disk spool for Redis writes, used while Redis is unavailable.
+
+A circuit breaker counts failed Redis writes. Once it opens, writes skip
+Redis and go straight to the spool, instead of waiting for the socket
+timeout. Spooled records are appended as JSON lines to a file per process,
+and replayed to Redis in batches by the reactor once it is back:
+
+    # in a DAO
+    spool.register_replayer("event", self._replay_events)
+
+    if not spool.breaker.allow():
+        spool.get_spool().append("event", {"keys": keys, "args": args})
+
+    # in the reactor, periodically
+    yield spool.get_spool().replay()
+"""
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from redis.exceptions import RedisError
+from tornado import concurrent
+
+from reactorcore import application
+from reactorcore import metrics
+
+logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+# record kind => function replaying a list of records, raises RedisError if
+# Redis failed, any other error for records that can't be replayed
+_replayers = {}
+
+
+def register_replayer(kind, func):
+    _replayers[kind] = func
+
+
+class CircuitBreaker(object):
+    """
+    Closed: calls go through. Opens after `threshold` failures in a row,
+    then calls are refused for `reset_timeout` seconds, after which one
+    trial call is let through (half open): it closes the breaker if it
+    succeeds, opens it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=3, reset_timeout=10):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if (
+                self.state == self.OPEN
+                and time.time() - self.opened_at >= self.reset_timeout
+            ):
+                # let one call through
+                self.state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.warning("Redis is back, closing circuit breaker")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.threshold
+            ):
+                logger.critical(
+                    "Redis unavailable, opening circuit breaker for %ss",
+                    self.reset_timeout,
+                )
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+
+class Spool(object):
+    """
+    Append-only files of JSON records in `directory`, one per process
+    (<pid>.spool). Replaying claims a file by renaming it (<pid>.replay),
+    records that could not be replayed because of Redis stay in the renamed
+    file, to be retried first next time. Records that can't be replayed at
+    all are moved to <pid>.dead.
+    """
+
+    # records replayed per Redis pipeline
+    BATCH_SIZE = 500
+
+    def __init__(self, directory, batch_size=None):
+        self.directory = directory
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        try:
+            os.makedirs(directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, "{}.spool".format(os.getpid()))
+
+    def append(self, kind, record):
+        """
+        Append a record to be replayed by the replayer for `kind`
+        """
+        line = json.dumps({"kind": kind, "record": record}) + "\n"
+
+        while True:
+            with open(self.path, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # the replayer may have claimed the file since we opened it
+                try:
+                    same = (
+                        os.fstat(f.fileno()).st_ino
+                        == os.stat(self.path).st_ino
+                    )
+                except OSError:
+                    same = False
+                if same:
+                    f.write(line)
+                    f.flush()
+                    break
+
+        metrics.registry.counter("spool.%s.spooled" % kind).incr()
+
+    def _glob(self, extension):
+        return sorted(glob.glob(os.path.join(self.directory, "*" + extension)))
+
+    def _claim(self):
+        """
+        Claim the spool files to replay
+        """
+        paths = []
+        for path in self._glob(".spool"):
+            claimed = path[: -len(".spool")] + ".replay"
+            if os.path.exists(claimed):
+                # the previous replay of this process' file is not done
+                continue
+            os.rename(path, claimed)
+            paths.append(claimed)
+
+        return paths
+
+    def _paths(self):
+        # left overs of previous replays first
+        for path in self._glob(".replay"):
+            yield path
+        for path in self._claim():
+            yield path
+
+    def _replay_file(self, path):
+        try:
+            f = open(path, "r+")
+        except IOError as ex:
+            if ex.errno == errno.ENOENT:
+                # replayed by another process
+                return 0, False
+            raise
+
+        with f:
+            # wait for appends still going on
+            fcntl.flock(f, fcntl.LOCK_EX)
+            lines = [l for l in f if l.strip()]
+
+            done = replayed = 0
+            dead = []
+            try:
+                while done < len(lines):
+                    batch = lines[done : done + self.batch_size]
+                    replayed += self._replay_batch(batch, dead)
+                    done += len(batch)
+            except RedisError as ex:
+                logger.critical("Error replaying spool %s: %s", path, ex)
+                failed = True
+            else:
+                failed = False
+            finally:
+                if dead:
+                    self._bury(path, dead)
+                # keep what's left for next time
+                f.seek(0)
+                f.truncate()
+                f.writelines(lines[done:])
+                f.flush()
+
+            if done == len(lines):
+                os.remove(path)
+
+        return replayed, failed
+
+    def _replay_batch(self, lines, dead):
+        """
+        Replay a batch of lines, adding the ones that can't be replayed
+        to `dead`. Returns the number of records replayed.
+        """
+        by_kind = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                by_kind.setdefault(entry["kind"], []).append(
+                    (line, entry["record"])
+                )
+            except (ValueError, TypeError, KeyError):
+                logger.critical("Bad spool record: %r", line)
+                dead.append(line)
+
+        replayed = 0
+        for kind, entries in by_kind.items():
+            replayer = _replayers.get(kind)
+            if replayer is None:
+                logger.critical("No spool replayer for %s", kind)
+                dead.extend(line for line, _ in entries)
+                continue
+
+            try:
+                replayer([record for _, record in entries])
+                done = len(entries)
+            except RedisError:
+                raise
+            except Exception:
+                # one at a time, to find the records that can't be replayed
+                done = 0
+                for line, record in entries:
+                    try:
+                        replayer([record])
+                        done += 1
+                    except RedisError:
+                        raise
+                    except Exception:
+                        logger.critical(
+                            "Error replaying %s record", kind, exc_info=True
+                        )
+                        dead.append(line)
+
+            metrics.registry.counter("spool.%s.replayed" % kind).incr(done)
+            replayed += done
+
+        return replayed
+
+    def _bury(self, path, lines):
+        """
+        Move records that can't be replayed out of the way, to <pid>.dead
+        """
+        with open(os.path.splitext(path)[0] + ".dead", "a") as f:
+            f.writelines(lines)
+        metrics.registry.counter("spool.dead").incr(len(lines))
+
+    @concurrent.run_on_executor
+    def replay(self):
+        """
+        Replay the spooled records to Redis, when the breaker lets us.
+        Returns the number of records replayed.
+        """
+        replayed = 0
+        if not self._glob(".spool") and not self._glob(".replay"):
+            return replayed
+
+        if not breaker.allow():
+            return replayed
+
+        failed = False
+        try:
+            for path in self._paths():
+                done, failed = self._replay_file(path)
+                replayed += done
+                if failed:
+                    breaker.failure()
+                    break
+            else:
+                breaker.success()
+        except Exception as ex:
+            # not Redis, records stay spooled until it's fixed
+            logger.critical("Error replaying spool: %s", ex, exc_info=True)
+
+        if replayed:
+            logger.info("Replayed %s spooled records", replayed)
+        return replayed
+
+
+# one breaker and one spool per process
+breaker = CircuitBreaker(
+    threshold=conf.get("spool", {}).get("breaker_threshold", 3),
+    reset_timeout=conf.get("spool", {}).get("breaker_reset_timeout", 10),
+)
+
+_spool = None
+
+
+def get_spool():
+    global _spool
+    if _spool is None:
+        _spool = Spool(
+            conf.get("spool", {}).get(
+                "directory",
+                os.path.join(tempfile.gettempdir(), "reactor-spool"),
+            ),
+            batch_size=conf.get("spool", {}).get("batch_size"),
+        )
+    return _spool
+
+
+def is_enabled():
+    return conf.get("spool", {}).get("enabled", True)
@@ -10,5 +10,25 @@ class ForbiddenError(Exception):
     status_code = 403
 
 
+class JobCancelled(Exception):
+    status_code = 500
+
+
+class JobFailed(Exception):
+    status_code = 500
+
+
 class NotFound(Exception):
     status_code = 404
+
+
+class TooManyRequests(Exception):
+    status_code = 429
+
+    def __init__(self, message, retry_after=None):
+        super(TooManyRequests, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class UnknownEventHandler(Exception):
+    status_code = 500
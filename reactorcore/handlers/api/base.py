@@ -1,4 +1,5 @@
 import logging
+import math
 import traceback
 import json
 
@@ -18,6 +19,10 @@ conf = application.get_conf()
 class BaseApiHandler(base.BaseRequestHandler):
     """API handler."""
 
+    # (calls, seconds): calls a client may make to the handler in any
+    # window of seconds, None for no limit
+    rate_limit = None
+
     def __init__(self, application, request, **kwargs):
         super(BaseApiHandler, self).__init__(application, request, **kwargs)
         self.data = {}
@@ -74,6 +79,7 @@ class BaseApiHandler(base.BaseRequestHandler):
         # let CORS preflight requests through
         if self.request.method != "OPTIONS":
             self.authenticate()
+            yield self.check_rate_limit()
 
     def log_request(self):
         masked_args = self._mask_unsafe_data(self.data)
@@ -129,6 +135,18 @@ class BaseApiHandler(base.BaseRequestHandler):
             self.write(response_data)
             return
 
+        if isinstance(ex, exception.TooManyRequests):
+            logger.warning(
+                "API request LIMITED [%s] for %s: %s",
+                self.request.id,
+                self.rate_limit_client(),
+                ex,
+            )
+            self.set_status(ex.status_code)
+            if ex.retry_after:
+                self.set_header("Retry-After", int(math.ceil(ex.retry_after)))
+            return
+
         if isinstance(ex, tornado.web.HTTPError):
             logger.warning(ex)
             self.set_status(ex.status_code)
@@ -167,6 +185,34 @@ class BaseApiHandler(base.BaseRequestHandler):
             )
             return
 
+    def rate_limit_client(self):
+        """
+        Who the rate limit counts the calls of: the user, else the IP
+        """
+        user_id = getattr(self.current_user, "id", None)
+        return user_id or self.request.remote_ip
+
+    @gen.coroutine
+    def check_rate_limit(self):
+        """
+        Raise TooManyRequests once the client made `rate_limit` calls to
+        the handler within its window
+        """
+        if not self.rate_limit:
+            return
+
+        limit, window = self.rate_limit
+        wait = yield self.app.service.ratelimit.hit(
+            "api:%s:%s" % (self.__class__.__name__, self.rate_limit_client()),
+            limit,
+            window,
+        )
+        if wait:
+            raise exception.TooManyRequests(
+                "Over %s calls in %s seconds" % (limit, window),
+                retry_after=wait,
+            )
+
     @gen.coroutine
     def login(self):
         """
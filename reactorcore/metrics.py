@@ -0,0 +1,170 @@
+"""
+In-process metrics registry.
+
+Services record their metrics in the module level `registry`:
+
+    from reactorcore import metrics
+
+    metrics.registry.counter("events.dedup.hits").incr()
+    metrics.registry.gauge("events.pending").set(120)
+    metrics.registry.histogram("events.handler.seconds").observe(0.2)
+
+    metrics.registry.snapshot()
+    => {"events.dedup.hits": 1, "events.pending": 120,
+        "events.handler.seconds": {"count": 1, "mean": 0.2, "p50": 0.2, ...}}
+
+Metrics are kept per process and are thread safe, since DAO calls
+run on executor threads.
+"""
+import bisect
+import threading
+
+
+class Counter(object):
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def incr(self, ticks=1):
+        with self._lock:
+            self.value += ticks
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(object):
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """
+    Counts observed values in fixed buckets, percentiles are
+    approximated by the upper bound of the bucket they fall in
+    """
+
+    # upper bounds of the buckets, in seconds
+    BUCKETS = (
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        30,
+        60,
+        300,
+        float("inf"),
+    )
+
+    def __init__(self, name, buckets=None):
+        self.name = name
+        self.buckets = buckets or self.BUCKETS
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            if not self.count:
+                return {"count": 0}
+
+            return {
+                "count": self.count,
+                "mean": self.sum / self.count,
+                "max": self.max,
+                "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95),
+                "p99": self.percentile(0.99),
+            }
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, cls):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name)
+                self._metrics[name] = metric
+
+        assert isinstance(metric, cls), "%s is not a %s" % (name, cls.__name__)
+        return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def histogram(self, name):
+        return self._get(name, Histogram)
+
+    def ratio(self, name, total_names):
+        """
+        Share of counter `name` in the sum of counters `total_names`,
+        None if nothing has been counted yet
+        """
+        total = sum(self.counter(n).value for n in total_names)
+        if not total:
+            return None
+        return float(self.counter(name).value) / total
+
+    def snapshot(self, prefix=None):
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return {
+            m.name: m.snapshot()
+            for m in metrics
+            if not prefix or m.name.startswith(prefix)
+        }
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+
+# one registry per process
+registry = Registry()
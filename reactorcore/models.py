@@ -111,30 +111,43 @@ class Event(Model):
         data=None,
         group=None,
         created_at=None,
+        id=None,
+        attempts=None,
+        priority=None,
     ):
-        super(Event, self).__init__()
+        super(Event, self).__init__(id=id)
         self.data = data
         self.group = group
         self.handler = handler
         self.ready_after = ready_after
         self.created_at = created_at
+        # failed handler calls so far
+        self.attempts = attempts
+        # constants.Jobs.HIGH/NORMAL/LOW, None for normal
+        self.priority = priority
 
     def to_dict(self, keys=None):
         return {
+            constants.Event.ID: self.id,
             constants.Event.DATA: self.data,
             constants.Event.GROUP: self.group,
             constants.Event.HANDLER: self.handler,
             constants.Event.READY_AFTER: self.ready_after,
             constants.Event.CREATED_AT: self.created_at,
+            constants.Event.ATTEMPTS: self.attempts,
+            constants.Event.PRIORITY: self.priority,
         }
 
     def from_dict(self, d):
         return Event(
+            id=d.get(constants.Event.ID),
             data=d.get(constants.Event.DATA),
             group=d.get(constants.Event.GROUP),
             handler=d.get(constants.Event.HANDLER),
             ready_after=d.get(constants.Event.READY_AFTER),
             created_at=d.get(constants.Event.CREATED_AT),
+            attempts=d.get(constants.Event.ATTEMPTS),
+            priority=d.get(constants.Event.PRIORITY),
         )
 
     def __str__(self):
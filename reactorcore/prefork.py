@@ -0,0 +1,175 @@
+"""
+Prefork native workers: build the application once, then fork the worker
+processes, which share its loaded modules copy-on-write.
+
+    prefork = PreforkWorker(processes=4, max_jobs=1000)
+    prefork.run()
+
+Each child runs a NativeWorker on an IOLoop of its own. Once it took
+`max_jobs` jobs it finishes them and exits, and a fresh fork replaces it, so
+memory creeping up in a long-lived process is given back.
+
+The parent only forks and waits. It must not run anything on the
+application: executor threads and IOLoops don't survive a fork, the children
+start their own on first use.
+"""
+from __future__ import absolute_import
+
+import errno
+import importlib
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import time
+
+from tornado.ioloop import IOLoop
+
+from reactorcore import application
+from reactorcore import worker
+
+logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+
+class PreforkWorker(object):
+    # jobs a child takes before it is replaced, 0 to keep it
+    MAX_JOBS = 1000
+
+    # seconds before replacing a child that failed, not to fork in a loop
+    RESPAWN_DELAY = 1
+
+    def __init__(
+        self,
+        processes=None,
+        queue_names=None,
+        concurrency=None,
+        max_jobs=None,
+        preload=None,
+    ):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.queue_names = queue_names
+        self.concurrency = concurrency
+        self.max_jobs = (
+            conf["jobs"].get("max_jobs_per_child", self.MAX_JOBS)
+            if max_jobs is None
+            else max_jobs
+        )
+        # modules the jobs need, imported once before forking
+        self.preload = (
+            conf["jobs"].get("preload", []) if preload is None else preload
+        )
+
+        self.pid = None
+        self.children = set()
+        self._stopping = False
+
+    def load(self):
+        """
+        Import the modules and build the application, for all the children
+        """
+        for name in self.preload:
+            importlib.import_module(name)
+        application.get_application()
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            logger.info("Started worker %s", pid)
+            self.children.add(pid)
+            return
+
+        code = 1
+        try:
+            self._run_child()
+            code = 0
+        except Exception:
+            logger.critical(
+                "[EXCEPTION] Worker %s failed", os.getpid(), exc_info=True
+            )
+        finally:
+            # not the parent's exit handlers
+            os._exit(code)
+
+    def _run_child(self):
+        random.seed()
+
+        IOLoop.clear_current()
+        loop = IOLoop()
+        loop.make_current()
+
+        native_worker = worker.NativeWorker(
+            self.queue_names,
+            concurrency=self.concurrency,
+            max_jobs=self.max_jobs,
+        )
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(
+                signum,
+                lambda *args: loop.add_callback_from_signal(
+                    native_worker.stop
+                ),
+            )
+
+        if self._stopping:
+            # signaled before it had its own handlers
+            native_worker.stop()
+
+        loop.run_sync(native_worker.work)
+
+    def run(self):
+        """
+        Keep `processes` children running until stopped, then wait for
+        them to finish their jobs
+        """
+        self.pid = os.getpid()
+        self.load()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: self.stop())
+
+        logger.info(
+            "Prefork worker started, %s processes of %s jobs",
+            self.processes,
+            self.max_jobs or "unlimited",
+        )
+
+        while True:
+            while not self._stopping and len(self.children) < self.processes:
+                self.spawn()
+            if not self.children:
+                break
+
+            try:
+                pid, status = os.wait()
+            except OSError as ex:
+                # interrupted by a signal
+                if ex.errno == errno.EINTR:
+                    continue
+                raise
+
+            self.children.discard(pid)
+            if os.WIFEXITED(status) and not os.WEXITSTATUS(status):
+                logger.info("Worker %s exited", pid)
+            else:
+                logger.critical("Worker %s exited with %s", pid, status)
+                if not self._stopping:
+                    time.sleep(self.RESPAWN_DELAY)
+
+        logger.info("Prefork worker stopped")
+
+    def stop(self):
+        """
+        Stop the children, they exit once their running jobs are done
+        """
+        self._stopping = True
+        if os.getpid() != self.pid:
+            # a child, still with the handlers of the parent
+            return
+
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError as ex:
+                if ex.errno != errno.ESRCH:
+                    raise
@@ -0,0 +1,101 @@
+"""
+Compare the throughput of the sorted set and the stream event backends
+against the configured Redis. Uses its own keys, and removes them when done.
+
+    python -m reactorcore.scripts.event_benchmark -n 10000 -b 1000
+"""
+import time
+from optparse import OptionParser
+from tornado import gen, ioloop
+
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import models
+from reactorcore.dao import event as event_dao
+
+parser = OptionParser()
+parser.add_option("-n", "--events", dest="events", type="int", default=10000)
+parser.add_option("-b", "--batch", dest="batch", type="int", default=1000)
+
+options, _ = parser.parse_args()
+
+
+def use_bench_keys(dao):
+    dao.schedule_key = "bench:event"
+    dao.data_key = "bench:event:data"
+    dao.stream_key = "bench:event:stream"
+    return dao
+
+
+def report(name, count, started):
+    elapsed = time.time() - started
+    print(
+        "{:<32} {:>8} events {:>8.3f}s {:>10.0f} events/s".format(
+            name, count, elapsed, count / elapsed if elapsed else 0
+        )
+    )
+
+
+@gen.coroutine
+def create_events(dao, name):
+    started = time.time()
+    for i in range(options.events):
+        yield dao.create_event(
+            models.Event(
+                handler="app.service.bench.handler",
+                ready_after=0,
+                data={"i": i, "text": "x" * 64},
+            )
+        )
+    report(name + " create", options.events, started)
+
+
+@gen.coroutine
+def bench_zset():
+    dao = use_bench_keys(event_dao.EventDao())
+    yield create_events(dao, "zset")
+
+    started = time.time()
+    events = yield dao.pop_ready_events()
+    report("zset pop", len(events), started)
+
+
+@gen.coroutine
+def bench_stream():
+    dao = use_bench_keys(event_dao.StreamEventDao())
+    dao.consumer_group = "bench"
+    yield create_events(dao, "stream")
+
+    started = time.time()
+    moved = yield dao.feed_ready_events()
+    report("stream feed", moved, started)
+
+    started = time.time()
+    count = 0
+    while True:
+        events = yield dao.read_events("bench", options.batch)
+        if not events:
+            break
+        yield dao.ack_events([e.stream_id for e in events])
+        count += len(events)
+    report("stream read + ack", count, started)
+
+
+@gen.coroutine
+def main():
+    print("Benchmarking {} events".format(options.events))
+    print("-------------------")
+    client = event_dao.EventDao().client
+    try:
+        yield bench_zset()
+        yield bench_stream()
+    finally:
+        client.delete("bench:event", "bench:event:data", "bench:event:stream")
+
+
+if __name__ == "__main__":
+    ioloop.IOLoop.instance().run_sync(main)
@@ -0,0 +1,40 @@
+"""
+Run jobs on one IOLoop, many at once, instead of a process per job.
+
+    python -m reactorcore.scripts.native_worker -c 50 high normal low
+
+Stops taking jobs on SIGTERM or SIGINT, and exits once the running jobs
+are done.
+"""
+import signal
+from optparse import OptionParser
+from tornado import ioloop
+
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import worker
+
+parser = OptionParser(usage="%prog [options] [queue ...]")
+parser.add_option("-c", "--concurrency", dest="concurrency", type="int")
+
+options, queue_names = parser.parse_args()
+
+
+if __name__ == "__main__":
+    application.get_application()
+    native_worker = worker.NativeWorker(
+        queue_names or None, concurrency=options.concurrency
+    )
+
+    loop = ioloop.IOLoop.instance()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(
+            signum,
+            lambda *args: loop.add_callback_from_signal(native_worker.stop),
+        )
+
+    loop.run_sync(native_worker.work)
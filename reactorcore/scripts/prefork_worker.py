@@ -0,0 +1,34 @@
+"""
+Build the application once, and fork native workers sharing it.
+
+    python -m reactorcore.scripts.prefork_worker -p 4 -m 1000 high normal low
+
+A worker is replaced once it took `-m` jobs (conf["jobs"]["max_jobs_per_child"],
+0 for no limit). On SIGTERM or SIGINT the workers finish their running jobs,
+and the launcher exits once they are all gone.
+"""
+from optparse import OptionParser
+
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import prefork
+
+parser = OptionParser(usage="%prog [options] [queue ...]")
+parser.add_option("-p", "--processes", dest="processes", type="int")
+parser.add_option("-c", "--concurrency", dest="concurrency", type="int")
+parser.add_option("-m", "--max-jobs", dest="max_jobs", type="int")
+
+options, queue_names = parser.parse_args()
+
+
+if __name__ == "__main__":
+    prefork.PreforkWorker(
+        processes=options.processes,
+        queue_names=queue_names or None,
+        concurrency=options.concurrency,
+        max_jobs=options.max_jobs,
+    ).run()
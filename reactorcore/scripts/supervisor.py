@@ -0,0 +1,62 @@
+"""
+Start and stop native workers with the depth and age of the job queues.
+
+    python -m reactorcore.scripts.supervisor --min 1 --max 8 high normal low
+
+The scaling policy is set in conf["jobs"]["autoscale"], the options take
+precedence. On SIGTERM or SIGINT the workers are drained, and the
+supervisor exits once they are all gone.
+"""
+import signal
+from optparse import OptionParser
+from tornado import gen, ioloop
+
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import supervisor
+
+parser = OptionParser(usage="%prog [options] [queue ...]")
+parser.add_option("--min", dest="min_workers", type="int")
+parser.add_option("--max", dest="max_workers", type="int")
+parser.add_option(
+    "-i", "--interval", dest="interval", type="int", default=5000
+)
+
+options, queue_names = parser.parse_args()
+
+
+@gen.coroutine
+def drain(sup, checker):
+    checker.stop()
+    sup.stop()
+    while sup.draining:
+        yield gen.sleep(1)
+        sup.reap()
+    ioloop.IOLoop.instance().stop()
+
+
+if __name__ == "__main__":
+    policy_conf = dict(conf["jobs"].get("autoscale", {}))
+    for option in ("min_workers", "max_workers"):
+        if getattr(options, option):
+            policy_conf[option] = getattr(options, option)
+
+    sup = supervisor.Supervisor(
+        supervisor.ScalingPolicy(**policy_conf), queue_names or None
+    )
+
+    loop = ioloop.IOLoop.instance()
+    checker = ioloop.PeriodicCallback(sup.check, options.interval)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(
+            signum,
+            lambda *args: loop.add_callback_from_signal(drain, sup, checker),
+        )
+
+    loop.add_callback(sup.check)
+    checker.start()
+    loop.start()
@@ -7,6 +7,7 @@ import tornado.ioloop
 from reactorcore import application
 from reactorcore import urls
 from reactorcore import services
+from reactorcore.dao import spool
 
 
 def start_server(app=None):
@@ -23,6 +24,9 @@ def start_server(app=None):
         application.configure(conf)
         app = application.get_application()
 
+    # fail early on event handlers that can't be resolved
+    app.service.event.check_handlers()
+
     http_server = tornado.httpserver.HTTPServer(app)
     http_server.listen(app.conf["application"]["port"])
 
@@ -32,6 +36,19 @@ def start_server(app=None):
         app.conf["events"]["polling_interval"],
     ).start()
 
+    # debounced jobs
+    tornado.ioloop.PeriodicCallback(
+        app.service.jobs.queue_delayed_jobs,
+        app.conf["jobs"].get("delayed_interval", 1000),
+    ).start()
+
+    # writes spooled while Redis was unavailable
+    if spool.is_enabled():
+        tornado.ioloop.PeriodicCallback(
+            spool.get_spool().replay,
+            app.conf.get("spool", {}).get("replay_interval", 1000 * 5),
+        ).start()
+
     # cron scheduled jobs check
     tornado.ioloop.PeriodicCallback(
         app.service.scheduler.check_scheduled_tasks,
@@ -1,30 +1,130 @@
 import logging
+import os
+import time
 from abc import ABCMeta, abstractmethod
 
 from tornado import gen
+from tornado import locks
 
+from reactorcore import application
+from reactorcore import exception
+from reactorcore import metrics
+from reactorcore import models
 from reactorcore import util
 from reactorcore.dao import event as event_dao
 from reactorcore.services import base, jobs
 
 logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+# Dispatch table, handler name => handler function
+_handlers = {}
+
+# handler name => max number of calls running at once
+_handler_concurrency = {}
+
+# handler name => batching policy for grouped events
+_handler_batching = {}
+
+
+def register_handler(name, func, concurrency=None, batching=None):
+    """
+    Register `func` as the handler for events created with handler `name`.
+    Handlers get called with a list of events and should return a Future.
+
+    `concurrency` limits how many calls of this handler run at once
+    (eg. 1 for handlers that are not safe to run in parallel)
+
+    `batching` is the policy for the groups of events of this handler,
+    a dict with any of:
+        max_batch: events per handler call, a group that reaches it
+                   is ripe right away
+        min_wait: seconds a group waits after its last event
+        max_wait: seconds a group waits at most after its first event
+    """
+    assert name
+    assert callable(func)
+
+    if name in _handlers and _handlers[name] is not func:
+        logger.warning("Replacing event handler %s", name)
+
+    _handlers[name] = func
+    if concurrency:
+        _handler_concurrency[name] = concurrency
+    if batching:
+        _handler_batching[name] = batching
+
+
+def event_handler(name, concurrency=None, batching=None):
+    """
+    Decorator registering an event handler
+
+        @event.event_handler("item.posted")
+        @gen.coroutine
+        def item_posted(events):
+            ...
+
+        yield app.service.event.create_event(
+            Event(handler="item.posted", ready_after=60, data={...}))
+    """
+
+    def decorator(func):
+        register_handler(
+            name, func, concurrency=concurrency, batching=batching
+        )
+        return func
+
+    return decorator
 
 
 class AbstractEventService(object):
     __metaclass__ = ABCMeta
 
+    # default number of event handlers running at once
+    CONCURRENCY = 10
+
+    # default seconds between event stats in the logs
+    STATS_INTERVAL = 60
+
+    # default handler calls for an event before it is moved to the dead set
+    MAX_ATTEMPTS = 5
+
+    # default seconds before the first retry, doubled for every next one
+    RETRY_BACKOFF = 30
+
+    # longest wait between retries
+    MAX_RETRY_DELAY = 60 * 60 * 6
+
     @abstractmethod
     def queue_ready_events(self):
         pass
 
     @abstractmethod
-    def create_event(self, event, group_by=None):
+    def create_event(
+        self, event, group_by=None, dedup_key=None, dedup_ttl=None
+    ):
+        pass
+
+    @abstractmethod
+    def cancel_event(self, event_id):
+        pass
+
+    @abstractmethod
+    def reschedule_event(self, event_id, ready_after):
         pass
 
     @gen.coroutine
     def process_events(self, events=None):
         """
         Process events that are ripe as of most recently.
+
+        Handlers run concurrently, up to `conf["events"]["concurrency"]`
+        at once. The limit for a handler can be lowered when registering it,
+        or with `conf["events"]["handler_concurrency"]`,
+        eg. {'app.service.mail.digest_handler': 1}
+
+        A failing handler does not stop the rest of the batch.
+        Returns a list of (handler, events) for the failed handler calls.
         """
         logger.debug("Processing %s events", len(events))
 
@@ -39,24 +139,149 @@ class AbstractEventService(object):
          Any event in group None should be processed separately,
          - these events do not belong to a bundle
         """
-        for e in event_groups.pop(None, {}).get("events", []):
-            func = self._get_event_handler(e.handler)
-            if not func:
-                continue
-            yield func([e])
+        calls = [
+            (e.handler, [e])
+            for e in event_groups.pop(None, {}).get("events", [])
+        ]
 
         """
         The rest of the groups are not None, they are valid,
-        and events in these groups are processed in one go
+        and events in these groups are processed in one go,
+        or in chunks of the handler's max batch size
         """
         for group_id, d in event_groups.items():
-            handler = d["handler"]
-            grouped_events = d["events"]
             logger.debug("Processing events for group %s", group_id)
-            func = self._get_event_handler(handler)
-            if not func:
-                continue
-            yield func(grouped_events)
+            max_batch = self.get_batching(d["handler"]).get("max_batch")
+            group_events = d["events"]
+            step = max_batch or len(group_events)
+            calls.extend(
+                (d["handler"], group_events[i : i + step])
+                for i in range(0, len(group_events), step)
+            )
+
+        semaphore = locks.Semaphore(
+            conf["events"].get("concurrency", self.CONCURRENCY)
+        )
+
+        handler_limits = dict(_handler_concurrency)
+        handler_limits.update(conf["events"].get("handler_concurrency", {}))
+        handler_semaphores = {
+            handler: locks.Semaphore(limit)
+            for handler, limit in handler_limits.items()
+        }
+
+        results = yield gen.multi(
+            [
+                self._run_event_handler(
+                    handler,
+                    handler_events,
+                    semaphore,
+                    handler_semaphores.get(handler),
+                )
+                for handler, handler_events in calls
+            ]
+        )
+
+        failed = [call for call, ok in zip(calls, results) if not ok]
+        if failed:
+            logger.error(
+                "%s of %s event handler calls failed", len(failed), len(calls)
+            )
+
+        self.log_stats()
+        raise gen.Return(failed)
+
+    @gen.coroutine
+    def _run_event_handler(
+        self, handler, events, semaphore, handler_semaphore=None
+    ):
+        """
+        Call the handler once a slot is free, returns False if it failed
+        """
+        if handler_semaphore:
+            # wait for the handler's own slot first, so that we don't hold
+            # a slot of the batch while other calls could use it
+            yield handler_semaphore.acquire()
+
+        try:
+            with (yield semaphore.acquire()):
+                started = time.time()
+                self._record_start_latency(events, started)
+
+                func = self._get_event_handler(handler)
+                if func:
+                    yield func(events)
+
+                metrics.registry.histogram(
+                    "events.handler.%s.seconds" % handler
+                ).observe(time.time() - started)
+        except Exception as ex:
+            logger.critical(
+                "[EXCEPTION] Event handler %s failed for %s events: %s",
+                handler,
+                len(events),
+                ex,
+                exc_info=True,
+            )
+            metrics.registry.counter(
+                "events.handler.%s.failures" % handler
+            ).incr()
+            raise gen.Return(False)
+        finally:
+            if handler_semaphore:
+                handler_semaphore.release()
+
+        raise gen.Return(True)
+
+    def get_batching(self, handler):
+        """
+        Batching policy for the groups of events of `handler`, as registered
+        or set in `conf["events"]["batching"]`, {} for none
+        """
+        return (
+            conf["events"]
+            .get("batching", {})
+            .get(handler, _handler_batching.get(handler, {}))
+        )
+
+    def retry_delay(self, attempts):
+        """
+        Seconds to wait before calling a handler again after
+        `attempts` failed calls
+        """
+        backoff = conf["events"].get("retry_backoff", self.RETRY_BACKOFF)
+        return min(backoff * 2 ** (attempts - 1), self.MAX_RETRY_DELAY)
+
+    def _record_start_latency(self, events, started):
+        """
+        Time from popping the events to their handler starting
+        """
+        histogram = metrics.registry.histogram("events.pop_to_start.seconds")
+        for e in events:
+            popped_at = getattr(e, "popped_at", None)
+            if popped_at is not None:
+                histogram.observe(started - popped_at)
+                metrics.registry.histogram(
+                    "events.pop_to_start.%s.seconds"
+                    % (e.priority or jobs.Jobs.NORMAL)
+                ).observe(started - popped_at)
+
+    def log_stats(self, interval=None):
+        """
+        Log a summary of the event metrics of this process,
+        at most every `interval` seconds (`conf["events"]["stats_interval"]`)
+        """
+        interval = (
+            conf["events"].get("stats_interval", self.STATS_INTERVAL)
+            if interval is None
+            else interval
+        )
+        now = time.time()
+        if now - getattr(self, "_stats_logged_at", 0) < interval:
+            return
+
+        self._stats_logged_at = now
+        logger.info("Event stats: %s", metrics.registry.snapshot("events."))
 
     @staticmethod
     def group_events(events):
@@ -83,87 +308,385 @@ class AbstractEventService(object):
 
         return groups
 
+    @staticmethod
+    def split_events(events, chunk_size):
+        """
+        Split events into batches that can be processed independently:
+        one batch per event group, ungrouped events in chunks of chunk_size.
+        """
+        event_groups = AbstractEventService.group_events(events)
+        ungrouped = event_groups.pop(None, {}).get("events", [])
+
+        batches = [d["events"] for d in event_groups.values()]
+        batches.extend(
+            ungrouped[i : i + chunk_size]
+            for i in range(0, len(ungrouped), chunk_size)
+        )
+        return batches
+
     def _get_event_handler(self, handler):
         """
-        Dynamically access handler from self.app
+        Look up the handler in the dispatch table. Handlers that were not
+        registered are resolved from self.app the first time they are used.
 
         Args:
-            handler: a string starting with app. giving the path to handler
+            handler: a registered handler name, or a string starting
+            with app. giving the path to handler
             eg.
                 'app.service.item_events.item_posted_event_handler'
         """
         assert handler
 
+        func = _handlers.get(handler)
+        if func is not None:
+            return func
+
         obj = self
-        for attr in handler.split("."):
-            obj = getattr(obj, attr)
+        try:
+            for attr in handler.split("."):
+                obj = getattr(obj, attr)
+        except AttributeError:
+            raise exception.UnknownEventHandler(
+                "Unknown event handler: `{}`".format(handler)
+            )
+
+        _handlers[handler] = obj
         return obj
 
+    def check_handlers(self, handlers=None):
+        """
+        Resolve the handlers in `conf["events"]["handlers"]` (and `handlers`)
+        into the dispatch table, raises UnknownEventHandler listing
+        the ones that can't be found. Called at startup.
+        """
+        handlers = list(handlers or []) + conf["events"].get("handlers", [])
+
+        unknown = []
+        for handler in handlers:
+            try:
+                self._get_event_handler(handler)
+            except exception.UnknownEventHandler:
+                unknown.append(handler)
+
+        if unknown:
+            raise exception.UnknownEventHandler(
+                "Unknown event handlers: {}".format(", ".join(unknown))
+            )
+
+        logger.info("Event handlers: %s", ", ".join(sorted(_handlers)))
+
 
 class EventService(base.BaseService, AbstractEventService):
+    DAO_CLASS = event_dao.EventDao
+
+    # ungrouped events per job, when fanning out
+    FAN_OUT_CHUNK_SIZE = 100
+
+    # events popped per batch
+    BATCH_SIZE = 1000
+
+    # batches popped and being enqueued at once
+    PUMP_STAGES = 2
+
     def __init__(self):
         super(EventService, self).__init__()
 
-        self.DAO = event_dao.EventDao()
-        self._lock = False
+        self.DAO = self.DAO_CLASS()
+        self._pumping = False
+        self._pump_requested = False
+        self._backlog_updated_at = 0
 
     @gen.coroutine
     def queue_ready_events(self):
-        if self._lock:
+        """
+        Pump ripe events to the job queue. Called on every polling tick,
+        a tick while the pump is running makes it go another round
+        rather than being dropped.
+        """
+        if self._pumping:
+            self._pump_requested = True
             return
 
-        self._lock = True
+        self._pumping = True
 
         try:
-            yield self._queue_ready_events()
+            while True:
+                self._pump_requested = False
+                yield self._queue_ready_events()
+                if not self._pump_requested:
+                    break
+
+            yield self._update_backlog()
         finally:
-            self._lock = False
+            self._pumping = False
+
+    @gen.coroutine
+    def _update_backlog(self):
+        """
+        Refresh the backlog gauges and log the event stats, when it's time
+        """
+        now = time.time()
+        interval = conf["events"].get("stats_interval", self.STATS_INTERVAL)
+        if now - self._backlog_updated_at >= interval:
+            self._backlog_updated_at = now
+            backlog = yield self.get_backlog()
+            logger.info("Event backlog: %s", backlog)
+
+        self.log_stats()
+
+    @gen.coroutine
+    def get_backlog(self):
+        """
+        Pending and ripe event counts, and age of the oldest ripe event,
+        also kept in the `events.backlog.*` gauges
+        """
+        backlog = yield self.DAO.get_backlog()
+        for name, value in backlog.items():
+            metrics.registry.gauge("events.backlog." + name).set(value)
+        raise gen.Return(backlog)
 
     @gen.coroutine
     def _queue_ready_events(self):
-        events = yield self.DAO.pop_ready_events()
+        """
+        Pop ripe events in batches of `conf["events"]["batch_size"]`, the next
+        batch is popped while the previous ones are being enqueued, with up to
+        `conf["events"]["pump_stages"]` batches in flight.
+        Stops when no full batch is left, or when the job queue holds
+        `conf["events"]["max_queue_depth"]` jobs or more.
+        """
+        batch_size = conf["events"].get("batch_size", self.BATCH_SIZE)
+        stages = locks.Semaphore(
+            conf["events"].get("pump_stages", self.PUMP_STAGES)
+        )
+
+        in_flight = []
+        while True:
+            yield stages.acquire()
 
-        if not events:
+            backed_up = yield self._is_backed_up()
+            events = []
+            if not backed_up:
+                events = yield self._pop_events(batch_size)
+
+            if not events:
+                stages.release()
+                break
+
+            in_flight.append(self._enqueue_stage(events, stages))
+            if len(events) < batch_size:
+                break
+
+        yield gen.multi(in_flight)
+
+    @gen.coroutine
+    def _pop_events(self, limit):
+        events = yield self.DAO.pop_ready_events(limit=limit)
+        raise gen.Return(events)
+
+    @gen.coroutine
+    def _enqueue_stage(self, events, stages):
+        try:
+            yield self._enqueue_events(events)
+        finally:
+            stages.release()
+
+    @gen.coroutine
+    def _is_backed_up(self):
+        """
+        True if the job queues are too deep to add more events to them
+        """
+        max_depth = conf["events"].get("max_queue_depth")
+        if not max_depth:
+            raise gen.Return(False)
+
+        depths = yield [
+            self.app.service.jobs.get_queue_depth(priority)
+            for priority in event_dao.PRIORITIES
+        ]
+        depth = sum(d for d in depths if d is not None)
+        metrics.registry.gauge("events.pump.queue_depth").set(depth)
+
+        if depth >= max_depth:
+            logger.warning(
+                "Job queues hold %s jobs, not queueing more events", depth
+            )
+            metrics.registry.counter("events.pump.backed_up").incr()
+            raise gen.Return(True)
+
+        raise gen.Return(False)
+
+    @gen.coroutine
+    def _enqueue_events(self, events):
+        """
+        Enqueue events on the job queue of their priority
+        """
+        by_priority = {}
+        for e in events:
+            by_priority.setdefault(e.priority or jobs.Jobs.NORMAL, []).append(
+                e
+            )
+
+        yield [
+            self._enqueue_lane(lane_events, priority)
+            for priority, lane_events in by_priority.items()
+        ]
+
+    @gen.coroutine
+    def _enqueue_lane(self, events, priority):
+        if not conf["events"].get("fan_out"):
+            yield self.app.service.jobs.add(
+                func=self.process_events,
+                kwargs={"events": events},
+                priority=priority,
+            )
             return
 
-        yield self.app.service.jobs.add(
-            func=self.process_events,
-            kwargs={"events": events},
-            priority=jobs.Jobs.NORMAL,
+        """
+        Fan out: one job per event group and per chunk of ungrouped events,
+        so that the batch is spread over the worker pool
+        """
+        batches = self.split_events(
+            events,
+            conf["events"].get("fan_out_chunk_size", self.FAN_OUT_CHUNK_SIZE),
+        )
+        logger.debug(
+            "Fanning out %s events to %s jobs", len(events), len(batches)
+        )
+
+        yield self.app.service.jobs.add_many(
+            [
+                (self.process_events, None, {"events": batch})
+                for batch in batches
+            ],
+            priority=priority,
         )
 
     @gen.coroutine
-    def create_event(self, event, group_by=None):
+    def create_event(
+        self, event, group_by=None, dedup_key=None, dedup_ttl=None
+    ):
         assert event.handler
         assert event.data
         assert event.ready_after is not None
 
-        logger.debug("Creating event %s group by %s", event, group_by)
+        assert event.priority in (None,) + event_dao.PRIORITIES
+
+        # fail here rather than in the worker processing the event
+        self._get_event_handler(event.handler)
 
-        event = yield self.DAO.create_event(event, group_by=group_by)
+        logger.debug(
+            "Creating event %s group by %s dedup key %s",
+            event,
+            group_by,
+            dedup_key,
+        )
+
+        event = yield self.DAO.create_event(
+            event,
+            group_by=group_by,
+            dedup_key=dedup_key,
+            dedup_ttl=dedup_ttl,
+            batching=self.get_batching(event.handler) if group_by else None,
+        )
         raise gen.Return(event)
 
-    def _get_event_handler(self, handler):
+    def get_dedup_stats(self):
+        """
+        Dedup hits/misses for events created by this process
         """
-        Dynamically access handler from self.app
+        names = ["events.dedup.hits", "events.dedup.misses"]
+        return {
+            "hits": metrics.registry.counter(names[0]).value,
+            "misses": metrics.registry.counter(names[1]).value,
+            "hit_rate": metrics.registry.ratio(names[0], names),
+        }
 
-        Args:
-            handler: a string starting with app. giving the path to handler
-            eg.
-                'app.service.item_events.item_posted_event_handler'
+    @gen.coroutine
+    def retry_failed_events(self, failed):
         """
-        assert handler
+        Schedule the events of failed handler calls again, with exponential
+        backoff. After `conf["events"]["max_attempts"]` failed calls
+        they are moved to the dead set.
+        Returns the events that could not be stored.
+        """
+        max_attempts = conf["events"].get("max_attempts", self.MAX_ATTEMPTS)
+
+        lost = []
+        for handler, events in failed:
+            attempts = max(e.attempts or 0 for e in events) + 1
+            for e in events:
+                e.attempts = attempts
+
+            if attempts >= max_attempts:
+                logger.error(
+                    "Event handler %s failed %s times, "
+                    "moving %s events to the dead set",
+                    handler,
+                    attempts,
+                    len(events),
+                )
+                stored = yield self.DAO.dead_letter_events(events)
+                metrics.registry.counter("events.dead").incr(len(events))
+            else:
+                delay = self.retry_delay(attempts)
+                logger.warning(
+                    "Retrying %s events for handler %s in %s seconds",
+                    len(events),
+                    handler,
+                    delay,
+                )
+                stored = yield self.DAO.retry_events(events, delay)
+                metrics.registry.counter("events.retried").incr(len(events))
+
+            if not stored:
+                lost.extend(events)
+
+        raise gen.Return(lost)
 
-        obj = self
-        for attr in handler.split("."):
-            obj = getattr(obj, attr)
-        return obj
+    @gen.coroutine
+    def get_dead_events(self, limit=100):
+        """
+        The oldest `limit` events in the dead set,
+        `attempts` tells how many times their handler failed
+        """
+        events = yield self.DAO.get_dead_events(limit=limit)
+        raise gen.Return(events)
+
+    @gen.coroutine
+    def redrive_dead_events(self, event_ids=None, limit=1000):
+        """
+        Schedule dead events again, to be processed right away:
+        the given ones, or else the oldest `limit`.
+        Returns the number of events scheduled.
+        """
+        redriven = yield self.DAO.redrive_dead_events(
+            event_ids=event_ids, limit=limit
+        )
+        logger.info("Redrove %s dead events", redriven)
+        raise gen.Return(redriven)
+
+    @gen.coroutine
+    def cancel_event(self, event_id):
+        logger.debug("Cancelling event %s", event_id)
+
+        cancelled = yield self.DAO.cancel_event(event_id)
+        raise gen.Return(cancelled)
+
+    @gen.coroutine
+    def reschedule_event(self, event_id, ready_after):
+        logger.debug(
+            "Rescheduling event %s to be ready after %s", event_id, ready_after
+        )
+
+        rescheduled = yield self.DAO.reschedule_event(event_id, ready_after)
+        raise gen.Return(rescheduled)
 
     @util.job
     @gen.coroutine
     def process_events(self, events=None):
         # same as base event service, but in a worker pool
-        yield super(EventService, self).process_events(events=events)
+        failed = yield super(EventService, self).process_events(events=events)
+        yield self.retry_failed_events(failed)
 
 
 class ImmediateEventService(EventService):
@@ -174,15 +697,70 @@ class ImmediateEventService(EventService):
 
     events = []
 
+    def __init__(self):
+        super(ImmediateEventService, self).__init__()
+        # dedup key => expiration timestamp, id of the original event
+        self._dedup_keys = {}
+
     @gen.coroutine
-    def create_event(self, event, group_by=None):
+    def create_event(
+        self, event, group_by=None, dedup_key=None, dedup_ttl=None
+    ):
         assert event.data
         assert event.ready_after is not None
 
+        self._get_event_handler(event.handler)
+
+        # copy the event object to avoid mutating the original
+        event = models.Event().from_dict(event.to_dict())
+        event.id = util.gen_random_string(size=event_dao.EventDao.ID_SIZE)
+
+        if dedup_key:
+            now = time.time()
+            expires_at, event_id = self._dedup_keys.get(dedup_key, (0, None))
+            is_duplicate = expires_at > now
+
+            metrics.registry.counter(
+                "events.dedup.hits" if is_duplicate else "events.dedup.misses"
+            ).incr()
+
+            if is_duplicate:
+                logger.info("Skipping duplicate event %s", dedup_key)
+                # like EventService, the id of the original event
+                event.id = event_id
+                raise gen.Return(event)
+
+            self._dedup_keys[dedup_key] = (
+                now
+                + (
+                    dedup_ttl
+                    or self.app.conf["events"].get(
+                        "dedup_ttl", event_dao.EventDao.DEDUP_TTL
+                    )
+                ),
+                event.id,
+            )
+
         self.events.append(event)
 
         logger.debug("Immediately processing event %s", event)
         yield self.process_events(events=[event])
+        raise gen.Return(event)
+
+    @util.job
+    @gen.coroutine
+    def process_events(self, events=None):
+        # events are processed as they are created, they are not retried
+        yield AbstractEventService.process_events(self, events=events)
+
+    @gen.coroutine
+    def cancel_event(self, event_id):
+        # events have already been processed
+        raise gen.Return(False)
+
+    @gen.coroutine
+    def reschedule_event(self, event_id, ready_after):
+        raise gen.Return(False)
 
 
 class VoidEventService(EventService):
@@ -192,5 +770,76 @@ class VoidEventService(EventService):
     """
 
     @gen.coroutine
-    def create_event(self, event, group_by=None):
+    def create_event(
+        self, event, group_by=None, dedup_key=None, dedup_ttl=None
+    ):
         pass
+
+    @gen.coroutine
+    def cancel_event(self, event_id):
+        raise gen.Return(False)
+
+    @gen.coroutine
+    def reschedule_event(self, event_id, ready_after):
+        raise gen.Return(False)
+
+
+class TimerEventService(EventService):
+    """
+    Keeps events in memory and honors `ready_after` and grouping,
+    for single node installs and benchmarks without Redis.
+    Set `conf["events"]["polling_interval"]` close to
+    `conf["events"]["tick"]` (default 0.1 second)
+    for events to fire on time.
+    """
+
+    DAO_CLASS = event_dao.TimerEventDao
+
+
+class StreamEventService(EventService):
+    """
+    Events are scheduled in the same sorted set as with EventService,
+    ripe events are then moved to a Redis stream and read through
+    a consumer group. Events are only acknowledged once their handler
+    succeeded, events of a crashed or failed job get claimed again
+    after `conf["events"]["claim_idle"]` seconds.
+    Needs Redis >= 6.2
+    """
+
+    DAO_CLASS = event_dao.StreamEventDao
+
+    # seconds before an unacknowledged event gets claimed again
+    CLAIM_IDLE = 60 * 10
+
+    def __init__(self):
+        super(StreamEventService, self).__init__()
+        self.consumer = "{}-{}".format(conf["host"], os.getpid())
+
+    @gen.coroutine
+    def _pop_events(self, limit):
+        yield self.DAO.feed_ready_events(limit=limit)
+
+        events = yield self.DAO.read_events(self.consumer, limit)
+
+        stalled = yield self.DAO.claim_stalled_events(
+            self.consumer,
+            conf["events"].get("claim_idle", self.CLAIM_IDLE),
+            limit,
+        )
+        if stalled:
+            logger.warning("Claimed %s stalled events", len(stalled))
+
+        raise gen.Return(events + stalled)
+
+    @util.job
+    @gen.coroutine
+    def process_events(self, events=None):
+        failed = yield AbstractEventService.process_events(self, events=events)
+
+        # failed events are scheduled again, those that could not be
+        # stay pending, to be claimed again
+        lost = yield self.retry_failed_events(failed)
+        lost = set(id(e) for e in lost)
+        yield self.DAO.ack_events(
+            [e.stream_id for e in events if id(e) not in lost]
+        )
@@ -1,17 +1,337 @@
 from __future__ import absolute_import
+import base64
+import bisect
+import datetime
+import functools
+import hashlib
 import logging
+import multiprocessing
+import pickle
+import sys
+import threading
+import time
+import traceback
+import uuid
+import zlib
 
+from concurrent import futures
 from redis.exceptions import RedisError
-from rq import Queue
+from rq import Queue, get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.utils import utcformat, utcnow
 from tornado import concurrent
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.util import raise_exc_info
 
+from reactorcore import application
+from reactorcore import exception
+from reactorcore import metrics
 from reactorcore.dao import redis
-from reactorcore.util import gen_random_string
+from reactorcore.dao import spool
 
 logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+# job kwargs used by im_wrapper, never moved to a blob
+WRAPPER_KWARGS = ("cls", "f_name", "job_id", "unique_key", "want_result")
+
+"""
+Claim a unique key for a job, returns the id of the job holding it: the
+new job, or the pending one it is merged into. A debounced job waits in the
+delayed sorted set, and every merged add pushes it back.
+
+KEYS: unique key, delayed jobs
+ARGV: job id, ttl, time to run the job at or "" if it is not debounced
+"""
+CLAIM_UNIQUE_SCRIPT = """
+local holder = redis.call('get', KEYS[1])
+if holder then
+    if ARGV[3] ~= '' then
+        -- no-op once it left the delayed set for its queue
+        redis.call('zadd', KEYS[2], 'XX', ARGV[3], holder)
+    end
+    return holder
+end
+
+redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('zadd', KEYS[2], ARGV[3], ARGV[1])
+end
+return ARGV[1]
+"""
+
+"""
+Release a unique key, if it is still held by the job
+
+KEYS: unique key
+ARGV: job id
+"""
+RELEASE_UNIQUE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+"""
+Move the delayed jobs whose time has come to their queue, as RQ enqueues.
+The job and queue keys are built from ARGV, not for Redis Cluster.
+
+KEYS: delayed jobs
+ARGV: now, limit, enqueued at, job key prefix, queue key prefix, queues key
+"""
+QUEUE_DELAYED_SCRIPT = """
+local job_ids = redis.call(
+    'zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+
+for _, job_id in ipairs(job_ids) do
+    redis.call('zrem', KEYS[1], job_id)
+    local job_key = ARGV[4] .. job_id
+    local origin = redis.call('hget', job_key, 'origin')
+    if origin then
+        redis.call(
+            'hmset', job_key, 'status', 'queued', 'enqueued_at', ARGV[3])
+        local queue_key = ARGV[5] .. origin
+        redis.call('rpush', queue_key, job_id)
+        redis.call('sadd', ARGV[6], queue_key)
+    end
+end
+return #job_ids
+"""
+
+"""
+Add a value to a histogram kept in a hash: its count, sum, max and the
+count of its bucket
+
+KEYS: histogram
+ARGV: value, bucket field
+"""
+OBSERVE_SCRIPT = """
+redis.call('hincrby', KEYS[1], 'count', 1)
+redis.call('hincrbyfloat', KEYS[1], 'sum', ARGV[1])
+redis.call('hincrby', KEYS[1], ARGV[2], 1)
+local max = redis.call('hget', KEYS[1], 'max')
+if not max or tonumber(max) < tonumber(ARGV[1]) then
+    redis.call('hset', KEYS[1], 'max', ARGV[1])
+end
+"""
+
+"""
+Add a call to the open batch of a function, returns the id of its batch job.
+A new batch job is saved and delayed until its wait is over, a full batch is
+closed and its job queued right away. The job and calls keys are built from
+ARGV, so it needs a standalone Redis, not Redis Cluster.
+
+KEYS: open batch, delayed jobs, queue
+ARGV: call, max batch, new job id, time to run the new job at, enqueued at,
+      job key prefix, calls key prefix, queues key, new job fields...
+"""
+ADD_BATCH_CALL_SCRIPT = """
+local job_id = redis.call('get', KEYS[1])
+if not job_id then
+    job_id = ARGV[3]
+    redis.call('set', KEYS[1], job_id)
+    redis.call('hmset', ARGV[6] .. job_id, unpack(ARGV, 9))
+    redis.call('zadd', KEYS[2], ARGV[4], job_id)
+end
+
+local count = redis.call('rpush', ARGV[7] .. job_id, ARGV[1])
+if count >= tonumber(ARGV[2]) then
+    -- full, the next calls go to a new batch
+    redis.call('del', KEYS[1])
+    -- unless queue_delayed_jobs queued it already
+    if redis.call('zrem', KEYS[2], job_id) == 1 then
+        redis.call(
+            'hmset', ARGV[6] .. job_id,
+            'status', 'queued', 'enqueued_at', ARGV[5])
+        redis.call('rpush', KEYS[3], job_id)
+        redis.call('sadd', ARGV[8], KEYS[3])
+    end
+end
+return job_id
+"""
+
+"""
+Take the calls of a batch job, and close its batch if it is still open
+
+KEYS: calls, open batch
+ARGV: job id
+"""
+TAKE_BATCH_SCRIPT = """
+local calls = redis.call('lrange', KEYS[1], 0, -1)
+redis.call('del', KEYS[1])
+if redis.call('get', KEYS[2]) == ARGV[1] then
+    redis.call('del', KEYS[2])
+end
+return calls
+"""
+
+# class => instance, shared by the jobs run by a process
+_instances = {}
+
+
+def get_instance(cls):
+    instance = _instances.get(cls)
+    if instance is None:
+        instance = _instances[cls] = cls()
+    return instance
+
+
+# True in the processes of a ProcessPoolJobService
+_in_pool_worker = False
+
+# queue of the reports of the processes of a pool, set by the service
+# before it forks them: ("started", job id), ("timing", record_timing args)
+_pool_reports = None
+
+
+def _init_pool_worker():
+    """
+    Set up a process of the pool, once: its jobs get an IOLoop and an
+    application of their own, rather than the ones forked from the parent,
+    whose executor threads did not survive the fork
+    """
+    global _in_pool_worker
+    if _in_pool_worker:
+        return
+
+    _in_pool_worker = True
+    _instances.clear()
+    IOLoop.clear_current()
+    IOLoop().make_current()
+    application._app = None
+    application.get_application()
+
+
+def _run_pool_job(job_id, priority, submitted_at, cls, f_name, args, kwargs):
+    _init_pool_worker()
+    started_at = time.time()
+    if _pool_reports is not None:
+        _pool_reports.put(("started", job_id))
+
+    im = getattr(get_instance(cls), f_name)
+    failed = True
+    try:
+        res = IOLoop.current().run_sync(functools.partial(im, *args, **kwargs))
+        failed = False
+        return res
+    finally:
+        # the metrics of the process are its own, the service records them
+        if _pool_reports is not None:
+            _pool_reports.put(
+                (
+                    "timing",
+                    (
+                        priority,
+                        cls,
+                        f_name,
+                        started_at - submitted_at,
+                        time.time() - started_at,
+                        failed,
+                    ),
+                )
+            )
+
+
+def get_rate_limit(cls, f_name):
+    """
+    The `util.rate_limit` of a job method, None if it has none
+    """
+    return getattr(getattr(cls, f_name or "", None), "rate_limit", None)
+
+
+def timing_prefixes(queue, cls, f_name):
+    name = "%s.%s" % (cls.__name__, f_name) if cls else f_name
+    return "jobs.%s." % queue, "jobs.%s." % name
+
+
+def record_timing(queue, cls, f_name, waited, run_time, failed=False):
+    """
+    Record a job in the `jobs.<queue>.` and `jobs.<Class.method>.` metrics:
+    the `wait.seconds` from enqueued to started, the `run.seconds` and the
+    `failed` count
+    """
+    for prefix in timing_prefixes(queue, cls, f_name):
+        if waited is not None:
+            metrics.registry.histogram(prefix + "wait.seconds").observe(waited)
+        metrics.registry.histogram(prefix + "run.seconds").observe(run_time)
+        if failed:
+            metrics.registry.counter(prefix + "failed").incr()
 
 
+@gen.coroutine
+def _record_rq_timing(cls, f_name, started, failed=False):
+    """
+    Record the timing of a job run by an RQ worker, out of the native worker
+    which records its own. The work horse process exits with its metrics,
+    so they are added to the ones kept in Redis.
+    """
+    rq_job = get_current_job()
+    if rq_job is None:
+        return
+
+    waited = (
+        (utcnow() - rq_job.enqueued_at).total_seconds()
+        if rq_job.enqueued_at
+        else None
+    )
+    yield application.get_application().service.jobs.store_timing(
+        rq_job.origin, cls, f_name, waited, time.time() - started, failed
+    )
+
+
+@gen.coroutine
+def _defer_rq_job(cls, f_name):
+    """
+    Take a token of the rate limit of a job run by an RQ worker, with none
+    left defer the job, like the native worker does before running it,
+    rather than holding the process. Returns True when deferred.
+    """
+    rq_job = get_current_job()
+    limit = get_rate_limit(cls, f_name)
+    if rq_job is None or not limit:
+        raise gen.Return(False)
+
+    if "deferred_result_ttl" in rq_job.meta:
+        # run again, see JobService.defer_rq_job
+        rq_job.result_ttl = rq_job.meta.pop("deferred_result_ttl")
+
+    app = application.get_application()
+    wait = yield app.service.ratelimit.acquire(**limit)
+    if not wait:
+        raise gen.Return(False)
+
+    yield app.service.jobs.defer_rq_job(rq_job, wait)
+    metrics.registry.counter("jobs.deferred").incr()
+    raise gen.Return(True)
+
+
+def _rq_job(f):
+    """
+    Run a wrapper on an IOLoop of its own when the stock RQ worker calls
+    it, with no loop running. The native worker yields it on its loop.
+    """
+
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        if get_current_job() is None:
+            return f(*args, **kwargs)
+
+        jobs = application.get_application().service.jobs
+        loop = IOLoop.current()
+        # util.job runs the method on this loop rather than a nested one
+        jobs.worker_loop = loop
+        try:
+            return loop.run_sync(functools.partial(f, *args, **kwargs))
+        finally:
+            jobs.worker_loop = None
+
+    return decorated_function
+
+
+@_rq_job
 @gen.coroutine
 def im_wrapper(*args, **kwargs):
     """
@@ -22,13 +342,84 @@ def im_wrapper(*args, **kwargs):
         cls = the class
         f_name = function name
 
-    This will get called by RQ upon unpickling
+    This will get called by RQ upon unpickling. The instance is built once
+    per process, and reused by the next jobs of the same class.
+    Large arguments are loaded from their blob, and the result or error is
+    stored for the job's handle when it was added with `want_result`.
 
     """
     cls = kwargs.pop("cls")
     f_name = kwargs.pop("f_name")
-    im = getattr(cls(), f_name)
-    res = yield im(*args, **kwargs)
+    job_id = kwargs.pop("job_id", None)
+    unique_key = kwargs.pop("unique_key", None)
+    want_result = kwargs.pop("want_result", False)
+    blob = kwargs.pop("blob", None)
+    im = getattr(get_instance(cls), f_name)
+
+    jobs = application.get_application().service.jobs
+    deferred = yield _defer_rq_job(cls, f_name)
+    if deferred:
+        return
+
+    if unique_key:
+        # from now on an identical job is added anew
+        yield jobs.release_unique(unique_key, job_id)
+
+    started = time.time()
+    try:
+        if blob:
+            args, kwargs = yield jobs.load_blob(blob)
+
+        res = yield im(*args, **kwargs)
+    except Exception as ex:
+        # yielding below loses the exception being handled
+        exc_info = sys.exc_info()
+        yield _record_rq_timing(cls, f_name, started, failed=True)
+        if want_result:
+            yield jobs.store_result(
+                job_id,
+                JobResult.FAILED,
+                "".join(traceback.format_exception_only(type(ex), ex)),
+            )
+        raise_exc_info(exc_info)
+
+    yield _record_rq_timing(cls, f_name, started)
+    if want_result:
+        yield jobs.store_result(job_id, JobResult.FINISHED, res)
+    raise gen.Return(res)
+
+
+@_rq_job
+@gen.coroutine
+def batch_wrapper(cls, f_name, priority, job_id):
+    """
+    Run a batch job: call the `util.batch_job` method once with the
+    (args, kwargs) of all the calls added to the batch
+    """
+    jobs = application.get_application().service.jobs
+    deferred = yield _defer_rq_job(cls, f_name)
+    if deferred:
+        return
+
+    calls = yield jobs.take_batch(cls, f_name, priority, job_id)
+    im = getattr(get_instance(cls), f_name)
+
+    started = time.time()
+    try:
+        res = yield im(calls)
+    except Exception as ex:
+        # yielding below loses the exception being handled
+        exc_info = sys.exc_info()
+        yield _record_rq_timing(cls, f_name, started, failed=True)
+        yield jobs.store_result(
+            job_id,
+            JobResult.FAILED,
+            "".join(traceback.format_exception_only(type(ex), ex)),
+        )
+        raise_exc_info(exc_info)
+
+    yield _record_rq_timing(cls, f_name, started)
+    yield jobs.store_result(job_id, JobResult.FINISHED, res)
     raise gen.Return(res)
 
 
@@ -38,10 +429,216 @@ class Jobs(object):
     LOW = "low"
 
 
+class JobResult(object):
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class JobHandle(object):
+    """
+    Handle on an added job, to wait for its result or cancel it
+    """
+
+    def __init__(self, service, job_id, stored=True):
+        self.service = service
+        self.id = job_id
+        # whether the worker stores the result
+        self.stored = stored
+
+    @gen.coroutine
+    def result(self, timeout=None):
+        """
+        Wait for the job to be done and return its result, raises
+        JobFailed or JobCancelled, or gen.TimeoutError after `timeout`
+        seconds
+        """
+        assert self.stored, "add the job with want_result to wait for it"
+        res = yield self.service.wait_for_result(self.id, timeout=timeout)
+        raise gen.Return(res)
+
+    @gen.coroutine
+    def cancel(self):
+        """
+        Take the job off its queue, False if it is not queued anymore
+        """
+        cancelled = yield self.service.cancel_job(self.id)
+        raise gen.Return(cancelled)
+
+
+class RanJobHandle(JobHandle):
+    """
+    Handle on a job that already ran in the process
+    """
+
+    def __init__(self, job_id, res):
+        super(RanJobHandle, self).__init__(None, job_id)
+        self._result = res
+
+    @gen.coroutine
+    def result(self, timeout=None):
+        raise gen.Return(self._result)
+
+    @gen.coroutine
+    def cancel(self):
+        raise gen.Return(False)
+
+
+class ResultListener(object):
+    """
+    Waits for job results on one pub/sub connection per process, subscribed
+    to the channels of the jobs waited for. Only its thread uses the
+    connection, it follows the waiters on each poll.
+    """
+
+    # seconds between checks for new jobs to wait for
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, service):
+        self.service = service
+        self.pubsub = None
+        self.subscribed = set()
+
+        # job id => [(loop, future)]
+        self.waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wait(self, job_id):
+        """
+        Future resolved once the result of `job_id` is stored
+        """
+        future = concurrent.Future()
+        with self._lock:
+            self.waiters.setdefault(job_id, []).append(
+                (IOLoop.current(), future)
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="job-results"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        return future
+
+    def forget(self, job_id, future):
+        with self._lock:
+            waiters = [
+                w for w in self.waiters.get(job_id, []) if w[1] is not future
+            ]
+            if waiters:
+                self.waiters[job_id] = waiters
+            else:
+                self.waiters.pop(job_id, None)
+
+    def _notify(self, job_id):
+        with self._lock:
+            waiters = self.waiters.pop(job_id, [])
+        for loop, future in waiters:
+            loop.add_callback(_set_done, future)
+
+    def _run(self):
+        while True:
+            try:
+                self._poll()
+            except RedisError as ex:
+                logger.critical(
+                    "Error waiting for job results: %s", ex.message
+                )
+                self.pubsub = None
+                self.subscribed = set()
+                time.sleep(1)
+
+    def _poll(self):
+        client = self.service.client
+        if self.pubsub is None:
+            self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+
+        with self._lock:
+            wanted = set(self.waiters)
+
+        gone = self.subscribed - wanted
+        if gone:
+            self.pubsub.unsubscribe(
+                *[self.service.done_channel(i) for i in gone]
+            )
+            self.subscribed -= gone
+
+        new = list(wanted - self.subscribed)
+        if new:
+            self.pubsub.subscribe(*[self.service.done_channel(i) for i in new])
+            self.subscribed.update(new)
+
+            # results stored before we subscribed
+            with client.pipeline() as pipe:
+                for job_id in new:
+                    pipe.exists(self.service.result_key(job_id))
+                for job_id, stored in zip(new, pipe.execute()):
+                    if stored:
+                        self._notify(job_id)
+
+        if not self.subscribed:
+            time.sleep(self.POLL_INTERVAL)
+            return
+
+        message = self.pubsub.get_message(timeout=self.POLL_INTERVAL)
+        while message:
+            if message["type"] == "message":
+                self._notify(
+                    message["channel"][len(self.service.done_channel("")) :]
+                )
+            message = self.pubsub.get_message()
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
 class JobService(redis.RedisSource):
+    # seconds job results are kept
+    RESULT_TTL = 500
+
+    # pickled job arguments from this size on go to a blob
+    BLOB_THRESHOLD = 64 * 1024
+
+    # seconds blobs are kept, they must outlive the jobs in the queues
+    BLOB_TTL = 60 * 60 * 24
+
+    # seconds a unique key is kept at most, in case its job never runs
+    UNIQUE_TTL = 60 * 60 * 24
+
+    # delayed jobs moved to their queue per call
+    DELAYED_BATCH_SIZE = 1000
+
     def __init__(self):
         super(JobService, self).__init__(name="JOBS", cls=self.__class__)
 
+        # the IOLoop of the native worker running jobs in this process
+        self.worker_loop = None
+
+        self.result_listener = ResultListener(self)
+
+        self.delayed_key = "job:delayed"
+        self._claim_unique_script = self.client.register_script(
+            CLAIM_UNIQUE_SCRIPT
+        )
+        self._release_unique_script = self.client.register_script(
+            RELEASE_UNIQUE_SCRIPT
+        )
+        self._queue_delayed_script = self.client.register_script(
+            QUEUE_DELAYED_SCRIPT
+        )
+        self._add_batch_call_script = self.client.register_script(
+            ADD_BATCH_CALL_SCRIPT
+        )
+        self._take_batch_script = self.client.register_script(
+            TAKE_BATCH_SCRIPT
+        )
+        self._observe_script = self.client.register_script(OBSERVE_SCRIPT)
+
+        spool.register_replayer("job", self._replay_jobs)
+
     def is_async(self):
         return True
 
@@ -51,31 +648,102 @@ class JobService(redis.RedisSource):
             priority, connection=self.client, is_async=self.is_async()
         )
 
+    @concurrent.run_on_executor
+    def get_queue_depth(self, priority=None):
+        """
+        Number of jobs waiting in the queue for `priority`
+        """
+        try:
+            return self._get_queue(priority).count
+        except RedisError as ex:
+            logger.critical("Error getting queue depth: %s", ex.message)
+            return None
+
     @gen.coroutine
     def add(
-        self, func=None, args=None, kwargs=None, priority=None, depends_on=None
+        self,
+        func=None,
+        args=None,
+        kwargs=None,
+        priority=None,
+        depends_on=None,
+        unique_key=None,
+        debounce=None,
+        want_result=False,
     ):
+        """
+        Add a job calling `func`, returns its JobHandle.
+
+        The result is stored for the handle only when `want_result` is set, or
+        for unique and batch jobs, whose handles are shared.
+        While a job with the same `unique_key` is pending, the job is not
+        added and the handle is the pending job's. With `debounce`, the job
+        is queued `debounce` seconds after the last add merged into it.
+        """
         args = args or ()
         kwargs = kwargs or {}
 
-        job_id = gen_random_string(size=6)
+        assert not debounce or unique_key, "debounce needs a unique_key"
+        assert not (debounce and depends_on), "can't debounce dependent jobs"
+
+        job_id = str(uuid.uuid4())
+
+        if getattr(func, "batch", None):
+            assert not (unique_key or depends_on), "not for batch jobs"
+            handle = yield self._add_to_batch(func, args, kwargs, priority)
+            raise gen.Return(handle)
 
         # if synchronous - just run the function in the same thread
         if not self.is_async():
-            yield func(*args, **kwargs)
-            raise gen.Return(None)
+            res = yield self._run_now(func, args, kwargs, priority)
+            raise gen.Return(RanJobHandle(job_id, res))
 
-        yield self._add(
+        job_id = yield self._add(
             func=func,
             args=args,
             kwargs=kwargs,
             priority=priority,
             depends_on=depends_on,
             job_id=job_id,
+            unique_key=unique_key,
+            debounce=debounce,
+            want_result=want_result,
         )
 
         logger.debug("Added job id(%s) to queue", job_id)
-        raise gen.Return(None)
+        raise gen.Return(
+            JobHandle(self, job_id, stored=bool(want_result or unique_key))
+        )
+
+    @gen.coroutine
+    def _run_now(self, func, args, kwargs, priority):
+        """
+        Run the call in this process, timed like the jobs of the workers,
+        with no wait
+        """
+        cls = getattr(func, "im_class", None)
+        started = time.time()
+        try:
+            res = yield func(*args, **kwargs)
+        except Exception:
+            record_timing(
+                priority or Jobs.NORMAL,
+                cls,
+                func.__name__,
+                0,
+                time.time() - started,
+                failed=True,
+            )
+            raise
+
+        record_timing(
+            priority or Jobs.NORMAL,
+            cls,
+            func.__name__,
+            0,
+            time.time() - started,
+        )
+        raise gen.Return(res)
 
     @concurrent.run_on_executor
     def _add(self, *args, **kwargs):
@@ -85,6 +753,9 @@ class JobService(redis.RedisSource):
         f_args = kwargs["args"]
         f_kwargs = kwargs["kwargs"]
         depends_on = kwargs["depends_on"]
+        unique_key = kwargs.get("unique_key")
+        debounce = kwargs.get("debounce")
+        want_result = kwargs.get("want_result")
         priority = priority or Jobs.NORMAL
 
         logger.debug('Adding JOB "%s" on %s', func.__name__, priority)
@@ -94,15 +765,45 @@ class JobService(redis.RedisSource):
         # these are for the wrapper
         f_kwargs["cls"] = func.im_class
         f_kwargs["f_name"] = func.__name__
+        f_kwargs["job_id"] = job_id
+        if unique_key:
+            f_kwargs["unique_key"] = unique_key
+        if want_result or unique_key:
+            # merged adds may wait on a unique job
+            f_kwargs["want_result"] = True
+
+        if spool.is_enabled() and not spool.breaker.allow():
+            # Redis is down, don't wait for it
+            self._spool_job(priority, f_args, f_kwargs, depends_on)
+            return job_id
 
-        res = None
+        claimed = False
         try:
-            res = q.enqueue_call(
+            if unique_key:
+                holder = self._claim_unique(
+                    q, job_id, f_args, f_kwargs, unique_key, debounce
+                )
+                if holder != job_id or debounce:
+                    spool.breaker.success()
+                    return holder
+                claimed = True
+
+            blobs = {}
+            job_args, job_kwargs = self._pack_call(f_args, f_kwargs, blobs)
+            if blobs:
+                with self.client.pipeline() as pipe:
+                    self._store_blobs(blobs, pipe)
+                    pipe.execute()
+
+            q.enqueue_call(
                 func=im_wrapper,
-                args=f_args,
-                kwargs=f_kwargs,
+                args=job_args,
+                kwargs=job_kwargs,
                 depends_on=depends_on,
+                job_id=job_id,
+                meta={"unique_key": unique_key} if unique_key else None,
             )
+            spool.breaker.success()
 
         except RedisError as ex:
             logger.critical(
@@ -111,10 +812,624 @@ class JobService(redis.RedisSource):
                 ex.message,
                 exc_info=True,
             )
+            spool.breaker.failure()
+            if spool.is_enabled():
+                self._spool_job(priority, f_args, f_kwargs, depends_on)
+            elif claimed:
+                # the job is dropped, don't keep the next ones out
+                self._release_unique_key(unique_key, job_id)
 
-            res = None
+        return job_id
 
-        return res
+    @gen.coroutine
+    def _add_to_batch(self, func, args, kwargs, priority):
+        # if synchronous - a batch of the one call
+        if not self.is_async():
+            res = yield self._run_now(func, ([(args, kwargs)],), {}, priority)
+            raise gen.Return(RanJobHandle(str(uuid.uuid4()), res))
+
+        job_id = yield self._add_batch_call(
+            func=func, args=args, kwargs=kwargs, priority=priority
+        )
+
+        logger.debug("Added call to batch job id(%s)", job_id)
+        raise gen.Return(JobHandle(self, job_id))
+
+    def batch_key(self, cls, f_name, priority):
+        return "job:batch:%s.%s.%s:%s" % (
+            cls.__module__,
+            cls.__name__,
+            f_name,
+            priority,
+        )
+
+    def batch_calls_key(self, job_id):
+        return "job:batch:calls:%s" % job_id
+
+    @concurrent.run_on_executor
+    def _add_batch_call(
+        self, func=None, args=None, kwargs=None, priority=None
+    ):
+        """
+        Add the call to the open batch of `func`, returns the id of the
+        batch job. The job is queued once the batch is full, or by
+        queue_delayed_jobs once its `max_wait` is over.
+        """
+        priority = priority or Jobs.NORMAL
+        cls = func.im_class
+        f_name = func.__name__
+        job_id = str(uuid.uuid4())
+
+        logger.debug('Adding call to batch JOB "%s" on %s', f_name, priority)
+
+        q = self._get_queue(priority)
+
+        if spool.is_enabled() and not spool.breaker.allow():
+            # Redis is down, don't wait for it
+            self._spool_batch_call(priority, cls, f_name, job_id, args, kwargs)
+            return job_id
+
+        # saved as the job of a new batch, if there is no open one
+        fields = Job.create(
+            batch_wrapper,
+            kwargs={
+                "cls": cls,
+                "f_name": f_name,
+                "priority": priority,
+                "job_id": job_id,
+            },
+            connection=self.client,
+            status=JobStatus.DEFERRED,
+            origin=q.name,
+            id=job_id,
+            meta={"batch": True},
+        ).to_dict()
+
+        try:
+            batch_job_id = self._add_batch_call_script(
+                keys=[
+                    self.batch_key(cls, f_name, priority),
+                    self.delayed_key,
+                    q.key,
+                ],
+                args=[
+                    pickle.dumps((args, kwargs), pickle.HIGHEST_PROTOCOL),
+                    func.batch["max_batch"],
+                    job_id,
+                    repr(time.time() + func.batch["max_wait"]),
+                    utcformat(utcnow()),
+                    Job.redis_job_namespace_prefix,
+                    self.batch_calls_key(""),
+                    Queue.redis_queues_keys,
+                ]
+                + [x for item in fields.items() for x in item],
+            )
+            spool.breaker.success()
+            return batch_job_id
+
+        except RedisError as ex:
+            logger.critical(
+                "[EXCEPTION] Error adding call to batch job %s %s",
+                f_name,
+                ex.message,
+                exc_info=True,
+            )
+            spool.breaker.failure()
+            if spool.is_enabled():
+                self._spool_batch_call(
+                    priority, cls, f_name, job_id, args, kwargs
+                )
+            return job_id
+
+    def _spool_batch_call(self, priority, cls, f_name, job_id, args, kwargs):
+        """
+        Spool the call as a batch of its own, replayed as a plain job
+        """
+        self._spool_job(
+            priority,
+            (),
+            {
+                "calls": [(args, kwargs)],
+                "cls": cls,
+                "f_name": f_name,
+                "job_id": job_id,
+            },
+        )
+
+    @concurrent.run_on_executor
+    def take_batch(self, cls, f_name, priority, job_id):
+        """
+        (args, kwargs) of the calls of batch job `job_id`, whose batch is
+        closed. Called by the worker when the job runs.
+        """
+        calls = self._take_batch_script(
+            keys=[
+                self.batch_calls_key(job_id),
+                self.batch_key(cls, f_name, priority),
+            ],
+            args=[job_id],
+        )
+        return [pickle.loads(call) for call in calls]
+
+    def unique_key(self, key):
+        return "job:unique:%s" % key
+
+    def _claim_unique(self, q, job_id, args, kwargs, unique_key, debounce):
+        """
+        Claim `unique_key` for the job, returns the id of the job holding
+        it. A debounced job is saved, to be queued by queue_delayed_jobs.
+        """
+        if debounce:
+            # saved first, it can be queued as soon as it is claimed
+            blobs = {}
+            job_args, job_kwargs = self._pack_call(args, kwargs, blobs)
+            with self.client.pipeline() as pipe:
+                self._store_blobs(blobs, pipe)
+                Job.create(
+                    im_wrapper,
+                    args=job_args,
+                    kwargs=job_kwargs,
+                    connection=self.client,
+                    status=JobStatus.DEFERRED,
+                    origin=q.name,
+                    id=job_id,
+                    meta={"unique_key": unique_key},
+                ).save(pipeline=pipe)
+                pipe.execute()
+
+        holder = self._claim_unique_script(
+            keys=[self.unique_key(unique_key), self.delayed_key],
+            args=[
+                job_id,
+                conf["jobs"].get("unique_ttl", self.UNIQUE_TTL),
+                repr(time.time() + debounce) if debounce else "",
+            ],
+        )
+
+        if holder != job_id:
+            logger.debug(
+                "Merged job id(%s) into id(%s) for %s",
+                job_id,
+                holder,
+                unique_key,
+            )
+            metrics.registry.counter("jobs.coalesced").incr()
+            if debounce:
+                Job(job_id, connection=self.client).delete(
+                    remove_from_queue=False
+                )
+
+        return holder
+
+    @concurrent.run_on_executor
+    def release_unique(self, unique_key, job_id):
+        """
+        Release `unique_key` when its job starts
+        """
+        self._release_unique_key(unique_key, job_id)
+
+    def _release_unique_key(self, unique_key, job_id):
+        try:
+            self._release_unique_script(
+                keys=[self.unique_key(unique_key)], args=[job_id]
+            )
+        except RedisError as ex:
+            logger.critical(
+                "Error releasing unique key %s: %s", unique_key, ex.message
+            )
+
+    @gen.coroutine
+    def queue_delayed_jobs(self):
+        """
+        Queue the debounced jobs whose time has come, called periodically
+        by the reactor
+        """
+        if not self.is_async():
+            raise gen.Return(0)
+
+        count = yield self._queue_delayed_jobs()
+        if count:
+            logger.debug("Queued %s delayed jobs", count)
+        raise gen.Return(count)
+
+    def defer_job(self, job, seconds):
+        """
+        Put a dequeued job back with the delayed jobs, it is queued again
+        in `seconds`. Blocking, it is called by the worker.
+        """
+        with self.client.pipeline() as pipe:
+            job.set_status(JobStatus.DEFERRED, pipeline=pipe)
+            pipe.zadd(self.delayed_key, **{job.id: time.time() + seconds})
+            pipe.execute()
+
+    @concurrent.run_on_executor
+    def defer_rq_job(self, job, seconds):
+        """
+        Defer a job the stock RQ worker is running. The worker then records
+        it as finished, and cleans it up after its result TTL, so the job
+        is kept until it runs again, with its own TTL back.
+        """
+        job.meta["deferred_result_ttl"] = job.result_ttl
+        job.result_ttl = -1
+        job.save_meta()
+        self.defer_job(job, seconds)
+
+    @concurrent.run_on_executor
+    def _queue_delayed_jobs(self):
+        try:
+            return self._queue_delayed_script(
+                keys=[self.delayed_key],
+                args=[
+                    repr(time.time()),
+                    self.DELAYED_BATCH_SIZE,
+                    utcformat(utcnow()),
+                    Job.redis_job_namespace_prefix,
+                    Queue.redis_queue_namespace_prefix,
+                    Queue.redis_queues_keys,
+                ],
+            )
+        except RedisError as ex:
+            logger.critical("Error queueing delayed jobs: %s", ex.message)
+            return 0
+
+    def _spool_job(self, priority, args, kwargs, depends_on=None):
+        """
+        Keep the job on disk, it is enqueued when the spool is replayed
+        """
+        logger.warning('Spooling JOB "%s" on %s', kwargs["f_name"], priority)
+        spool.get_spool().append(
+            "job",
+            {
+                "priority": priority,
+                "call": base64.b64encode(
+                    pickle.dumps((args, kwargs), pickle.HIGHEST_PROTOCOL)
+                ),
+                "depends_on": getattr(depends_on, "id", depends_on),
+            },
+        )
+
+    def _replay_jobs(self, records):
+        with self.client.pipeline() as pipe:
+            for record in records:
+                args, kwargs = pickle.loads(base64.b64decode(record["call"]))
+                q = self._get_queue(record["priority"])
+                unique_key = kwargs.get("unique_key")
+                meta = {"unique_key": unique_key} if unique_key else None
+
+                if record["depends_on"]:
+                    # rq checks the dependency outside of our pipeline
+                    q.enqueue_call(
+                        func=im_wrapper,
+                        args=args,
+                        kwargs=kwargs,
+                        depends_on=record["depends_on"],
+                        job_id=kwargs.get("job_id"),
+                        meta=meta,
+                    )
+                    continue
+
+                job = Job.create(
+                    im_wrapper,
+                    args=args,
+                    kwargs=kwargs,
+                    connection=self.client,
+                    status=JobStatus.QUEUED,
+                    origin=q.name,
+                    id=kwargs.get("job_id"),
+                    meta=meta,
+                )
+                q.enqueue_job(job, pipeline=pipe)
+            pipe.execute()
+
+    @gen.coroutine
+    def add_many(self, calls=None, priority=None, want_result=False):
+        """
+        Add one job per (func, args, kwargs) in `calls`,
+        with a single Redis pipeline, returns their JobHandles
+        """
+        calls = [
+            (str(uuid.uuid4()), func, args or (), kwargs or {})
+            for func, args, kwargs in calls
+        ]
+
+        # if synchronous - just run the functions in the same thread
+        if not self.is_async():
+            handles = []
+            for job_id, func, args, kwargs in calls:
+                res = yield self._run_now(func, args, kwargs, priority)
+                handles.append(RanJobHandle(job_id, res))
+            raise gen.Return(handles)
+
+        yield self._add_many(
+            calls=calls, priority=priority, want_result=want_result
+        )
+
+        logger.debug("Added %s jobs to queue", len(calls))
+        raise gen.Return(
+            [
+                JobHandle(self, job_id, stored=want_result)
+                for job_id, _, _, _ in calls
+            ]
+        )
+
+    @concurrent.run_on_executor
+    def _add_many(self, calls=None, priority=None, want_result=False):
+        priority = priority or Jobs.NORMAL
+
+        logger.debug("Adding %s JOBS on %s", len(calls), priority)
+
+        q = self._get_queue(priority)
+
+        # these are for the wrapper
+        calls = [
+            (
+                job_id,
+                args,
+                dict(
+                    kwargs,
+                    cls=func.im_class,
+                    f_name=func.__name__,
+                    job_id=job_id,
+                    want_result=want_result,
+                ),
+            )
+            for job_id, func, args, kwargs in calls
+        ]
+
+        if spool.is_enabled() and not spool.breaker.allow():
+            # Redis is down, don't wait for it
+            for _, args, kwargs in calls:
+                self._spool_job(priority, args, kwargs)
+            return
+
+        try:
+            blobs = {}
+            packed = [
+                (job_id, self._pack_call(args, kwargs, blobs))
+                for job_id, args, kwargs in calls
+            ]
+
+            with self.client.pipeline() as pipe:
+                # the blobs before the jobs that need them
+                self._store_blobs(blobs, pipe)
+
+                for job_id, (args, kwargs) in packed:
+                    job = Job.create(
+                        im_wrapper,
+                        args=args,
+                        kwargs=kwargs,
+                        connection=self.client,
+                        status=JobStatus.QUEUED,
+                        origin=q.name,
+                        id=job_id,
+                    )
+                    q.enqueue_job(job, pipeline=pipe)
+                pipe.execute()
+            spool.breaker.success()
+
+        except RedisError as ex:
+            logger.critical(
+                "[EXCEPTION] Error adding %s jobs %s",
+                len(calls),
+                ex.message,
+                exc_info=True,
+            )
+            spool.breaker.failure()
+            if spool.is_enabled():
+                for _, args, kwargs in calls:
+                    self._spool_job(priority, args, kwargs)
+
+    def blob_key(self, digest):
+        return "job:blob:%s" % digest
+
+    def _pack_call(self, args, kwargs, blobs):
+        """
+        Args and kwargs to enqueue for a job. When the call pickles to
+        `conf["jobs"]["blob_threshold"]` bytes or more, it is compressed to
+        a blob keyed by its digest, added to `blobs`, and the job only
+        refers to it: the same call is stored once for all its jobs.
+        """
+        threshold = conf["jobs"].get("blob_threshold", self.BLOB_THRESHOLD)
+        if not threshold:
+            return args, kwargs
+
+        wrapper_kwargs = {
+            k: v for k, v in kwargs.items() if k in WRAPPER_KWARGS
+        }
+        call_kwargs = {
+            k: v for k, v in kwargs.items() if k not in WRAPPER_KWARGS
+        }
+
+        data = pickle.dumps((args, call_kwargs), pickle.HIGHEST_PROTOCOL)
+        if len(data) < threshold:
+            return args, kwargs
+
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in blobs:
+            blobs[digest] = zlib.compress(data)
+
+        return (), dict(wrapper_kwargs, blob=digest)
+
+    def _store_blobs(self, blobs, pipe):
+        ttl = conf["jobs"].get("blob_ttl", self.BLOB_TTL)
+        for digest, blob in blobs.items():
+            # stored already by an identical call: keep it longer
+            pipe.set(self.blob_key(digest), blob, ex=ttl, nx=True)
+            pipe.expire(self.blob_key(digest), ttl)
+
+    @concurrent.run_on_executor
+    def load_blob(self, digest):
+        """
+        Args and kwargs of a call stored as a blob, loaded by the worker
+        when the job runs
+        """
+        blob = self.client.get(self.blob_key(digest))
+        if blob is None:
+            raise exception.NotFound("No blob %s, it expired" % digest)
+        return pickle.loads(zlib.decompress(blob))
+
+    def result_key(self, job_id):
+        return "job:result:%s" % job_id
+
+    def done_channel(self, job_id):
+        return "job:done:%s" % job_id
+
+    @concurrent.run_on_executor
+    def store_result(self, job_id, status, value):
+        """
+        Store the outcome of a job and signal the waiters, called by the
+        worker once the job is done
+        """
+        self._store_result(job_id, status, value)
+
+    def _store_result(self, job_id, status, value):
+        try:
+            data = pickle.dumps(
+                {"status": status, "value": value}, pickle.HIGHEST_PROTOCOL
+            )
+        except Exception as ex:
+            status = JobResult.FAILED
+            data = pickle.dumps(
+                {"status": status, "value": "Unpicklable result: %s" % ex},
+                pickle.HIGHEST_PROTOCOL,
+            )
+
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.set(
+                    self.result_key(job_id),
+                    data,
+                    ex=conf["jobs"].get("result_ttl", self.RESULT_TTL),
+                )
+                pipe.publish(self.done_channel(job_id), status)
+                pipe.execute()
+        except RedisError as ex:
+            logger.critical(
+                "Error storing result of job id(%s) %s", job_id, ex.message
+            )
+
+    def metrics_key(self, name):
+        return "jobs:metrics:%s" % name
+
+    @concurrent.run_on_executor
+    def store_timing(self, queue, cls, f_name, waited, run_time, failed=False):
+        """
+        Add a job run to the metrics kept in Redis, see record_timing, for
+        the processes that don't outlive their job
+        """
+        histograms = []
+        for prefix in timing_prefixes(queue, cls, f_name):
+            if waited is not None:
+                histograms.append((prefix + "wait.seconds", waited))
+            histograms.append((prefix + "run.seconds", run_time))
+
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for name, value in histograms:
+                    bucket = bisect.bisect_left(
+                        metrics.Histogram.BUCKETS, value
+                    )
+                    self._observe_script(
+                        keys=[self.metrics_key(name)],
+                        args=[repr(value), bucket],
+                        client=pipe,
+                    )
+                if failed:
+                    for prefix in timing_prefixes(queue, cls, f_name):
+                        pipe.incr(self.metrics_key(prefix + "failed"))
+                pipe.execute()
+        except RedisError as ex:
+            logger.critical("Error storing job timing: %s", ex.message)
+
+    @concurrent.run_on_executor
+    def get_stored_timing(self, prefix):
+        """
+        The metrics of `prefix`, eg. "jobs.normal.", kept in Redis by
+        store_timing, as metrics.registry.snapshot gives them
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            for name in ("wait.seconds", "run.seconds"):
+                pipe.hgetall(self.metrics_key(prefix + name))
+            pipe.get(self.metrics_key(prefix + "failed"))
+            wait, run, failed = pipe.execute()
+
+        snapshot = {prefix + "failed": int(failed or 0)}
+        for name, fields in (("wait.seconds", wait), ("run.seconds", run)):
+            histogram = metrics.Histogram(prefix + name)
+            if fields:
+                histogram.count = int(fields["count"])
+                histogram.sum = float(fields["sum"])
+                histogram.max = float(fields["max"])
+                for index in range(len(histogram.buckets)):
+                    histogram.counts[index] = int(fields.get(str(index), 0))
+            snapshot[prefix + name] = histogram.snapshot()
+        return snapshot
+
+    @concurrent.run_on_executor
+    def _get_result(self, job_id):
+        data = self.client.get(self.result_key(job_id))
+        return pickle.loads(data) if data is not None else None
+
+    @gen.coroutine
+    def wait_for_result(self, job_id, timeout=None):
+        """
+        Wait for the result of job `job_id` without polling,
+        see JobHandle.result
+        """
+        future = self.result_listener.wait(job_id)
+        try:
+            if timeout is None:
+                yield future
+            else:
+                yield gen.with_timeout(
+                    datetime.timedelta(seconds=timeout), future
+                )
+        finally:
+            self.result_listener.forget(job_id, future)
+
+        stored = yield self._get_result(job_id)
+        if stored is None:
+            raise exception.NotFound("No result for job %s" % job_id)
+
+        if stored["status"] == JobResult.FAILED:
+            raise exception.JobFailed(stored["value"])
+        if stored["status"] == JobResult.CANCELLED:
+            raise exception.JobCancelled("Job %s was cancelled" % job_id)
+        raise gen.Return(stored["value"])
+
+    @concurrent.run_on_executor
+    def cancel_job(self, job_id):
+        """
+        Take job `job_id` off its queue, or the delayed jobs, and release
+        its unique key. False if it is not pending anymore, and for batch
+        jobs, which the other calls of the batch share.
+        """
+        try:
+            job = Job.fetch(job_id, connection=self.client)
+            if job.meta.get("batch"):
+                return False
+
+            with self.client.pipeline() as pipe:
+                pipe.lrem(self._get_queue(job.origin).key, job_id)
+                pipe.zrem(self.delayed_key, job_id)
+                if not any(pipe.execute()):
+                    # running or done
+                    return False
+
+            unique_key = job.meta.get("unique_key")
+            if unique_key:
+                self._release_unique_key(unique_key, job_id)
+            job.delete(remove_from_queue=False)
+        except NoSuchJobError:
+            return False
+        except RedisError as ex:
+            logger.critical(
+                "Error cancelling job id(%s) %s", job_id, ex.message
+            )
+            return False
+
+        self._store_result(job_id, JobResult.CANCELLED, None)
+        return True
 
 
 class ImmediateJobService(JobService):
@@ -124,3 +1439,202 @@ class ImmediateJobService(JobService):
 
     def is_async(self):
         return False
+
+    @gen.coroutine
+    def get_queue_depth(self, priority=None):
+        # jobs run as they are added
+        raise gen.Return(0)
+
+
+class PoolJobHandle(JobHandle):
+    """
+    Handle on a job submitted to a process pool
+    """
+
+    def __init__(self, job_id, future):
+        super(PoolJobHandle, self).__init__(None, job_id)
+        self.future = future
+
+    @gen.coroutine
+    def result(self, timeout=None):
+        try:
+            if timeout is None:
+                res = yield self.future
+            else:
+                res = yield gen.with_timeout(
+                    datetime.timedelta(seconds=timeout), self.future
+                )
+        except futures.CancelledError:
+            raise exception.JobCancelled("Job %s was cancelled" % self.id)
+        except gen.TimeoutError:
+            raise
+        except Exception as ex:
+            raise exception.JobFailed(
+                "".join(traceback.format_exception_only(type(ex), ex))
+            )
+        raise gen.Return(res)
+
+    @gen.coroutine
+    def cancel(self):
+        raise gen.Return(self.future.cancel())
+
+
+class ProcessPoolJobService(JobService):
+    """Job queue class that runs jobs in pools of pre-forked processes,
+       one pool per priority, without Redis. Each process sets up the
+       application once, and runs its jobs on an IOLoop of its own."""
+
+    # processes per priority
+    PROCESSES = {
+        Jobs.HIGH: 1,
+        Jobs.NORMAL: multiprocessing.cpu_count(),
+        Jobs.LOW: 1,
+    }
+
+    def __init__(self):
+        super(ProcessPoolJobService, self).__init__()
+
+        self.pools = {}
+        self.pending = dict.fromkeys(self.PROCESSES, 0)
+        self._lock = threading.Lock()
+
+        # unique key => handle of the job holding it
+        self.unique = {}
+
+        if _in_pool_worker:
+            # jobs added by jobs run right away
+            return
+
+        # the futures of the pool are running once queued for a process,
+        # the processes tell when they start a job, and how long it took
+        global _pool_reports
+        self.reports = _pool_reports = multiprocessing.Queue()
+        thread = threading.Thread(
+            target=self._watch_reports, name="pool-reports"
+        )
+        thread.daemon = True
+        thread.start()
+
+        processes = dict(self.PROCESSES, **conf["jobs"].get("processes", {}))
+        for priority, count in processes.items():
+            self.pools[priority] = futures.ProcessPoolExecutor(count)
+            # fork the processes now, not on the first job
+            self.pools[priority].submit(_init_pool_worker)
+
+    def is_async(self):
+        return not _in_pool_worker
+
+    @gen.coroutine
+    def get_queue_depth(self, priority=None):
+        raise gen.Return(self.pending[priority or Jobs.NORMAL])
+
+    def _submit(self, job_id, func, args, kwargs, priority):
+        priority = priority or Jobs.NORMAL
+
+        logger.debug('Adding JOB "%s" on %s', func.__name__, priority)
+
+        with self._lock:
+            self.pending[priority] += 1
+
+        future = self.pools[priority].submit(
+            _run_pool_job,
+            job_id,
+            priority,
+            time.time(),
+            func.im_class,
+            func.__name__,
+            args,
+            kwargs,
+        )
+        future.add_done_callback(
+            functools.partial(self._job_done, job_id, priority)
+        )
+        return PoolJobHandle(job_id, future)
+
+    def _job_done(self, job_id, priority, future):
+        with self._lock:
+            self.pending[priority] -= 1
+
+        if not future.cancelled() and future.exception() is not None:
+            logger.critical(
+                "[EXCEPTION] Job id(%s) failed: %s", job_id, future.exception()
+            )
+
+    def _watch_reports(self):
+        while True:
+            kind, report = self.reports.get()
+            if kind == "started":
+                self._job_started(report)
+            else:
+                record_timing(*report)
+
+    def _job_started(self, job_id):
+        """
+        Release the unique key of the job, from now on an identical job is
+        added anew
+        """
+        with self._lock:
+            for unique_key, handle in self.unique.items():
+                if handle.id == job_id:
+                    del self.unique[unique_key]
+                    break
+
+    def _release_unique(self, unique_key, handle, future):
+        with self._lock:
+            if self.unique.get(unique_key) is handle:
+                del self.unique[unique_key]
+
+    @gen.coroutine
+    def add(
+        self,
+        func=None,
+        args=None,
+        kwargs=None,
+        priority=None,
+        depends_on=None,
+        unique_key=None,
+        debounce=None,
+        want_result=False,
+    ):
+        """
+        Submit a job calling `func` to the pool of its priority,
+        returns its JobHandle. A job with the `unique_key` of a job that
+        has not started yet is merged into it, `debounce` is ignored.
+        The result is always kept, `want_result` is ignored.
+        """
+        assert depends_on is None, "no job dependencies in a process pool"
+
+        if getattr(func, "batch", None):
+            # not batched across processes, a batch of the one call
+            args, kwargs = ([(args or (), kwargs or {})],), None
+
+        if _in_pool_worker:
+            res = yield func(*(args or ()), **(kwargs or {}))
+            raise gen.Return(RanJobHandle(str(uuid.uuid4()), res))
+
+        holder = self.unique.get(unique_key) if unique_key else None
+        if holder is not None and not holder.future.done():
+            metrics.registry.counter("jobs.coalesced").incr()
+            raise gen.Return(holder)
+
+        handle = self._submit(
+            str(uuid.uuid4()), func, args or (), kwargs or {}, priority
+        )
+        if unique_key:
+            with self._lock:
+                self.unique[unique_key] = handle
+            # released when it starts, or if it never does
+            handle.future.add_done_callback(
+                functools.partial(self._release_unique, unique_key, handle)
+            )
+        raise gen.Return(handle)
+
+    @gen.coroutine
+    def add_many(self, calls=None, priority=None, want_result=False):
+        handles = []
+        for func, args, kwargs in calls:
+            handle = yield self.add(
+                func=func, args=args, kwargs=kwargs, priority=priority
+            )
+            handles.append(handle)
+        raise gen.Return(handles)
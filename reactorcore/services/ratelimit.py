@@ -0,0 +1,200 @@
+"""
+Rate limits shared by all the processes, kept in Redis.
+
+    wait = yield self.app.service.ratelimit.acquire("mailchimp", rate=10)
+    if wait:
+        # no token left, try again in `wait` seconds
+
+A token bucket (`acquire`) lets bursts of up to `burst` calls through, and
+`rate` calls per `per` seconds on average. A sliding window (`hit`) lets
+at most `limit` calls through in any `window` seconds. Each check is one
+Lua script, so concurrent callers can't both take the last token.
+"""
+from __future__ import absolute_import
+
+import logging
+import time
+import uuid
+
+from redis.exceptions import RedisError
+from tornado import concurrent
+from tornado import gen
+
+from reactorcore.dao.redis import RedisSource
+from reactorcore.services.base import BaseService
+
+logger = logging.getLogger(__name__)
+
+"""
+Take tokens from a bucket refilled at a steady rate, returns the seconds to
+wait for them, 0 once they are taken
+
+KEYS: bucket
+ARGV: tokens per second, burst, now, tokens to take
+"""
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local wanted = tonumber(ARGV[4])
+
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or burst
+local at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+
+local wait = 0
+if tokens >= wanted then
+    tokens = tokens - wanted
+else
+    wait = (wanted - tokens) / rate
+end
+
+redis.call('hmset', KEYS[1], 'tokens', tokens, 'at', now)
+-- a full bucket needs no key
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 1)
+-- numbers are truncated to integers on the way out
+return tostring(wait)
+"""
+
+"""
+Count a call in a sliding window, returns the seconds to wait for the oldest
+call to leave the window, 0 once the call is counted
+
+KEYS: window
+ARGV: limit, window seconds, now, call id
+"""
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+redis.call('zremrangebyscore', KEYS[1], '-inf', now - window)
+if redis.call('zcard', KEYS[1]) < limit then
+    redis.call('zadd', KEYS[1], now, ARGV[4])
+    redis.call('expire', KEYS[1], math.ceil(window))
+    return '0'
+end
+
+local oldest = redis.call('zrange', KEYS[1], 0, 0, 'WITHSCORES')
+return tostring(tonumber(oldest[2]) + window - now)
+"""
+
+
+class RateLimitService(RedisSource, BaseService):
+    """
+    Redis-based rate limits. Limits fail open: when Redis is down, calls
+    go through.
+    """
+
+    def __init__(self):
+        super(RateLimitService, self).__init__(
+            name="RATELIMIT", cls=self.__class__
+        )
+        self.prefix = "ratelimit:"
+
+        self._token_bucket_script = self.client.register_script(
+            TOKEN_BUCKET_SCRIPT
+        )
+        self._sliding_window_script = self.client.register_script(
+            SLIDING_WINDOW_SCRIPT
+        )
+
+    def token_wait(self, key, rate, per=1, burst=None, tokens=1):
+        """
+        Take `tokens` from the bucket of `key`, refilled with `rate` tokens
+        every `per` seconds and holding `burst` at most (default `rate`).
+        Returns the seconds to wait for them, 0 once taken. Blocking, see
+        acquire.
+        """
+        try:
+            return float(
+                self._token_bucket_script(
+                    keys=[self.prefix + "bucket:" + key],
+                    args=[
+                        repr(float(rate) / per),
+                        burst or rate,
+                        repr(time.time()),
+                        tokens,
+                    ],
+                )
+            )
+        except RedisError as ex:
+            logger.critical(
+                "Error taking tokens of rate limit %s: %s", key, ex.message
+            )
+            return 0
+
+    def window_wait(self, key, limit, window):
+        """
+        Count a call in the window of `key`, which lets `limit` calls
+        through per `window` seconds. Returns the seconds to wait before
+        calling again, 0 once counted. Blocking, see hit.
+        """
+        try:
+            return float(
+                self._sliding_window_script(
+                    keys=[self.prefix + "window:" + key],
+                    args=[limit, window, repr(time.time()), uuid.uuid4().hex],
+                )
+            )
+        except RedisError as ex:
+            logger.critical(
+                "Error counting call of rate limit %s: %s", key, ex.message
+            )
+            return 0
+
+    @concurrent.run_on_executor
+    def acquire(self, key, rate, per=1, burst=None, tokens=1):
+        return self.token_wait(key, rate, per, burst, tokens)
+
+    @concurrent.run_on_executor
+    def hit(self, key, limit, window):
+        return self.window_wait(key, limit, window)
+
+
+class MemoryRateLimitService(BaseService):
+    """
+    Rate limits of this process only, to test without Redis
+    """
+
+    def __init__(self):
+        # key => (tokens, at)
+        self.buckets = {}
+        # key => [call times]
+        self.windows = {}
+
+    def token_wait(self, key, rate, per=1, burst=None, tokens=1, now=None):
+        now = time.time() if now is None else now
+        rate = float(rate) / per
+        burst = burst or rate * per
+
+        left, at = self.buckets.get(key, (burst, now))
+        left = min(burst, left + max(0, now - at) * rate)
+
+        wait = 0
+        if left >= tokens:
+            left -= tokens
+        else:
+            wait = (tokens - left) / rate
+
+        self.buckets[key] = (left, now)
+        return wait
+
+    def window_wait(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+
+        calls = [t for t in self.windows.get(key, []) if t > now - window]
+        self.windows[key] = calls
+        if len(calls) < limit:
+            calls.append(now)
+            return 0
+        return calls[0] + window - now
+
+    @gen.coroutine
+    def acquire(self, key, rate, per=1, burst=None, tokens=1):
+        raise gen.Return(self.token_wait(key, rate, per, burst, tokens))
+
+    @gen.coroutine
+    def hit(self, key, limit, window):
+        raise gen.Return(self.window_wait(key, limit, window))
@@ -40,6 +40,9 @@ default = {
     "host": socket.gethostname(),
     "jobs": {"backend": "reactorcore.services.jobs.ImmediateJobService"},
     "locale": "en_US",
+    "ratelimit": {
+        "backend": "reactorcore.services.ratelimit.RateLimitService"
+    },
     "redis": {"host": "localhost", "port": 6379, "db": 0, "timeout": 5},
     "scheme": "http",
     "secret": "S5etPPoGLXNAfAyND2cBwPMOuUBstu3bdrKtCYEJ4Ew=",
@@ -9,6 +9,9 @@ test = {
         "backend": "tests.integration.services.event.MemoryEventService",
         "polling_interval": 1000 * 10,
     },
+    "ratelimit": {
+        "backend": "reactorcore.services.ratelimit.MemoryRateLimitService"
+    },
     "redis": {"host": "localhost", "port": 6379, "db": 0, "timeout": 5},
     "jobs": {"backend": "reactorcore.services.jobs.ImmediateJobService"},
     "secret": "BKOJRQ1mqVX3K548cr8srOOXI2JBmv7Y66ZqqGaWRPc=",
@@ -0,0 +1,208 @@
+"""
+Worker autoscaling: start and stop native worker processes with the load.
+
+    policy = ScalingPolicy(min_workers=1, max_workers=8)
+    supervisor = Supervisor(policy)
+    PeriodicCallback(supervisor.check, 5000).start()
+
+Every check looks at the depth of the job queues and the age of their oldest
+job, and asks the policy how many workers to run. Workers are stopped with
+SIGTERM, so they finish their running jobs before exiting.
+"""
+from __future__ import absolute_import
+
+import logging
+import math
+import signal
+import subprocess
+import sys
+import time
+
+from redis.exceptions import RedisError
+from rq import Queue
+from tornado import concurrent
+from tornado import gen
+
+from reactorcore import application
+from reactorcore import metrics
+from reactorcore.dao import redis
+from reactorcore.services.jobs import Jobs
+from reactorcore.worker import get_queue_stats
+
+logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+
+class ScalingPolicy(object):
+    """
+    Number of workers to run for the queue stats. Scales up as soon as the
+    queues need it, one step to the size needed. Scales down one worker at
+    a time, once the queues stayed below the lower threshold for
+    `scale_down_delay` seconds, so a load around a threshold doesn't make
+    workers come and go. No change within `cooldown` seconds of the last.
+    """
+
+    # seconds the oldest job of a queue may wait, before adding a worker
+    MAX_AGE = {Jobs.HIGH: 10, Jobs.NORMAL: 60, Jobs.LOW: 600}
+
+    def __init__(
+        self,
+        min_workers=1,
+        max_workers=4,
+        jobs_per_worker=100,
+        max_age=None,
+        scale_down_ratio=0.5,
+        scale_down_delay=60,
+        cooldown=30,
+    ):
+        assert 0 < min_workers <= max_workers
+        assert 0 < scale_down_ratio <= 1
+
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.jobs_per_worker = jobs_per_worker
+        self.max_age = dict(self.MAX_AGE, **(max_age or {}))
+        self.scale_down_ratio = scale_down_ratio
+        self.scale_down_delay = scale_down_delay
+        self.cooldown = cooldown
+
+        self._changed_at = None
+        self._low_since = None
+
+    def _clamp(self, workers):
+        return max(self.min_workers, min(self.max_workers, workers))
+
+    def desired(self, workers, stats, now):
+        """
+        Workers to run, given the `workers` running and the
+        {queue: (depth, oldest age)} `stats`
+        """
+        if workers < self.min_workers:
+            # first start, or workers died
+            self._changed_at = now
+            return self.min_workers
+
+        depth = sum(d for d, _ in stats.values())
+        overdue = any(
+            age > self.max_age.get(name, self.MAX_AGE[Jobs.NORMAL])
+            for name, (_, age) in stats.items()
+        )
+        cooling = (
+            self._changed_at is not None
+            and now - self._changed_at < self.cooldown
+        )
+
+        up = int(math.ceil(float(depth) / self.jobs_per_worker))
+        if overdue:
+            up = max(up, workers + 1)
+        up = self._clamp(up)
+
+        if up > workers:
+            self._low_since = None
+            if cooling:
+                return workers
+            self._changed_at = now
+            return up
+
+        down = self._clamp(
+            int(
+                math.ceil(
+                    float(depth)
+                    / (self.jobs_per_worker * self.scale_down_ratio)
+                )
+            )
+        )
+        if overdue or down >= workers:
+            self._low_since = None
+            return workers
+
+        if self._low_since is None:
+            self._low_since = now
+        if now - self._low_since < self.scale_down_delay or cooling:
+            return workers
+
+        self._changed_at = now
+        self._low_since = now
+        return workers - 1
+
+
+class Supervisor(redis.RedisSource):
+    def __init__(self, policy, queue_names=None, command=None):
+        super(Supervisor, self).__init__(name="SUPERVISOR", cls=self.__class__)
+
+        self.policy = policy
+        self.queue_names = queue_names or [Jobs.HIGH, Jobs.NORMAL, Jobs.LOW]
+        self.command = (
+            command
+            or [sys.executable, "-m", "reactorcore.scripts.native_worker"]
+            + self.queue_names
+        )
+
+        # worker processes, oldest first
+        self.workers = []
+        # workers stopped, finishing their jobs
+        self.draining = []
+
+    @concurrent.run_on_executor
+    def get_queue_stats(self):
+        return get_queue_stats(
+            self.client,
+            [Queue(name, connection=self.client) for name in self.queue_names],
+        )
+
+    def reap(self):
+        """
+        Forget the workers that exited
+        """
+        for procs in (self.workers, self.draining):
+            for proc in [p for p in procs if p.poll() is not None]:
+                procs.remove(proc)
+                if proc.returncode and procs is self.workers:
+                    logger.critical(
+                        "Worker %s exited with %s", proc.pid, proc.returncode
+                    )
+
+    def scale_to(self, count):
+        while len(self.workers) < count:
+            proc = subprocess.Popen(self.command)
+            logger.info("Started worker %s", proc.pid)
+            self.workers.append(proc)
+
+        while len(self.workers) > count:
+            # the newest goes first
+            proc = self.workers.pop()
+            logger.info("Draining worker %s", proc.pid)
+            proc.send_signal(signal.SIGTERM)
+            self.draining.append(proc)
+
+    @gen.coroutine
+    def check(self):
+        self.reap()
+
+        try:
+            stats = yield self.get_queue_stats()
+        except RedisError as ex:
+            logger.critical("Error getting queue stats: %s", ex.message)
+            # keep what runs, but replace dead workers
+            self.scale_to(max(len(self.workers), self.policy.min_workers))
+            return
+
+        workers = len(self.workers)
+        count = self.policy.desired(workers, stats, time.time())
+        if count != workers:
+            logger.info(
+                "Scaling workers from %s to %s, queues %s",
+                workers,
+                count,
+                stats,
+            )
+            self.scale_to(count)
+
+        metrics.registry.gauge("jobs.workers").set(len(self.workers))
+        metrics.registry.gauge("jobs.workers.draining").set(len(self.draining))
+
+    def stop(self):
+        """
+        Drain all the workers
+        """
+        self.scale_to(0)
@@ -0,0 +1,156 @@
+"""
+Hierarchical timing wheel, to keep a large number of pending timers in memory.
+
+    wheel = TimerWheel(tick=0.1)
+    wheel.add(time.time() + 60, "key", item)
+
+    # later, get the items whose time has come
+    items = wheel.advance(time.time())
+
+Adding, cancelling and popping a timer are O(1). Level 0 of the wheel has one
+slot per tick, each next level has one slot per revolution of the level below.
+Timers are placed in the lowest level that covers their delay, and moved down
+a level ("cascaded") once the level below comes around to their slot.
+Timers never fire early: their time is rounded up to the next tick.
+"""
+import math
+import time
+
+
+class TimerWheel(object):
+    def __init__(self, tick=0.1, slots=256, levels=4, now=None):
+        assert tick > 0
+        assert slots > 1 and slots & (slots - 1) == 0, "slots: power of 2"
+
+        self.tick = tick
+        self.bits = slots.bit_length() - 1
+        self.mask = slots - 1
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+
+        # beyond the reach of the last level, looked at every revolution
+        self.overflow = []
+
+        # timers that were already due when added
+        self.due = []
+
+        # key => timer entry [tick, key, item]
+        self.timers = {}
+
+        # the last tick that has passed
+        self.current = self._passed_ticks(time.time() if now is None else now)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def _to_tick(self, t):
+        return int(math.ceil(t / self.tick))
+
+    def _passed_ticks(self, t):
+        return int(math.floor(t / self.tick))
+
+    def _place(self, entry):
+        delta = entry[0] - self.current
+
+        if delta <= 0:
+            self.due.append(entry)
+            return
+
+        for level, wheel in enumerate(self.wheels):
+            if delta < 1 << (self.bits * (level + 1)):
+                wheel[(entry[0] >> (self.bits * level)) & self.mask].append(
+                    entry
+                )
+                return
+
+        self.overflow.append(entry)
+
+    def add(self, at, key, item):
+        """
+        Add `item` to be popped at timestamp `at`,
+        replacing the timer for `key`, if any
+        """
+        self.cancel(key)
+
+        entry = [self._to_tick(at), key, item]
+        self.timers[key] = entry
+        self._place(entry)
+
+    def cancel(self, key):
+        """
+        Remove the timer for `key`, returns its item or None
+        """
+        entry = self.timers.pop(key, None)
+        if entry is None:
+            return None
+
+        # the entry stays in its slot, and is skipped when popped
+        item, entry[2] = entry[2], None
+        entry[1] = None
+        return item
+
+    def get_time(self, key):
+        """
+        Timestamp (rounded up to the tick) when the timer for `key` is due
+        """
+        entry = self.timers.get(key)
+        return entry[0] * self.tick if entry else None
+
+    def _cascade(self, level):
+        wheel = self.wheels[level]
+        index = (self.current >> (self.bits * level)) & self.mask
+        entries, wheel[index] = wheel[index], []
+
+        for entry in entries:
+            if entry[1] is not None:
+                self._place(entry)
+
+    def advance(self, now=None):
+        """
+        Move the wheel to timestamp `now`,
+        returns the items of all the timers that are due
+        """
+        target = self._passed_ticks(time.time() if now is None else now)
+        popped, self.due = self.due, []
+
+        while self.current < target:
+            if not self.timers:
+                # nothing pending, jump ahead
+                self.current = target
+                break
+
+            self.current += 1
+
+            # when a level comes full circle, bring down the next level's slot
+            level = 1
+            while level < len(self.wheels) and not (
+                self.current & ((1 << (self.bits * level)) - 1)
+            ):
+                self._cascade(level)
+                level += 1
+
+            if level == len(self.wheels):
+                overflow, self.overflow = self.overflow, []
+                for entry in overflow:
+                    if entry[1] is not None:
+                        self._place(entry)
+
+            wheel = self.wheels[0]
+            index = self.current & self.mask
+            popped.extend(wheel[index])
+            wheel[index] = []
+
+            popped.extend(self.due)
+            self.due = []
+
+        items = []
+        for entry in popped:
+            if entry[1] is None:
+                # cancelled
+                continue
+            del self.timers[entry[1]]
+            items.append(entry[2])
+
+        return items
@@ -256,10 +256,14 @@ def job(f):
         partial_f = functools.partial(f, *args, **kwargs)
 
         # If asynchronous, this code will run in a separate worker process.
-        # Create a new IO loop and run it.
+        # Create a new IO loop and run it, unless the native worker already
+        # runs jobs on its loop. Errors are logged, and fail the job.
         if jobs.is_async():
             try:
-                IOLoop.instance().run_sync(partial_f)
+                if getattr(jobs, "worker_loop", None) is not None:
+                    res = yield partial_f()
+                else:
+                    res = IOLoop.instance().run_sync(partial_f)
             except exception.NotFound:
                 ex_type, ex, last_tb = sys.exc_info()
                 tb = traceback.extract_tb(last_tb)
@@ -273,19 +277,7 @@ def job(f):
                     failed_code,
                     exc_info=True,
                 )
-            except exception.DuplicateError:
-                ex_type, ex, last_tb = sys.exc_info()
-                tb = traceback.extract_tb(last_tb)
-                file_name, line, func, failed_code = tb[-1]
-                logger.error(
-                    'Error: %s. Occurred at: %s:%s %s() in "%s"',
-                    ex.message,
-                    file_name,
-                    line,
-                    func,
-                    failed_code,
-                    exc_info=True,
-                )
+                raise
             except UnicodeEncodeError:
                 ex_type, ex, last_tb = sys.exc_info()
                 tb = traceback.extract_tb(last_tb)
@@ -299,6 +291,7 @@ def job(f):
                     failed_code,
                     exc_info=True,
                 )
+                raise
             except Exception:
                 ex_type, ex, last_tb = sys.exc_info()
                 tb = traceback.extract_tb(last_tb)
@@ -312,15 +305,60 @@ def job(f):
                     failed_code,
                     exc_info=True,
                 )
+                raise
         else:
             # already within IOLoop - just yield the future
-            yield partial_f()
+            res = yield partial_f()
 
-        raise gen.Return(None)
+        raise gen.Return(res)
 
     return decorated_function
 
 
+def batch_job(max_batch=100, max_wait=5):
+    """
+    Make a job method consume its calls in batches. It is added one call at
+    a time, and called once with the list of up to `max_batch` (args, kwargs)
+    added within `max_wait` seconds:
+
+        @batch_job(max_batch=500)
+        @job
+        @gen.coroutine
+        def index(self, calls):
+            ...
+
+        yield self.app.service.jobs.add(
+            self.app.service.item.index, args=(item_id,)
+        )
+    """
+
+    def decorator(f):
+        f.batch = {"max_batch": max_batch, "max_wait": max_wait}
+        return f
+
+    return decorator
+
+
+def rate_limit(key, rate, per=1, burst=None):
+    """
+    Run a job method at most `rate` times every `per` seconds, in bursts of
+    up to `burst`, across all the workers. A job over the limit is deferred
+    until a token is free, rather than failed:
+
+        @rate_limit("mailchimp", rate=10)
+        @job
+        @gen.coroutine
+        def subscribe(self, email):
+            ...
+    """
+
+    def decorator(f):
+        f.rate_limit = {"key": key, "rate": rate, "per": per, "burst": burst}
+        return f
+
+    return decorator
+
+
 def coroutine_partial(func, *args, **keywords):
     """Yields and raises as you would for coroutine and bakes
     the extra args and kwargs like a partial"""
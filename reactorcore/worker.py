@@ -0,0 +1,447 @@
+"""
+Native job worker, runs the jobs of the priority queues on one IOLoop.
+
+The stock RQ worker forks a process per job, in which `util.job` spins up a
+new IOLoop and `im_wrapper` builds a new service instance. This worker keeps
+one loop alive and runs up to `concurrency` coroutine jobs at once:
+
+    worker = NativeWorker([Jobs.HIGH, Jobs.NORMAL, Jobs.LOW], concurrency=50)
+    IOLoop.current().run_sync(worker.work)
+
+Jobs run on the loop, so they must not block it: use the DAOs, which run
+their Redis and database calls on executors.
+
+Queues are picked by weight rather than in strict order, so a busy `high`
+queue doesn't starve the others, and a queue whose oldest job waited too
+long goes first.
+"""
+from __future__ import absolute_import
+
+import datetime
+import logging
+import sys
+import time
+import traceback
+
+from redis.exceptions import RedisError, WatchError
+from rq import Queue
+from rq.compat.connections import patch_connection
+from rq.exceptions import DequeueTimeout
+from rq.job import Job, JobStatus
+from rq.queue import get_failed_queue
+from rq.registry import FinishedJobRegistry, StartedJobRegistry
+from rq.utils import utcformat, utcnow, utcparse
+from tornado import concurrent
+from tornado import gen
+from tornado import locks
+from tornado.ioloop import IOLoop
+
+from reactorcore import application
+from reactorcore import metrics
+from reactorcore.dao import redis
+from reactorcore.services.jobs import Jobs, get_rate_limit, record_timing
+
+logger = logging.getLogger(__name__)
+conf = application.get_conf()
+
+
+def get_queue_stats(client, queues):
+    """
+    {queue name: (number of jobs, seconds its oldest job waited)}
+    """
+    with client.pipeline() as pipe:
+        for q in queues:
+            pipe.llen(q.key)
+            pipe.lindex(q.key, 0)
+        replies = pipe.execute()
+    depths, heads = replies[::2], replies[1::2]
+
+    with client.pipeline() as pipe:
+        for job_id in heads:
+            if job_id:
+                pipe.hget(Job.key_for(job_id), "enqueued_at")
+        enqueued = iter(pipe.execute())
+
+    stats = {}
+    for q, depth, job_id in zip(queues, depths, heads):
+        enqueued_at = next(enqueued) if job_id else None
+        stats[q.name] = (
+            depth,
+            (utcnow() - utcparse(enqueued_at)).total_seconds()
+            if enqueued_at
+            else 0,
+        )
+    return stats
+
+
+class WeightedScheduler(object):
+    """
+    Smooth weighted round robin: every queue is tried first in proportion
+    to its weight, and its turns are spread out, eg. with weights
+    {"high": 6, "normal": 3, "low": 1} `low` comes first once every 10 picks.
+    """
+
+    def __init__(self, names, weights):
+        self.names = names
+        self.weights = {n: weights.get(n, 1) for n in names}
+        self.current = dict.fromkeys(names, 0)
+
+    def order(self, first=()):
+        """
+        Queue names in the order to try them for the next job,
+        `first` ahead of the others
+        """
+        total = sum(self.weights.values())
+        for name in self.names:
+            self.current[name] += self.weights[name]
+
+        pick = max(self.names, key=lambda n: self.current[n])
+        self.current[pick] -= total
+
+        rest = sorted(
+            (n for n in self.names if n != pick),
+            key=lambda n: -self.weights[n],
+        )
+        return list(first) + [n for n in [pick] + rest if n not in first]
+
+
+class NativeWorker(redis.RedisSource):
+    # jobs running at once
+    CONCURRENCY = 10
+
+    # share of the jobs taken from each queue, when they all have jobs
+    QUEUE_WEIGHTS = {Jobs.HIGH: 6, Jobs.NORMAL: 3, Jobs.LOW: 1}
+
+    # seconds the oldest job of a queue waits before its queue goes first
+    MAX_WAIT = 60
+
+    # seconds between checks of the oldest job of each queue
+    STARVATION_CHECK_INTERVAL = 1
+
+    # seconds between stats logs
+    STATS_INTERVAL = 60
+
+    # seconds a dequeue waits for a job, below the Redis socket timeout
+    DEQUEUE_TIMEOUT = 1
+
+    # seconds a finished job and its result are kept, as RQ does
+    RESULT_TTL = 500
+
+    def __init__(self, queue_names=None, concurrency=None, max_jobs=None):
+        super(NativeWorker, self).__init__(name="WORKER", cls=self.__class__)
+
+        self.queue_names = queue_names or [Jobs.HIGH, Jobs.NORMAL, Jobs.LOW]
+        self.concurrency = concurrency or conf["jobs"].get(
+            "concurrency", self.CONCURRENCY
+        )
+        self.slots = locks.Semaphore(self.concurrency)
+        self.running = 0
+        self._stopping = False
+
+        # stop after this many jobs, None to run until stopped
+        self.max_jobs = max_jobs
+        self.jobs_taken = 0
+
+        self.scheduler = WeightedScheduler(
+            self.queue_names,
+            conf["jobs"].get("queue_weights", self.QUEUE_WEIGHTS),
+        )
+        self.max_wait = conf["jobs"].get("max_wait", self.MAX_WAIT)
+        self._starved = []
+        self._checked_at = 0
+        self._stats_logged_at = time.time()
+
+    @property
+    def queues(self):
+        return [
+            Queue(name, connection=self.client) for name in self.queue_names
+        ]
+
+    def log_stats(self):
+        interval = conf["jobs"].get("stats_interval", self.STATS_INTERVAL)
+        now = time.time()
+        if now - self._stats_logged_at < interval:
+            return
+
+        self._stats_logged_at = now
+        logger.info("Job stats: %s", metrics.registry.snapshot("jobs."))
+
+    def stop(self):
+        """
+        Stop taking jobs, `work` returns once the running jobs are done
+        """
+        logger.info("Worker stopping, %s jobs running", self.running)
+        self._stopping = True
+
+    @gen.coroutine
+    def work(self):
+        """
+        Run jobs until stopped, or `max_jobs` were taken
+        """
+        jobs = application.get_application().service.jobs
+        # util.job runs the jobs on this loop instead of a loop of their own
+        jobs.worker_loop = IOLoop.current()
+
+        logger.info(
+            "Worker started on %s, %s jobs at once",
+            ", ".join(self.queue_names),
+            self.concurrency,
+        )
+
+        try:
+            while not self._stopping:
+                yield self.slots.acquire()
+                if self._stopping:
+                    self.slots.release()
+                    break
+
+                try:
+                    dequeued = yield self._dequeue()
+                except RedisError as ex:
+                    logger.critical("Error dequeueing jobs: %s", ex.message)
+                    dequeued = None
+                    yield gen.sleep(self.DEQUEUE_TIMEOUT)
+
+                self.log_stats()
+
+                if dequeued is None:
+                    self.slots.release()
+                    continue
+
+                IOLoop.current().spawn_callback(self.perform, dequeued[0])
+
+                self.jobs_taken += 1
+                if self.max_jobs and self.jobs_taken >= self.max_jobs:
+                    logger.info("Worker took its %s jobs", self.max_jobs)
+                    self.stop()
+
+            # wait for the running jobs
+            for _ in range(self.concurrency):
+                yield self.slots.acquire()
+            for _ in range(self.concurrency):
+                self.slots.release()
+        finally:
+            jobs.worker_loop = None
+
+        logger.info("Worker stopped")
+
+    def _starved_queues(self):
+        """
+        Names of the queues whose oldest job waited more than `max_wait`
+        seconds, oldest first. Checked at most every
+        STARVATION_CHECK_INTERVAL, and kept in the
+        `jobs.<queue>.oldest_wait` gauges.
+        """
+        now = time.time()
+        if now - self._checked_at < self.STARVATION_CHECK_INTERVAL:
+            return self._starved
+        self._checked_at = now
+
+        waits = {
+            name: oldest_wait
+            for name, (_, oldest_wait) in get_queue_stats(
+                self.client, self.queues
+            ).items()
+        }
+        for name, oldest_wait in waits.items():
+            metrics.registry.gauge("jobs.%s.oldest_wait" % name).set(
+                oldest_wait
+            )
+
+        self._starved = sorted(
+            (n for n in waits if waits[n] > self.max_wait),
+            key=lambda n: -waits[n],
+        )
+        return self._starved
+
+    @concurrent.run_on_executor
+    def _dequeue(self):
+        """
+        Next (job, queue) of the queues, in the order of the scheduler,
+        None when they stayed empty for DEQUEUE_TIMEOUT
+        """
+        queues = {q.name: q for q in self.queues}
+        ordered = [
+            queues[n] for n in self.scheduler.order(self._starved_queues())
+        ]
+
+        try:
+            dequeued = Queue.dequeue_any(ordered, None, connection=self.client)
+            if dequeued is None:
+                # all empty, wait for a job in any of them
+                dequeued = Queue.dequeue_any(
+                    ordered, self.DEQUEUE_TIMEOUT, connection=self.client
+                )
+        except DequeueTimeout:
+            return None
+        return dequeued
+
+    @gen.coroutine
+    def perform(self, job):
+        """
+        Run `job` on the loop, and record its outcome like RQ does.
+        A job past its timeout is failed, but keeps its slot until it ends.
+        """
+        self.running += 1
+        started = None
+        future = None
+        try:
+            limit = get_rate_limit(
+                job.kwargs.get("cls"), job.kwargs.get("f_name")
+            )
+            if limit:
+                ratelimit = application.get_application().service.ratelimit
+                wait = yield ratelimit.acquire(**limit)
+                if wait:
+                    # over the limit, queued again once a token is free
+                    yield self._defer_job(job, wait)
+                    metrics.registry.counter("jobs.deferred").incr()
+                    return
+
+            waited = (
+                (utcnow() - job.enqueued_at).total_seconds()
+                if job.enqueued_at
+                else None
+            )
+            yield self._start_job(job)
+
+            started = time.time()
+            try:
+                result = job.func(*job.args, **job.kwargs)
+                if gen.is_future(result):
+                    future = result
+                    result = yield gen.with_timeout(
+                        datetime.timedelta(
+                            seconds=job.timeout or Queue.DEFAULT_TIMEOUT
+                        ),
+                        future,
+                    )
+            except Exception:
+                exc_info = sys.exc_info()
+                logger.critical(
+                    "[EXCEPTION] Job %s %s failed",
+                    job.id,
+                    job.func_name,
+                    exc_info=True,
+                )
+                self._record_timing(job, waited, started, failed=True)
+                yield self._fail_job(job, exc_info)
+            else:
+                self._record_timing(job, waited, started)
+                yield self._finish_job(job, result)
+
+        except RedisError as ex:
+            logger.critical("Error recording job %s: %s", job.id, ex.message)
+            yield self._recover_job(job, started, traceback.format_exc())
+
+        finally:
+            if future is not None and not future.done():
+                # timed out, the coroutine can't be stopped
+                IOLoop.current().add_future(future, self._release_slot)
+            else:
+                self._release_slot()
+
+    def _release_slot(self, future=None):
+        self.running -= 1
+        self.slots.release()
+
+    def _record_timing(self, job, waited, started, failed=False):
+        record_timing(
+            job.origin,
+            job.kwargs.get("cls"),
+            job.kwargs.get("f_name") or job.func_name,
+            waited,
+            time.time() - started,
+            failed,
+        )
+
+    def _pipeline(self):
+        """
+        A StrictRedis pipeline on our connection, RQ's registries call
+        zadd(key, score, member) on the pipelines they are given
+        """
+        return patch_connection(self.client)._pipeline()
+
+    @concurrent.run_on_executor
+    def _recover_job(self, job, started, exc_info):
+        """
+        Put back a job whose run couldn't be recorded: at the front of its
+        queue if it didn't start, else in the failed queue, not to run it
+        twice
+        """
+        try:
+            if started is None:
+                Queue(job.origin, connection=self.client).push_job_id(
+                    job.id, at_front=True
+                )
+                logger.info("Requeued job %s", job.id)
+            else:
+                get_failed_queue(self.client).quarantine(job, exc_info)
+                logger.info("Quarantined job %s", job.id)
+        except RedisError as ex:
+            logger.critical("Job %s is lost: %s", job.id, ex.message)
+
+    @concurrent.run_on_executor
+    def _defer_job(self, job, seconds):
+        logger.debug("Deferring job %s by %.2fs", job.id, seconds)
+        application.get_application().service.jobs.defer_job(job, seconds)
+
+    @concurrent.run_on_executor
+    def _start_job(self, job):
+        job.started_at = utcnow()
+        with self._pipeline() as pipe:
+            StartedJobRegistry(job.origin, self.client).add(
+                job, (job.timeout or Queue.DEFAULT_TIMEOUT) + 60, pipeline=pipe
+            )
+            job.set_status(JobStatus.STARTED, pipeline=pipe)
+            pipe.hset(job.key, "started_at", utcformat(job.started_at))
+            pipe.execute()
+
+    @concurrent.run_on_executor
+    def _finish_job(self, job, result):
+        job.ended_at = utcnow()
+        job._result = result
+
+        queue = Queue(job.origin, connection=self.client)
+        result_ttl = job.get_result_ttl(self.RESULT_TTL)
+
+        with self._pipeline() as pipe:
+            while True:
+                try:
+                    # dependents added meanwhile make execute() fail
+                    pipe.watch(job.dependents_key)
+                    # calls multi() on the pipeline
+                    queue.enqueue_dependents(job, pipeline=pipe)
+
+                    if result_ttl != 0:
+                        job.set_status(JobStatus.FINISHED, pipeline=pipe)
+                        job.save(pipeline=pipe, include_meta=False)
+                        FinishedJobRegistry(job.origin, self.client).add(
+                            job, result_ttl, pipe
+                        )
+
+                    job.cleanup(
+                        result_ttl, pipeline=pipe, remove_from_queue=False
+                    )
+                    StartedJobRegistry(job.origin, self.client).remove(
+                        job, pipeline=pipe
+                    )
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+
+    @concurrent.run_on_executor
+    def _fail_job(self, job, exc_info):
+        job.ended_at = utcnow()
+
+        with self._pipeline() as pipe:
+            job.set_status(JobStatus.FAILED, pipeline=pipe)
+            StartedJobRegistry(job.origin, self.client).remove(
+                job, pipeline=pipe
+            )
+            pipe.execute()
+
+        get_failed_queue(self.client).quarantine(
+            job, exc_info="".join(traceback.format_exception(*exc_info))
+        )
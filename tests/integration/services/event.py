@@ -1,7 +1,8 @@
 import json
 from tornado import gen
 from reactorcore.services.event import AbstractEventService
-from reactorcore.model import Event
+from reactorcore.models import Event
+from reactorcore import util
 
 
 class MemoryEventService(AbstractEventService):
@@ -10,6 +11,7 @@ class MemoryEventService(AbstractEventService):
         self.events = list()
         self.processed_events = list()
         self.time = 0  # seconds
+        self.dedup_keys = dict()
 
     @gen.coroutine
     def queue_ready_events(self):
@@ -27,15 +29,42 @@ class MemoryEventService(AbstractEventService):
         return ready_events
 
     @gen.coroutine
-    def create_event(self, event, group_by=None):
+    def create_event(self, event, group_by=None, dedup_key=None, dedup_ttl=None):
         # copy
         e = Event().from_dict(event.to_dict())
+        e.id = util.gen_random_string(size=12)
+
+        if dedup_key:
+            expires_at, event_id = self.dedup_keys.get(dedup_key, (-1, None))
+            if expires_at > self.time:
+                # the id of the original event
+                e.id = event_id
+                raise gen.Return(e)
+            self.dedup_keys[dedup_key] = (
+                self.time + (dedup_ttl or 60 * 60), e.id)
 
         # fake json serializing to ensure serialization works
         json.dumps(e.data)
 
         e.group = group_by
         self.events.append((self.time, e))
+        raise gen.Return(e)
+
+    @gen.coroutine
+    def cancel_event(self, event_id):
+        remaining = [(t, e) for t, e in self.events if e.id != event_id]
+        cancelled = len(remaining) != len(self.events)
+        self.events = remaining
+        raise gen.Return(cancelled)
+
+    @gen.coroutine
+    def reschedule_event(self, event_id, ready_after):
+        for t, e in self.events:
+            if e.id == event_id:
+                # ripe `ready_after` seconds from now
+                e.ready_after = self.time - t + ready_after
+                raise gen.Return(True)
+        raise gen.Return(False)
 
     def forward_time_by(self, seconds):
         self.time = self.time + seconds
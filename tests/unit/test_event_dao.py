@@ -0,0 +1,370 @@
+import json
+import time
+import unittest
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import models
+from reactorcore.dao.event import (
+    STREAM_REDIS_VERSION, EventDao, StreamEventDao, TimerEventDao,
+    batch_ready_at, lane_quotas)
+from tests.unit.test_supervisor import redis_available
+
+
+def redis_version():
+    if not redis_available():
+        return ()
+    version = EventDao().client.info('server')['redis_version']
+    return tuple(map(int, version.split('.')[:2]))
+
+
+class TestEventDao(unittest.TestCase):
+
+    def test_encode_decode(self):
+        event = models.Event(
+            handler='app.service.item.handler',
+            ready_after=60,
+            data={'item_id': 1},
+            created_at='2018-10-27 10:00:00')
+
+        payload = EventDao.encode(event)
+
+        # compact keys, empty fields are not stored
+        self.assertEqual(
+            json.loads(payload),
+            {'h': 'app.service.item.handler', 'r': 60,
+             'd': {'item_id': 1}, 'c': '2018-10-27 10:00:00'})
+
+        decoded = models.Event() << EventDao.decode('abc', payload)
+        self.assertEqual(decoded.id, 'abc')
+        self.assertEqual(decoded.handler, event.handler)
+        self.assertEqual(decoded.ready_after, event.ready_after)
+        self.assertEqual(decoded.data, event.data)
+        self.assertEqual(decoded.group, None)
+
+    def test_load_stream_entries(self):
+        event = models.Event(handler='app.handler', ready_after=0, data={'a': 1})
+        entries = [
+            ['1-0', ['id', 'abc', 'payload', EventDao.encode(event)]],
+            # deleted while pending
+            ['2-0', None],
+        ]
+
+        events = StreamEventDao()._load_entries(entries)
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].id, 'abc')
+        self.assertEqual(events[0].stream_id, '1-0')
+        self.assertEqual(events[0].data, {'a': 1})
+
+    def test_batch_ready_at(self):
+        policy = {'min_wait': 10, 'max_wait': 100, 'max_batch': 5}
+
+        # ready_after after the first event
+        self.assertEqual(batch_ready_at(1000, 1000, 60, 1, policy), 1060)
+        # pushed back by events coming in
+        self.assertEqual(batch_ready_at(1000, 1055, 60, 2, policy), 1065)
+        # up to max_wait
+        self.assertEqual(batch_ready_at(1000, 1095, 60, 3, policy), 1100)
+        # full
+        self.assertEqual(batch_ready_at(1000, 1020, 60, 5, policy), 1020)
+        # no policy, same as a plain group
+        self.assertEqual(batch_ready_at(1000, 1020, 60, 5, {}), 1060)
+
+    def test_lane_quotas(self):
+        # high, normal, low
+        self.assertEqual(lane_quotas(-1), [-1, -1, -1])
+        self.assertEqual(lane_quotas(100), [60, 30, 10])
+        self.assertEqual(lane_quotas(5), [4, 1, 0])
+        self.assertEqual(
+            lane_quotas(10, {'high': 1, 'normal': 1, 'low': 0}), [5, 5, 0])
+
+
+class TestTimerEventDao(AsyncTestCase):
+
+    def event(self, data, ready_after=0):
+        return models.Event(
+            handler='app.handler', ready_after=ready_after, data=data)
+
+    @gen_test
+    def test_cancel_and_reschedule_in_the_wheel(self):
+        dao = TimerEventDao()
+        grouped = yield dao.create_event(self.event(1, 60), group_by='item')
+        other = yield dao.create_event(self.event(2, 60), group_by='item')
+        batched = yield dao.create_event(
+            self.event(3, 60), group_by='item', batching={'max_batch': 5})
+        self.assertEqual(other.score, grouped.score)
+        self.assertEqual(len(dao.wheel), 3)
+
+        # out of its group, the group key stays for the other event
+        rescheduled = yield dao.reschedule_event(grouped.id, 0)
+        self.assertTrue(rescheduled)
+        # goes with its batch
+        rescheduled = yield dao.reschedule_event(batched.id, 0)
+        self.assertFalse(rescheduled)
+
+        yield gen.sleep(0.15)
+        events = yield dao.pop_ready_events()
+        self.assertEqual([e.id for e in events], [grouped.id])
+        self.assertIsNone(events[0].group)
+        self.assertIn(other.group, dao.groups)
+
+        self.assertTrue((yield dao.cancel_event(batched.id)))
+        self.assertTrue((yield dao.cancel_event(other.id)))
+        self.assertFalse((yield dao.cancel_event(other.id)))
+        # the batch, now empty
+        self.assertEqual(len(dao.wheel), 1)
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestEventDaoWithRedis(AsyncTestCase):
+
+    def setUp(self):
+        super(TestEventDaoWithRedis, self).setUp()
+        self.dao = EventDao()
+        self.clear()
+
+    def tearDown(self):
+        self.clear()
+        super(TestEventDaoWithRedis, self).tearDown()
+
+    def clear(self):
+        keys = self.dao.client.keys('event*')
+        if keys:
+            self.dao.client.delete(*keys)
+
+    def event(self, data, ready_after=0, **kwargs):
+        return models.Event(
+            handler='app.handler', ready_after=ready_after, data=data,
+            **kwargs)
+
+    @gen_test
+    def test_create_then_pop(self):
+        created = yield self.dao.create_event(self.event({'a': 1}))
+        later = yield self.dao.create_event(self.event({'b': 2}, 60))
+
+        # the schedule only holds the ids, the payloads are in the hash
+        self.assertEqual(
+            self.dao.client.zrange('event', 0, -1), [created.id, later.id])
+        self.assertEqual(
+            json.loads(self.dao.client.hget('event:data', created.id))['d'],
+            {'a': 1})
+
+        events = yield self.dao.pop_ready_events()
+
+        self.assertEqual([e.id for e in events], [created.id])
+        self.assertEqual(events[0].data, {'a': 1})
+        self.assertEqual(events[0].handler, 'app.handler')
+        self.assertEqual(self.dao.client.zrange('event', 0, -1), [later.id])
+        self.assertEqual(self.dao.client.hkeys('event:data'), [later.id])
+
+    @gen_test
+    def test_cancel(self):
+        created = yield self.dao.create_event(self.event({'a': 1}))
+
+        cancelled = yield self.dao.cancel_event(created.id)
+        self.assertTrue(cancelled)
+        cancelled = yield self.dao.cancel_event(created.id)
+        self.assertFalse(cancelled)
+
+        self.assertEqual(self.dao.client.zcard('event'), 0)
+        self.assertEqual(self.dao.client.hlen('event:data'), 0)
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual(events, [])
+
+    @gen_test
+    def test_reschedule_takes_the_event_out_of_its_group(self):
+        data = {'ids': [], 'big': 12345678901234567, 'ts': 1700000000.123456}
+        grouped = yield self.dao.create_event(
+            self.event(data, 60), group_by='item')
+        other = yield self.dao.create_event(
+            self.event({'a': 1}, 60), group_by='item')
+        payload = self.dao.client.hget('event:data', grouped.id)
+
+        rescheduled = yield self.dao.reschedule_event(grouped.id, 0)
+        self.assertTrue(rescheduled)
+
+        # only the group is gone from the payload, the data is as it was
+        group = ',"g":%s' % json.dumps(grouped.group)
+        self.assertIn(group, payload)
+        self.assertEqual(
+            self.dao.client.hget('event:data', grouped.id),
+            payload.replace(group, ''))
+
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual([e.id for e in events], [grouped.id])
+        self.assertEqual(events[0].data, data)
+        self.assertIsNone(events[0].group)
+        # the group key of the other event is still there
+        self.assertTrue(self.dao.client.exists(other.group))
+
+        rescheduled = yield self.dao.reschedule_event(grouped.id, 0)
+        self.assertFalse(rescheduled)
+
+    @gen_test
+    def test_dedup_key_keeps_the_original_event(self):
+        first = yield self.dao.create_event(
+            self.event({'a': 1}, 60), dedup_key='once')
+        again = yield self.dao.create_event(
+            self.event({'a': 2}, 60), dedup_key='once')
+
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(self.dao.client.get('event:dedup:once'), first.id)
+        self.assertGreater(self.dao.client.ttl('event:dedup:once'), 0)
+        # no second payload nor schedule entry
+        self.assertEqual(self.dao.client.zrange('event', 0, -1), [first.id])
+        self.assertEqual(self.dao.client.hkeys('event:data'), [first.id])
+        self.assertEqual(
+            json.loads(self.dao.client.hget('event:data', first.id))['d'],
+            {'a': 1})
+
+
+    @gen.coroutine
+    def create_batch(self, count, batching, ready_after=60, first=0):
+        created = []
+        for i in range(first, first + count):
+            e = yield self.dao.create_event(
+                self.event({'i': i}, ready_after), group_by='item',
+                batching=batching)
+            created.append(e)
+        raise gen.Return(created)
+
+    @gen_test
+    def test_a_full_batch_is_ripe_right_away(self):
+        batching = {'max_batch': 3}
+        created = yield self.create_batch(2, batching)
+
+        # scheduled as a whole, not its members
+        self.assertEqual(
+            self.dao.client.zrange('event', 0, -1), [created[0].group])
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual(events, [])
+
+        created += yield self.create_batch(1, batching, first=2)
+        events = yield self.dao.pop_ready_events()
+
+        self.assertEqual(
+            sorted(e.id for e in events), sorted(e.id for e in created))
+        self.assertEqual(sorted(e.data['i'] for e in events), [0, 1, 2])
+        self.assertFalse(self.dao.client.exists(created[0].group))
+        self.assertEqual(self.dao.client.hlen('event:data'), 0)
+
+    @gen_test
+    def test_late_events_join_the_batch_until_it_is_popped(self):
+        batching = {'max_batch': 2}
+        created = yield self.create_batch(2, batching)
+        # ripe, not popped yet
+        created += yield self.create_batch(1, batching)
+
+        # cancelled members are left out
+        cancelled = yield self.dao.cancel_event(created[0].id)
+        self.assertTrue(cancelled)
+
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual(
+            sorted(e.id for e in events), sorted(e.id for e in created[1:]))
+
+    @gen_test
+    def test_batch_waits_within_its_bounds(self):
+        # pushed back by min_wait, up to max_wait after the first event
+        created = yield self.create_batch(
+            2, {'min_wait': 60, 'max_wait': 0.2}, ready_after=0)
+        score = self.dao.client.zscore('event', created[0].group)
+        self.assertLessEqual(score, time.time() + 0.2)
+
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual(events, [])
+
+        yield gen.sleep(0.25)
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual(len(events), 2)
+
+
+    @gen_test
+    def test_lanes_get_their_share_of_a_limited_pop(self):
+        for i in range(10):
+            for priority in ('high', 'low', None):
+                yield self.dao.create_event(
+                    self.event({'i': i}, priority=priority))
+
+        self.assertEqual(
+            [self.dao.client.zcard(lane) for lane in self.dao.lanes],
+            [10, 10, 10])
+        backlog = yield self.dao.get_backlog()
+        self.assertEqual(backlog['high.ripe'], 10)
+        self.assertEqual(backlog['ripe'], 30)
+
+        events = yield self.dao.pop_ready_events(limit=10)
+        self.assertEqual(
+            [e.priority for e in events], ['high'] * 6 + [None] * 3 + ['low'])
+
+        # lanes with nothing left give their share to the others
+        events = yield self.dao.pop_ready_events(limit=10)
+        events += yield self.dao.pop_ready_events(limit=10)
+        self.assertEqual(
+            sorted(e.priority for e in events),
+            [None] * 7 + ['high'] * 4 + ['low'] * 9)
+        events = yield self.dao.pop_ready_events()
+        self.assertEqual(len(events), 0)
+
+
+@unittest.skipUnless(
+    redis_version() >= STREAM_REDIS_VERSION, 'needs a local redis-server 6.2')
+class TestStreamEventDaoWithRedis(AsyncTestCase):
+
+    def setUp(self):
+        super(TestStreamEventDaoWithRedis, self).setUp()
+        self.dao = StreamEventDao()
+        self.clear()
+
+    def tearDown(self):
+        self.clear()
+        super(TestStreamEventDaoWithRedis, self).tearDown()
+
+    def clear(self):
+        keys = self.dao.client.keys('event*')
+        if keys:
+            self.dao.client.delete(*keys)
+
+    @gen_test
+    def test_feed_read_ack_and_claim(self):
+        grouped = yield self.dao.create_event(
+            models.Event(handler='app.handler', ready_after=0, data={'a': 1}),
+            group_by='item')
+        other = yield self.dao.create_event(
+            models.Event(handler='app.handler', ready_after=0, data={'b': 2}))
+
+        moved = yield self.dao.feed_ready_events()
+        self.assertEqual(moved, 2)
+        # out of the schedule, and the group is done with
+        self.assertEqual(self.dao.client.zcard('event'), 0)
+        self.assertEqual(self.dao.client.hlen('event:data'), 0)
+        self.assertFalse(self.dao.client.exists(grouped.group))
+
+        events = yield self.dao.read_events('first', 10)
+        self.assertEqual(
+            sorted((e.id, e.data) for e in events),
+            sorted([(grouped.id, {'a': 1}), (other.id, {'b': 2})]))
+        self.assertTrue(all(e.stream_id for e in events))
+        again = yield self.dao.read_events('first', 10)
+        self.assertEqual(again, [])
+
+        acked, stalled = events
+        yield self.dao.ack_events([acked.stream_id])
+
+        backlog = yield self.dao.get_backlog()
+        self.assertEqual(backlog['stream'], 1)
+        self.assertEqual(backlog['unacknowledged'], 1)
+
+        # the one left pending goes to another consumer
+        claimed = yield self.dao.claim_stalled_events('second', 0, 10)
+        self.assertEqual([e.id for e in claimed], [stalled.id])
+        self.assertEqual(claimed[0].data, stalled.data)
+        claimed = yield self.dao.claim_stalled_events('second', 60, 10)
+        self.assertEqual(claimed, [])
@@ -0,0 +1,365 @@
+import json
+import time
+import unittest
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import exception
+from reactorcore.models import Event
+from reactorcore.services import event
+from tests.unit.test_supervisor import redis_available
+
+
+class StubEventService(event.AbstractEventService):
+    """
+    Resolves `app.` handlers on itself
+    """
+
+    def __init__(self):
+        self.app = self
+        self.processed = []
+
+    queue_ready_events = None
+    create_event = None
+    cancel_event = None
+    reschedule_event = None
+
+    @gen.coroutine
+    def on_item(self, events):
+        self.processed.extend(e.data for e in events)
+
+    @gen.coroutine
+    def on_broken(self, events):
+        raise ValueError('broken handler')
+
+
+class TestEventService(AsyncTestCase):
+
+    def setUp(self):
+        super(TestEventService, self).setUp()
+        self.service = StubEventService()
+
+    def tearDown(self):
+        event._handlers.clear()
+        event._handler_concurrency.clear()
+        event._handler_batching.clear()
+        super(TestEventService, self).tearDown()
+
+    def test_register_handler(self):
+        @event.event_handler('test.registered', concurrency=1)
+        def registered(events):
+            pass
+
+        self.assertIs(
+            self.service._get_event_handler('test.registered'), registered)
+        self.assertEqual(event._handler_concurrency['test.registered'], 1)
+
+    def test_check_handlers(self):
+        self.service.check_handlers(['app.on_item'])
+        self.assertIn('app.on_item', event._handlers)
+
+        with self.assertRaises(exception.UnknownEventHandler):
+            self.service.check_handlers(['app.on_item', 'app.missing'])
+
+    @gen_test
+    def test_process_events_isolates_failures(self):
+        events = [
+            Event(handler='app.on_item', data=1, ready_after=0),
+            Event(handler='app.on_broken', data=2, ready_after=0),
+            Event(handler='app.on_item', data=3, ready_after=0),
+        ]
+
+        failed = yield self.service.process_events(events=events)
+
+        self.assertEqual(sorted(self.service.processed), [1, 3])
+        self.assertEqual(len(failed), 1)
+        handler, failed_events = failed[0]
+        self.assertEqual(handler, 'app.on_broken')
+        self.assertEqual([e.data for e in failed_events], [2])
+
+    @gen_test
+    def test_process_events_splits_large_groups(self):
+        calls = []
+
+        @event.event_handler('test.batched', batching={'max_batch': 2})
+        @gen.coroutine
+        def batched(events):
+            calls.append([e.data for e in events])
+
+        events = [
+            Event(handler='test.batched', data=i, ready_after=0, group='g')
+            for i in range(5)
+        ]
+
+        yield self.service.process_events(events=events)
+
+        self.assertEqual(sorted(calls), [[0, 1], [2, 3], [4]])
+
+    def test_split_events(self):
+        events = [
+            Event(handler='app.on_item', data=i, ready_after=0)
+            for i in range(5)
+        ]
+        for i, group in enumerate(['g1', 'g1', 'g2']):
+            events.append(Event(
+                handler='app.on_item', data=10 + i, ready_after=0, group=group))
+
+        batches = self.service.split_events(events, chunk_size=2)
+
+        self.assertEqual(
+            sorted([e.data for e in batch] for batch in batches),
+            [[0, 1], [2, 3], [4], [10, 11], [12]])
+
+
+class TestEventRetries(AsyncTestCase):
+
+    def setUp(self):
+        super(TestEventRetries, self).setUp()
+        self.service = event.TimerEventService()
+
+    def test_retry_delay(self):
+        backoff = self.service.RETRY_BACKOFF
+        self.assertEqual(self.service.retry_delay(1), backoff)
+        self.assertEqual(self.service.retry_delay(3), backoff * 4)
+        self.assertEqual(
+            self.service.retry_delay(100), self.service.MAX_RETRY_DELAY)
+
+    @gen_test
+    def test_retry_then_dead_letter(self):
+        events = [
+            Event(id='e1', handler='h', data=1, ready_after=0, group='g'),
+            Event(id='e2', handler='h', data=2, ready_after=0, group='g'),
+        ]
+
+        lost = yield self.service.retry_failed_events([('h', events)])
+
+        self.assertEqual(lost, [])
+        self.assertIn('e1', self.service.DAO.wheel)
+        self.assertEqual([e.attempts for e in events], [1, 1])
+        self.assertEqual(events[0].group, 'g:retry')
+
+        # popped and failed again
+        for e in events:
+            self.service.DAO.wheel.cancel(e.id)
+        events[0].attempts = self.service.MAX_ATTEMPTS - 1
+        yield self.service.retry_failed_events([('h', events)])
+
+        dead = yield self.service.get_dead_events()
+        self.assertEqual([e.id for e in dead], ['e1', 'e2'])
+        self.assertEqual(len(self.service.DAO.wheel), 0)
+
+        redriven = yield self.service.redrive_dead_events(['e2'])
+        self.assertEqual(redriven, 1)
+        self.assertIsNone(events[1].attempts)
+        self.assertIn('e2', self.service.DAO.wheel)
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestEventRetriesWithRedis(AsyncTestCase):
+
+    def setUp(self):
+        super(TestEventRetriesWithRedis, self).setUp()
+        self.service = event.EventService()
+        self.client = self.service.DAO.client
+        self.clear()
+
+    def tearDown(self):
+        self.clear()
+        super(TestEventRetriesWithRedis, self).tearDown()
+
+    def clear(self):
+        keys = self.client.keys('event*')
+        if keys:
+            self.client.delete(*keys)
+
+    @gen_test
+    def test_retry_dead_letter_then_redrive(self):
+        data = {'ids': [], 'big': 12345678901234567}
+        created = yield self.service.DAO.create_event(Event(
+            handler='app.on_item', data=data, ready_after=0,
+            priority='high'))
+        events = yield self.service.DAO.pop_ready_events()
+
+        lost = yield self.service.retry_failed_events([('app.on_item', events)])
+
+        self.assertEqual(lost, [])
+        score = self.client.zscore('event:high', created.id)
+        self.assertGreater(score, time.time())
+
+        # failed again on its last attempt
+        self.client.zadd('event:high', created.id, 0)
+        events = yield self.service.DAO.pop_ready_events()
+        self.assertEqual(events[0].attempts, 1)
+        events[0].attempts = self.service.MAX_ATTEMPTS - 1
+        yield self.service.retry_failed_events([('app.on_item', events)])
+
+        self.assertIsNone(self.client.zscore('event:high', created.id))
+        self.assertIsNotNone(self.client.zscore('event:dead', created.id))
+        dead = json.loads(self.client.hget('event:dead:data', created.id))
+        self.assertEqual(dead['d'], data)
+        self.assertEqual(dead['a'], self.service.MAX_ATTEMPTS)
+
+        redriven = yield self.service.redrive_dead_events([created.id])
+
+        self.assertEqual(redriven, 1)
+        self.assertEqual(self.client.zcard('event:dead'), 0)
+        self.assertEqual(self.client.hlen('event:dead:data'), 0)
+        # back in its lane, with a clean slate of attempts
+        self.assertIsNotNone(self.client.zscore('event:high', created.id))
+        events = yield self.service.DAO.pop_ready_events()
+        self.assertEqual([e.id for e in events], [created.id])
+        self.assertEqual(events[0].data, data)
+        self.assertEqual(events[0].priority, 'high')
+        self.assertIsNone(events[0].attempts)
+
+        redriven = yield self.service.redrive_dead_events([created.id])
+        self.assertEqual(redriven, 0)
+
+
+class TestTimerEventService(AsyncTestCase):
+
+    def setUp(self):
+        super(TestTimerEventService, self).setUp()
+        self.service = event.TimerEventService()
+        self.calls = []
+
+        @event.event_handler('test.timer')
+        @gen.coroutine
+        def timer(events):
+            self.calls.append(sorted(e.data for e in events))
+
+    def tearDown(self):
+        event._handlers.clear()
+        super(TestTimerEventService, self).tearDown()
+
+    @gen.coroutine
+    def create(self, data, ready_after, **kwargs):
+        created = yield self.service.create_event(
+            Event(handler='test.timer', data=data, ready_after=ready_after),
+            **kwargs)
+        raise gen.Return(created)
+
+    @gen_test
+    def test_create_cancel_and_reschedule(self):
+        later = yield self.create(1, 0.5)
+        cancelled = yield self.create(2, 60)
+        rescheduled = yield self.create(3, 60)
+
+        self.assertTrue((yield self.service.cancel_event(cancelled.id)))
+        self.assertFalse((yield self.service.cancel_event(cancelled.id)))
+        self.assertTrue(
+            (yield self.service.reschedule_event(rescheduled.id, 0)))
+        self.assertFalse(
+            (yield self.service.reschedule_event(cancelled.id, 0)))
+
+        # ripe on the next tick
+        yield self.service.queue_ready_events()
+        self.assertEqual(self.calls, [])
+        yield gen.sleep(0.25)
+        yield self.service.queue_ready_events()
+        self.assertEqual(self.calls, [[3]])
+
+        yield gen.sleep(0.35)
+        yield self.service.queue_ready_events()
+        self.assertEqual(self.calls, [[3], [1]])
+        self.assertEqual(len(self.service.DAO.wheel), 0)
+        self.assertTrue(later.id)
+
+    @gen_test
+    def test_grouped_events_are_processed_together(self):
+        yield self.create(1, 0.3, group_by='item')
+        # a dedup hit is not scheduled again
+        first = yield self.create(3, 0.3, dedup_key='once')
+        again = yield self.create(3, 0.3, dedup_key='once')
+        self.assertEqual(again.id, first.id)
+        yield gen.sleep(0.1)
+        yield self.create(2, 0.3, group_by='item')
+
+        # the group fires at the time of its first event
+        yield gen.sleep(0.3)
+        yield self.service.queue_ready_events()
+        self.assertEqual(sorted(self.calls), [[1, 2], [3]])
+
+
+class TestEventPump(AsyncTestCase):
+
+    def setUp(self):
+        super(TestEventPump, self).setUp()
+        self.service = event.TimerEventService()
+        self.service.BATCH_SIZE = 3
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.service._enqueue_events = self.enqueue_events
+
+    @gen.coroutine
+    def enqueue_events(self, events):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        yield gen.sleep(0.01)
+        self.batches.append([e.data for e in events])
+        self.in_flight -= 1
+
+    @gen_test
+    def test_pump_drains_in_bounded_stages(self):
+        for i in range(10):
+            self.service.DAO.wheel.add(
+                0, i, Event(id=str(i), handler='h', data=i, ready_after=0))
+
+        yield self.service._queue_ready_events()
+
+        self.assertEqual([len(b) for b in self.batches], [3, 3, 3, 1])
+        self.assertEqual(
+            sorted(i for b in self.batches for i in b), range(10))
+        self.assertEqual(self.max_in_flight, self.service.PUMP_STAGES)
+
+    @gen_test
+    def test_pump_weighs_priorities(self):
+        for i in range(10):
+            for priority in ('high', 'low', None):
+                key = '%s-%s' % (priority, i)
+                self.service.DAO.wheel.add(0, key, Event(
+                    id=key, handler='h', data=key, ready_after=0,
+                    priority=priority))
+
+        events = yield self.service.DAO.pop_ready_events(limit=10)
+
+        self.assertEqual(
+            [e.priority for e in events], ['high'] * 6 + [None] * 3 + ['low'])
+
+        # lanes with nothing left give their share to the others
+        events = yield self.service.DAO.pop_ready_events(limit=10)
+        events += yield self.service.DAO.pop_ready_events(limit=10)
+        self.assertEqual(
+            sorted(e.priority for e in events),
+            [None] * 7 + ['high'] * 4 + ['low'] * 9)
+
+
+class TestImmediateEventService(AsyncTestCase):
+
+    def tearDown(self):
+        event._handlers.clear()
+        super(TestImmediateEventService, self).tearDown()
+
+    @gen_test
+    def test_duplicate_gets_the_id_of_the_original_event(self):
+        service = event.ImmediateEventService()
+        processed = []
+
+        @event.event_handler('test.immediate')
+        def immediate(events):
+            processed.extend(e.data for e in events)
+
+        e = Event(handler='test.immediate', data=1, ready_after=0)
+        first = yield service.create_event(e, dedup_key='once')
+        again = yield service.create_event(e, dedup_key='once')
+
+        self.assertTrue(first.id)
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(processed, [1])
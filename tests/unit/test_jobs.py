@@ -0,0 +1,594 @@
+import os
+import pickle
+import unittest
+import uuid
+import zlib
+
+from rq import Queue, SimpleWorker
+from rq.queue import get_failed_queue
+from tornado import concurrent, gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import exception
+from reactorcore import metrics
+from reactorcore import util
+from reactorcore.services import jobs
+from tests.unit.test_supervisor import redis_available
+from tests.unit.test_worker import Limited
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.calls = []
+
+    @gen.coroutine
+    def record(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        raise gen.Return(len(self.calls))
+
+    @util.batch_job(max_batch=10)
+    @gen.coroutine
+    def record_batch(self, calls):
+        self.calls.append(calls)
+        raise gen.Return(len(calls))
+
+
+class BatchService(object):
+
+    @util.batch_job(max_batch=3, max_wait=0.1)
+    @gen.coroutine
+    def index(self, calls):
+        raise gen.Return([args[0] for args, kwargs in calls])
+
+
+class CpuService(object):
+
+    @util.job
+    @gen.coroutine
+    def pid(self, offset=0):
+        raise gen.Return(os.getpid() + offset)
+
+    @util.job
+    @gen.coroutine
+    def nap(self, seconds):
+        yield gen.sleep(seconds)
+
+    @util.job
+    @gen.coroutine
+    def broken(self):
+        raise ValueError('broken job')
+
+
+class TestImmediateJobService(AsyncTestCase):
+
+    @gen_test
+    def test_add_returns_a_handle_on_the_result(self):
+        recorder = Recorder()
+        service = jobs.ImmediateJobService()
+
+        handle = yield service.add(recorder.record, args=('a',))
+
+        res = yield handle.result(timeout=1)
+        self.assertEqual(res, 1)
+        cancelled = yield handle.cancel()
+        self.assertFalse(cancelled)
+
+    @gen_test
+    def test_add_many_runs_the_calls_in_order(self):
+        recorder = Recorder()
+        service = jobs.ImmediateJobService()
+
+        yield service.add_many([
+            (recorder.record, (1,), None),
+            (recorder.record, None, {'b': 2}),
+            (recorder.record, (3,), {'c': 4}),
+        ], priority=jobs.Jobs.LOW)
+
+        self.assertEqual(recorder.calls, [
+            ((1,), {}),
+            ((), {'b': 2}),
+            ((3,), {'c': 4}),
+        ])
+
+    @gen_test
+    def test_jobs_are_timed(self):
+        metrics.registry.reset()
+        service = jobs.ImmediateJobService()
+
+        yield service.add(Recorder().record, priority=jobs.Jobs.HIGH)
+        with self.assertRaises(ValueError):
+            yield service.add(CpuService().broken)
+
+        self.assertEqual(
+            metrics.registry.histogram('jobs.high.run.seconds').count, 1)
+        self.assertEqual(
+            metrics.registry.histogram('jobs.Recorder.record.wait.seconds')
+            .snapshot()['max'], 0)
+        self.assertEqual(metrics.registry.counter('jobs.normal.failed').value, 1)
+        self.assertEqual(
+            metrics.registry.counter('jobs.CpuService.broken.failed').value, 1)
+
+    @gen_test
+    def test_batch_jobs_run_each_call_as_a_batch(self):
+        recorder = Recorder()
+        service = jobs.ImmediateJobService()
+
+        handle = yield service.add(
+            recorder.record_batch, args=(1,), kwargs={'b': 2})
+
+        res = yield handle.result()
+        self.assertEqual(res, 1)
+        self.assertEqual(recorder.calls, [[((1,), {'b': 2})]])
+
+
+class TestResultListener(AsyncTestCase):
+
+    @gen_test
+    def test_notify_resolves_the_waiters_of_the_job(self):
+        listener = jobs.ResultListener(None)
+        # waiters are registered as wait() does, without the thread
+        first, second, other = (concurrent.Future() for _ in range(3))
+        listener.waiters = {
+            'job-1': [(self.io_loop, first), (self.io_loop, second)],
+            'job-2': [(self.io_loop, other)],
+        }
+
+        listener.forget('job-1', second)
+        listener._notify('job-1')
+        yield first
+
+        self.assertFalse(second.done())
+        self.assertFalse(other.done())
+        self.assertEqual(list(listener.waiters), ['job-2'])
+
+
+class TestJobBlobs(AsyncTestCase):
+
+    def test_large_calls_are_packed_once(self):
+        service = jobs.JobService()
+        events = [str(i) * 1024 for i in range(100)]
+        wrapper = {'cls': Recorder, 'f_name': 'record', 'job_id': 'job-1'}
+
+        blobs = {}
+        packed = [
+            service._pack_call((), dict(wrapper, events=events), blobs)
+            for _ in range(2)
+        ]
+        small = service._pack_call((1,), dict(wrapper, events=['x']), blobs)
+
+        self.assertEqual(len(blobs), 1)
+        digest, = blobs.keys()
+        self.assertEqual(packed[0], packed[1])
+        self.assertEqual(packed[0], ((), dict(wrapper, blob=digest)))
+        self.assertEqual(small, ((1,), dict(wrapper, events=['x'])))
+
+        args, kwargs = pickle.loads(zlib.decompress(blobs[digest]))
+        self.assertEqual(args, ())
+        self.assertEqual(kwargs, {'events': events})
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestJobServiceWithRedis(AsyncTestCase):
+
+    def setUp(self):
+        super(TestJobServiceWithRedis, self).setUp()
+        self.service = jobs.JobService()
+
+    @gen_test(timeout=10)
+    def test_handles_get_the_results_stored_by_the_worker(self):
+        done = jobs.JobHandle(self.service, str(uuid.uuid4()))
+        failed = jobs.JobHandle(self.service, str(uuid.uuid4()))
+        waiting = [done.result(timeout=5), failed.result(timeout=5)]
+
+        # as a worker runs them
+        res = yield jobs.im_wrapper(
+            1, cls=Recorder, f_name='record', job_id=done.id,
+            want_result=True)
+        with self.assertRaises(ValueError):
+            yield jobs.im_wrapper(
+                cls=CpuService, f_name='broken', job_id=failed.id,
+                want_result=True)
+
+        self.assertEqual((yield waiting[0]), res)
+        with self.assertRaises(exception.JobFailed):
+            yield waiting[1]
+        # stored already
+        self.assertEqual((yield done.result(timeout=5)), res)
+
+    @gen_test(timeout=10)
+    def test_results_are_only_stored_when_wanted(self):
+        client = self.service.client
+        handle = yield self.service.add(
+            CpuService().nap, args=(0,), priority=jobs.Jobs.LOW)
+        wanted = yield self.service.add(
+            CpuService().nap, args=(0,), priority=jobs.Jobs.LOW,
+            want_result=True)
+        key = str(uuid.uuid4())
+        unique = yield self.service.add(
+            CpuService().nap, args=(0,), priority=jobs.Jobs.LOW,
+            unique_key=key)
+        many = yield self.service.add_many(
+            [(CpuService().nap, (0,), None)], priority=jobs.Jobs.LOW)
+
+        self.assertFalse(handle.stored)
+        self.assertTrue(wanted.stored)
+        self.assertTrue(unique.stored)
+        self.assertFalse(many[0].stored)
+        with self.assertRaises(AssertionError):
+            yield handle.result(timeout=1)
+
+        # as a worker runs them
+        queue = self.service._get_queue(jobs.Jobs.LOW)
+        for h in (handle, wanted, unique, many[0]):
+            job = jobs.Job.fetch(h.id, connection=client)
+            yield jobs.im_wrapper(*job.args, **job.kwargs)
+            queue.remove(h.id)
+
+        self.assertIsNone(client.get(self.service.result_key(handle.id)))
+        self.assertIsNone(client.get(self.service.result_key(many[0].id)))
+        self.assertIsNone((yield wanted.result(timeout=5)))
+        self.assertIsNone((yield unique.result(timeout=5)))
+
+    @gen_test(timeout=10)
+    def test_cancel_takes_the_job_off_its_queue(self):
+        handle = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            want_result=True)
+        waiting = handle.result(timeout=5)
+
+        self.assertTrue((yield handle.cancel()))
+        with self.assertRaises(exception.JobCancelled):
+            yield waiting
+        self.assertFalse((yield handle.cancel()))
+
+    @gen_test(timeout=10)
+    def test_unique_jobs_merge_until_the_job_starts(self):
+        key = str(uuid.uuid4())
+        first = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key)
+        merged = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key)
+        self.assertEqual(merged.id, first.id)
+
+        # as the worker does when the job starts
+        yield self.service.release_unique(key, first.id)
+        second = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key)
+        self.assertNotEqual(second.id, first.id)
+
+        self.assertTrue((yield first.cancel()))
+        self.assertTrue((yield second.cancel()))
+        # released by the cancel
+        self.assertIsNone(
+            self.service.client.get(self.service.unique_key(key)))
+
+    @gen_test(timeout=10)
+    def test_debounced_jobs_are_queued_after_the_last_add(self):
+        key = str(uuid.uuid4())
+        client = self.service.client
+        queue = self.service._get_queue(jobs.Jobs.LOW)
+
+        handle = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key, debounce=0.2)
+        yield gen.sleep(0.1)
+        merged = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key, debounce=0.2)
+        self.assertEqual(merged.id, handle.id)
+
+        # pushed back by the second add
+        yield gen.sleep(0.15)
+        yield self.service.queue_delayed_jobs()
+        self.assertNotIn(handle.id, queue.job_ids)
+
+        yield gen.sleep(0.1)
+        yield self.service.queue_delayed_jobs()
+        self.assertIn(handle.id, queue.job_ids)
+        self.assertIsNone(client.zscore(self.service.delayed_key, handle.id))
+        job = jobs.Job.fetch(handle.id, connection=client)
+        self.assertEqual(job.get_status(), jobs.JobStatus.QUEUED)
+
+        self.assertTrue((yield handle.cancel()))
+
+    @gen_test(timeout=10)
+    def test_cancel_a_debounced_job(self):
+        key = str(uuid.uuid4())
+        handle = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key, debounce=60)
+
+        self.assertTrue((yield handle.cancel()))
+        client = self.service.client
+        self.assertIsNone(client.zscore(self.service.delayed_key, handle.id))
+        self.assertIsNone(client.get(self.service.unique_key(key)))
+        self.assertFalse((yield handle.cancel()))
+
+        again = yield self.service.add(
+            CpuService().nap, args=(1,), priority=jobs.Jobs.LOW,
+            unique_key=key, debounce=60)
+        self.assertNotEqual(again.id, handle.id)
+        self.assertTrue((yield again.cancel()))
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestRqWorkerWithRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.service = jobs.JobService()
+        self.queue = Queue('test-rq', connection=self.service.client)
+        self.queue.empty()
+        jobs._instances.pop(Recorder, None)
+        self.metric_keys = [
+            self.service.metrics_key(prefix + name)
+            for prefix in ('jobs.test-rq.', 'jobs.Recorder.record.')
+            for name in ('wait.seconds', 'run.seconds', 'failed')
+        ]
+        self.service.client.delete(*self.metric_keys)
+
+    def tearDown(self):
+        self.queue.empty()
+        self.service.client.delete(*self.metric_keys)
+
+    def test_the_stock_worker_runs_the_wrappers_on_a_loop(self):
+        job_id = str(uuid.uuid4())
+        job = self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(1,),
+            kwargs={'cls': Recorder, 'f_name': 'record', 'job_id': job_id,
+                    'want_result': True})
+
+        worker = SimpleWorker([self.queue], connection=self.service.client)
+        worker.work(burst=True)
+
+        job.refresh()
+        self.assertEqual(job.get_status(), jobs.JobStatus.FINISHED)
+        self.assertEqual(job.result, 1)
+        stored = pickle.loads(
+            self.service.client.get(self.service.result_key(job_id)))
+        self.assertEqual(
+            stored, {'status': jobs.JobResult.FINISHED, 'value': 1})
+
+        # the timing outlives the work horse
+        timing = IOLoop.current().run_sync(
+            lambda: self.service.get_stored_timing('jobs.test-rq.'))
+        self.assertEqual(timing['jobs.test-rq.wait.seconds']['count'], 1)
+        self.assertEqual(timing['jobs.test-rq.run.seconds']['count'], 1)
+        self.assertEqual(timing['jobs.test-rq.failed'], 0)
+
+    def test_the_stock_worker_fails_util_job_errors(self):
+        job_id = str(uuid.uuid4())
+        job = self.queue.enqueue_call(
+            func=jobs.im_wrapper,
+            kwargs={'cls': CpuService, 'f_name': 'broken', 'job_id': job_id,
+                    'want_result': True})
+
+        # the jobs service of a worker, util.job runs on its loop
+        service = application.get_application().service
+        immediate = service.jobs
+        service.jobs = self.service
+        try:
+            worker = SimpleWorker([self.queue], connection=self.service.client)
+            worker.work(burst=True)
+        finally:
+            service.jobs = immediate
+
+        job.refresh()
+        self.assertEqual(job.get_status(), jobs.JobStatus.FAILED)
+        self.assertIn('ValueError: broken job', job.exc_info)
+        stored = pickle.loads(
+            self.service.client.get(self.service.result_key(job_id)))
+        self.assertEqual(
+            stored, {'status': jobs.JobResult.FAILED,
+                     'value': 'ValueError: broken job\n'})
+        get_failed_queue(self.service.client).remove(job.id)
+
+    def test_util_job_errors_are_raised_out_of_a_worker_too(self):
+        service = application.get_application().service
+        immediate = service.jobs
+        # async, no worker loop: the job runs on a loop of its own
+        service.jobs = self.service
+        try:
+            future = CpuService().broken()
+        finally:
+            service.jobs = immediate
+
+        with self.assertRaises(ValueError):
+            future.result()
+
+    def test_the_stock_worker_defers_jobs_over_their_rate_limit(self):
+        client = self.service.client
+        client.delete('ratelimit:bucket:test-limited')
+        Limited.calls = []
+
+        self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(1,),
+            kwargs={'cls': Limited, 'f_name': 'echo'})
+        job_id = str(uuid.uuid4())
+        deferred = self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(2,),
+            kwargs={'cls': Limited, 'f_name': 'echo', 'job_id': job_id,
+                    'want_result': True})
+
+        worker = SimpleWorker([self.queue], connection=client)
+        worker.work(burst=True)
+
+        # not run, and kept until it runs again
+        self.assertEqual(Limited.calls, [1])
+        self.assertIsNotNone(client.zscore('job:delayed', deferred.id))
+        self.assertEqual(client.ttl(deferred.key), None)
+        self.assertIsNone(client.get(self.service.result_key(job_id)))
+
+        client.zadd('job:delayed', deferred.id, 0)
+        client.delete('ratelimit:bucket:test-limited')
+        IOLoop.current().run_sync(self.service.queue_delayed_jobs)
+        worker.work(burst=True)
+
+        self.assertEqual(Limited.calls, [1, 2])
+        stored = pickle.loads(client.get(self.service.result_key(job_id)))
+        self.assertEqual(
+            stored, {'status': jobs.JobResult.FINISHED, 'value': 2})
+        # with the result TTL of the worker back
+        self.assertGreater(client.ttl(deferred.key), 0)
+        client.delete('ratelimit:bucket:test-limited')
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestBatchJobsWithRedis(AsyncTestCase):
+    priority = 'test-batch'
+
+    def setUp(self):
+        super(TestBatchJobsWithRedis, self).setUp()
+        self.service = jobs.JobService()
+        self.client = self.service.client
+        self.queue = self.service._get_queue(self.priority)
+        self.batch_key = self.service.batch_key(
+            BatchService, 'index', self.priority)
+        self.cleanup()
+
+    def tearDown(self):
+        self.cleanup()
+        super(TestBatchJobsWithRedis, self).tearDown()
+
+    def cleanup(self):
+        job_id = self.client.get(self.batch_key)
+        if job_id:
+            self.client.zrem(self.service.delayed_key, job_id)
+            self.client.delete(self.service.batch_calls_key(job_id))
+        self.client.delete(self.batch_key)
+        self.queue.empty()
+
+    @gen.coroutine
+    def add(self, i):
+        handle = yield self.service.add(
+            BatchService().index, args=(i,), priority=self.priority)
+        raise gen.Return(handle.id)
+
+    @gen.coroutine
+    def run(self, job_id):
+        # as the worker does
+        self.client.lrem(self.queue.key, job_id)
+        res = yield jobs.batch_wrapper(
+            BatchService, 'index', self.priority, job_id)
+        raise gen.Return(res)
+
+    @gen_test(timeout=10)
+    def test_a_full_batch_is_queued_right_away(self):
+        ids = yield [self.add(i) for i in range(3)]
+
+        self.assertEqual(len(set(ids)), 1)
+        self.assertEqual(self.queue.job_ids, ids[:1])
+        self.assertIsNone(self.client.get(self.batch_key))
+        self.assertIsNone(
+            self.client.zscore(self.service.delayed_key, ids[0]))
+
+        # the next call starts a new batch
+        new_id = yield self.add(3)
+        self.assertNotEqual(new_id, ids[0])
+        self.assertEqual(self.queue.job_ids, ids[:1])
+
+        res = yield self.run(ids[0])
+        self.assertEqual(sorted(res), [0, 1, 2])
+        self.assertFalse(
+            self.client.exists(self.service.batch_calls_key(ids[0])))
+
+    @gen_test(timeout=10)
+    def test_a_batch_is_queued_after_its_max_wait(self):
+        first = yield self.add(0)
+        yield gen.sleep(0.15)
+        yield self.service.queue_delayed_jobs()
+        self.assertEqual(self.queue.job_ids, [first])
+
+        # still joins its batch until the job starts
+        self.assertEqual((yield self.add(1)), first)
+
+        res = yield self.run(first)
+        self.assertEqual(res, [0, 1])
+        # taking the calls closed the batch
+        self.assertIsNone(self.client.get(self.batch_key))
+        self.assertNotEqual((yield self.add(2)), first)
+
+    @gen_test(timeout=10)
+    def test_a_batch_filled_after_its_max_wait_is_queued_once(self):
+        first = yield self.add(0)
+        yield gen.sleep(0.15)
+        yield self.service.queue_delayed_jobs()
+
+        # fills up once queue_delayed_jobs queued it
+        ids = yield [self.add(i) for i in (1, 2)]
+        self.assertEqual(ids, [first, first])
+        self.assertEqual(self.queue.job_ids, [first])
+        self.assertIsNone(self.client.get(self.batch_key))
+
+        res = yield self.run(first)
+        self.assertEqual(sorted(res), [0, 1, 2])
+
+
+class TestProcessPoolJobService(AsyncTestCase):
+
+    @gen_test(timeout=30)
+    def test_runs_jobs_in_the_pools(self):
+        metrics.registry.reset()
+        service = jobs.ProcessPoolJobService()
+
+        handles = yield service.add_many([
+            (CpuService().pid, None, {'offset': 0}),
+            (CpuService().pid, None, None),
+        ], priority=jobs.Jobs.LOW)
+        pids = yield [h.result(timeout=20) for h in handles]
+
+        # the low pool has one process
+        self.assertEqual(len(set(pids)), 1)
+        self.assertNotEqual(pids[0], os.getpid())
+
+        handle = yield service.add(CpuService().broken)
+        with self.assertRaises(exception.JobFailed):
+            yield handle.result(timeout=20)
+
+        # the processes report the timing of their jobs to the service
+        run = metrics.registry.histogram('jobs.low.run.seconds')
+        failed = metrics.registry.counter('jobs.CpuService.broken.failed')
+        for _ in range(100):
+            if run.count == 2 and failed.value:
+                break
+            yield gen.sleep(0.05)
+        self.assertEqual(run.count, 2)
+        self.assertEqual(
+            metrics.registry.histogram('jobs.CpuService.pid.wait.seconds')
+            .count, 2)
+        self.assertEqual(failed.value, 1)
+
+        for pool in service.pools.values():
+            pool.shutdown()
+
+    @gen_test(timeout=30)
+    def test_merges_jobs_with_the_key_of_a_pending_job(self):
+        service = jobs.ProcessPoolJobService()
+        low = jobs.Jobs.LOW
+
+        # keeps the only process of the low pool busy
+        yield service.add(CpuService().nap, args=(0.5,), priority=low)
+        first = yield service.add(
+            CpuService().pid, priority=low, unique_key='pid')
+        second = yield service.add(
+            CpuService().pid, priority=low, unique_key='pid')
+
+        self.assertIs(first, second)
+        yield first.result(timeout=20)
+
+        third = yield service.add(
+            CpuService().pid, priority=low, unique_key='pid')
+        self.assertIsNot(third, first)
+        yield third.result(timeout=20)
+
+        for pool in service.pools.values():
+            pool.shutdown()
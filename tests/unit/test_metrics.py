@@ -0,0 +1,47 @@
+import unittest
+
+from reactorcore import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        self.registry.counter('a.hits').incr()
+        self.registry.counter('a.hits').incr(2)
+        self.registry.counter('b.hits').incr()
+
+        self.assertEqual(self.registry.counter('a.hits').value, 3)
+        self.assertEqual(self.registry.snapshot(), {'a.hits': 3, 'b.hits': 1})
+        self.assertEqual(self.registry.snapshot(prefix='b.'), {'b.hits': 1})
+
+    def test_ratio(self):
+        names = ['dedup.hits', 'dedup.misses']
+        self.assertEqual(self.registry.ratio('dedup.hits', names), None)
+
+        self.registry.counter('dedup.hits').incr()
+        self.registry.counter('dedup.misses').incr(3)
+        self.assertEqual(self.registry.ratio('dedup.hits', names), 0.25)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('handler.seconds')
+        self.assertEqual(histogram.snapshot(), {'count': 0})
+
+        for value in [0.002] * 90 + [0.2] * 9 + [42]:
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        self.assertEqual(snapshot['max'], 42)
+        self.assertAlmostEqual(snapshot['mean'], (0.18 + 1.8 + 42) / 100)
+        # upper bound of the bucket
+        self.assertEqual(snapshot['p50'], 0.0025)
+        self.assertEqual(snapshot['p95'], 0.25)
+        # the last bucket is capped by the max
+        self.assertEqual(histogram.percentile(1), 42)
+
+    def test_gauge(self):
+        self.registry.gauge('events.pending').set(12)
+        self.assertEqual(self.registry.snapshot(), {'events.pending': 12})
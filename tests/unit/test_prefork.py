@@ -0,0 +1,55 @@
+import os
+import signal
+import unittest
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import prefork
+
+
+class ShortLivedPrefork(prefork.PreforkWorker):
+    """
+    Children exit right away, as if they took all their jobs
+    """
+
+    def __init__(self, spawns, **kwargs):
+        super(ShortLivedPrefork, self).__init__(**kwargs)
+        self.spawns = spawns
+        self.pids = []
+
+    def load(self):
+        pass
+
+    def _run_child(self):
+        pass
+
+    def spawn(self):
+        if len(self.pids) == self.spawns:
+            self.stop()
+            return
+        super(ShortLivedPrefork, self).spawn()
+        self.pids.extend(self.children - set(self.pids))
+
+
+class TestPreforkWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.handlers = {
+            signum: signal.getsignal(signum)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+
+    def tearDown(self):
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+
+    def test_replaces_children_that_exit(self):
+        pool = ShortLivedPrefork(5, processes=2, max_jobs=1)
+        pool.run()
+
+        self.assertEqual(len(set(pool.pids)), 5)
+        self.assertNotIn(os.getpid(), pool.pids)
+        self.assertEqual(pool.children, set())
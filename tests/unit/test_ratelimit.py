@@ -0,0 +1,125 @@
+import time
+import unittest
+import uuid
+
+from tornado import gen
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore.handlers.api.base import BaseApiHandler
+from reactorcore.services.ratelimit import (
+    MemoryRateLimitService, RateLimitService)
+from tests.unit.test_supervisor import redis_available
+
+
+class LimitedHandler(BaseApiHandler):
+    rate_limit = (2, 60)
+
+    @gen.coroutine
+    def prepare(self):
+        self.request.id = 'test'
+        yield super(LimitedHandler, self).prepare()
+
+    # no masking of the request data, nor users
+    def log_request(self):
+        pass
+
+    def authenticate(self):
+        pass
+
+    def get(self):
+        self.write({})
+
+
+class TestMemoryRateLimitService(unittest.TestCase):
+
+    def test_token_bucket_lets_bursts_through_then_the_rate(self):
+        limits = MemoryRateLimitService()
+
+        waits = [limits.token_wait('api', rate=2, burst=3, now=0)
+                 for _ in range(4)]
+        self.assertEqual(waits, [0, 0, 0, 0.5])
+
+        # a token every half second
+        self.assertEqual(limits.token_wait('api', rate=2, now=0.5), 0)
+        self.assertEqual(limits.token_wait('api', rate=2, now=0.5), 0.5)
+        # other keys have their own bucket
+        self.assertEqual(limits.token_wait('other', rate=2, now=0.5), 0)
+
+    def test_sliding_window_counts_the_last_calls(self):
+        limits = MemoryRateLimitService()
+
+        for now in (0, 1, 2):
+            self.assertEqual(limits.window_wait('api', 3, 10, now=now), 0)
+
+        self.assertEqual(limits.window_wait('api', 3, 10, now=5), 5)
+        # the first call left the window
+        self.assertEqual(limits.window_wait('api', 3, 10, now=10.5), 0)
+        self.assertEqual(limits.window_wait('api', 3, 10, now=10.5), 0.5)
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestRateLimitServiceWithRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.limits = RateLimitService()
+        self.key = uuid.uuid4().hex
+
+    def tearDown(self):
+        self.limits.client.delete(
+            'ratelimit:bucket:' + self.key, 'ratelimit:window:' + self.key)
+
+    def test_token_bucket_lets_bursts_through_then_the_rate(self):
+        waits = [self.limits.token_wait(self.key, rate=20, burst=3)
+                 for _ in range(4)]
+
+        self.assertEqual(waits[:3], [0, 0, 0])
+        # a token every 50ms
+        self.assertAlmostEqual(waits[3], 0.05, delta=0.01)
+
+        time.sleep(0.06)
+        self.assertEqual(self.limits.token_wait(self.key, rate=20), 0)
+        self.assertGreater(self.limits.token_wait(self.key, rate=20), 0)
+
+    def test_sliding_window_counts_the_last_calls(self):
+        for _ in range(3):
+            self.assertEqual(self.limits.window_wait(self.key, 3, 0.2), 0)
+
+        wait = self.limits.window_wait(self.key, 3, 0.2)
+        self.assertGreater(wait, 0.1)
+        self.assertLessEqual(wait, 0.2)
+
+        # the calls left the window
+        time.sleep(wait + 0.01)
+        self.assertEqual(self.limits.window_wait(self.key, 3, 0.2), 0)
+
+
+class TestRateLimitedApiHandler(AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.service = application.get_application().service
+        self.ratelimit = self.service.ratelimit
+        self.service.ratelimit = MemoryRateLimitService()
+        super(TestRateLimitedApiHandler, self).setUp()
+
+    def tearDown(self):
+        self.service.ratelimit = self.ratelimit
+        super(TestRateLimitedApiHandler, self).tearDown()
+
+    def get_app(self):
+        return Application([('/limited', LimitedHandler)])
+
+    def test_calls_over_the_limit_get_a_429(self):
+        for _ in range(2):
+            self.assertEqual(self.fetch('/limited').code, 200)
+
+        response = self.fetch('/limited')
+
+        self.assertEqual(response.code, 429)
+        # the seconds left of the window, rounded up
+        self.assertEqual(response.headers['Retry-After'], '60')
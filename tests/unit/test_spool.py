@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from redis.exceptions import RedisError
+from tornado.testing import AsyncTestCase, gen_test
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore.dao import spool
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_and_recovers(self):
+        breaker = spool.CircuitBreaker(threshold=2, reset_timeout=0)
+
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        # one trial call once the timeout is over
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+class TestSpool(AsyncTestCase):
+
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.spool = spool.Spool(self.directory, batch_size=2)
+        self.replayed = []
+        self.fail_after = None
+        spool.register_replayer('test', self.replay)
+        spool.breaker.success()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        spool._replayers.pop('test')
+        super(TestSpool, self).tearDown()
+
+    def replay(self, records):
+        if self.fail_after is not None and len(self.replayed) >= self.fail_after:
+            raise RedisError('down again')
+        if any(r.get('broken') for r in records):
+            raise ValueError('broken record')
+        self.replayed.extend(records)
+
+    @gen_test
+    def test_replay(self):
+        for i in range(5):
+            self.spool.append('test', {'i': i})
+
+        # fails in the middle, the rest is kept for later
+        self.fail_after = 2
+        replayed = yield self.spool.replay()
+        self.assertEqual(replayed, 2)
+        self.assertEqual(self.replayed, [{'i': 0}, {'i': 1}])
+        self.assertEqual(spool.breaker.failures, 1)
+
+        # appended while the other file waits to be replayed
+        self.spool.append('test', {'i': 5})
+
+        self.fail_after = None
+        spool.breaker.success()
+        replayed = yield self.spool.replay()
+
+        self.assertEqual(replayed, 4)
+        self.assertEqual([r['i'] for r in self.replayed], range(6))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @gen_test
+    def test_moves_records_that_cant_be_replayed_out_of_the_way(self):
+        self.spool.append('test', {'i': 0})
+        self.spool.append('test', {'i': 1, 'broken': True})
+        self.spool.append('unknown', {'i': 2})
+        with open(self.spool.path, 'a') as f:
+            f.write('{not json\n')
+        self.spool.append('test', {'i': 3})
+
+        replayed = yield self.spool.replay()
+
+        self.assertEqual(replayed, 2)
+        self.assertEqual([r['i'] for r in self.replayed], [0, 3])
+        # not Redis failures
+        self.assertEqual(spool.breaker.state, spool.breaker.CLOSED)
+        self.assertEqual(spool.breaker.failures, 0)
+
+        dead = '{}.dead'.format(os.getpid())
+        self.assertEqual(os.listdir(self.directory), [dead])
+        with open(os.path.join(self.directory, dead)) as f:
+            self.assertEqual(len(f.readlines()), 3)
@@ -0,0 +1,102 @@
+import sys
+import unittest
+
+import redis
+from tornado.testing import AsyncTestCase, gen_test
+
+from reactorcore import application
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import supervisor
+
+
+def redis_available():
+    try:
+        return redis.Redis(
+            host=conf['redis']['host'], port=conf['redis']['port'],
+            socket_timeout=1).ping()
+    except redis.RedisError:
+        return False
+
+
+def noop():
+    pass
+
+
+class TestScalingPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = supervisor.ScalingPolicy(
+            min_workers=1, max_workers=5, jobs_per_worker=100,
+            scale_down_delay=60, cooldown=30)
+
+    def test_scales_up_to_the_depth(self):
+        self.assertEqual(self.policy.desired(0, {}, 0), 1)
+        self.assertEqual(
+            self.policy.desired(1, {'normal': (250, 1)}, 100), 3)
+        # within the cooldown
+        self.assertEqual(
+            self.policy.desired(3, {'normal': (450, 1)}, 110), 3)
+        self.assertEqual(
+            self.policy.desired(3, {'normal': (900, 1)}, 130), 5)
+
+    def test_scales_up_when_jobs_wait_too_long(self):
+        self.assertEqual(
+            self.policy.desired(2, {'high': (5, 11), 'low': (0, 0)}, 0), 3)
+
+    def test_scales_down_one_at_a_time_after_a_delay(self):
+        stats = {'normal': (100, 1)}
+        # 100 jobs would need 1 worker, 2 at half their capacity
+        self.assertEqual(self.policy.desired(3, stats, 0), 3)
+        self.assertEqual(self.policy.desired(3, stats, 59), 3)
+        self.assertEqual(self.policy.desired(3, stats, 60), 2)
+        # back above the lower threshold
+        self.assertEqual(self.policy.desired(2, {'normal': (150, 1)}, 200), 2)
+        self.assertEqual(self.policy.desired(2, stats, 210), 2)
+        self.assertEqual(self.policy.desired(2, {}, 250), 2)
+        self.assertEqual(self.policy.desired(2, {}, 310), 1)
+        self.assertEqual(self.policy.desired(1, {}, 1000), 1)
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestSupervisor(AsyncTestCase):
+
+    def setUp(self):
+        super(TestSupervisor, self).setUp()
+        self.queue = supervisor.Queue(
+            'test-supervisor', connection=supervisor.Supervisor(None).client)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super(TestSupervisor, self).tearDown()
+
+    @gen_test(timeout=30)
+    def test_scales_workers_with_the_queue(self):
+        sup = supervisor.Supervisor(
+            supervisor.ScalingPolicy(
+                min_workers=1, max_workers=3, jobs_per_worker=2,
+                scale_down_delay=0, cooldown=0),
+            queue_names=['test-supervisor'],
+            command=[sys.executable, '-c', 'import time; time.sleep(30)'])
+
+        yield sup.check()
+        self.assertEqual(len(sup.workers), 1)
+
+        for _ in range(5):
+            self.queue.enqueue(noop)
+        yield sup.check()
+        self.assertEqual(len(sup.workers), 3)
+
+        self.queue.empty()
+        yield sup.check()
+        self.assertEqual(len(sup.workers), 2)
+        self.assertEqual(len(sup.draining), 1)
+
+        sup.stop()
+        for proc in sup.draining:
+            proc.wait()
+        sup.reap()
+        self.assertEqual(sup.draining, [])
@@ -0,0 +1,68 @@
+import math
+import random
+import unittest
+
+from reactorcore.timer import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_advance(self):
+        wheel = TimerWheel(tick=1, now=0)
+        wheel.add(5, 'a', 'A')
+        wheel.add(300, 'b', 'B')
+        wheel.add(70000, 'c', 'C')
+
+        self.assertEqual(wheel.advance(4), [])
+        self.assertEqual(wheel.advance(5), ['A'])
+        self.assertEqual(wheel.advance(299.9), [])
+        self.assertEqual(wheel.advance(1000), ['B'])
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(70000), ['C'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_due_when_added(self):
+        wheel = TimerWheel(tick=1, now=10)
+        wheel.add(3, 'a', 'A')
+        self.assertEqual(wheel.advance(10), ['A'])
+
+    def test_cancel_and_replace(self):
+        wheel = TimerWheel(tick=1, now=0)
+        wheel.add(5, 'a', 'A')
+        wheel.add(6, 'b', 'B')
+
+        self.assertEqual(wheel.cancel('a'), 'A')
+        self.assertEqual(wheel.cancel('a'), None)
+
+        # replaces the pending timer
+        wheel.add(20, 'b', 'B2')
+        self.assertEqual(wheel.get_time('b'), 20)
+
+        self.assertEqual(wheel.advance(10), [])
+        self.assertEqual(wheel.advance(20), ['B2'])
+
+    def test_against_sorted_timers(self):
+        rnd = random.Random(42)
+        # small wheels, to go through cascades and overflow
+        wheel = TimerWheel(tick=1, slots=4, levels=3, now=0)
+        pending = {}
+        now = 0
+
+        for _ in range(2000):
+            for _ in range(rnd.randint(0, 3)):
+                key = rnd.randint(0, 300)
+                at = now + rnd.choice([1, 10, 100, 1000]) * rnd.random()
+                wheel.add(at, key, (key, at))
+                pending[key] = at
+
+            now += rnd.random() * rnd.choice([1, 10, 50])
+            # timers fire on the first tick after their time
+            expected = sorted(
+                k for k, at in pending.items()
+                if math.ceil(at) <= math.floor(now))
+
+            popped = wheel.advance(now)
+
+            self.assertEqual(sorted(k for k, _ in popped), expected)
+            for key in expected:
+                del pending[key]
@@ -0,0 +1,309 @@
+import unittest
+from collections import deque
+
+from redis.exceptions import RedisError
+
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.queue import get_failed_queue
+from rq.registry import FinishedJobRegistry, StartedJobRegistry
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from reactorcore import application
+from reactorcore import metrics
+from reactorcore import util
+from reactorcore.settings import conf
+
+application.configure(conf)
+
+from reactorcore import worker
+from reactorcore.services import jobs
+from tests.unit.test_supervisor import redis_available
+
+
+class StubJob(object):
+    timeout = None
+    func_name = 'stub'
+    origin = 'test'
+    enqueued_at = None
+
+    def __init__(self, id, func, *args):
+        self.id = id
+        self.func = func
+        self.args = args
+        self.kwargs = {}
+
+
+class StubWorker(worker.NativeWorker):
+    """
+    Takes its jobs from a list, and keeps the outcomes in memory
+    """
+
+    def __init__(self, job_list, concurrency):
+        super(StubWorker, self).__init__(concurrency=concurrency)
+        self.pending = deque(job_list)
+        self.finished = []
+        self.failed = []
+
+    @gen.coroutine
+    def _dequeue(self):
+        if not self.pending:
+            self.stop()
+            raise gen.Return(None)
+        raise gen.Return((self.pending.popleft(), None))
+
+    @gen.coroutine
+    def _start_job(self, job):
+        pass
+
+    @gen.coroutine
+    def _finish_job(self, job, result):
+        self.finished.append((job.id, result))
+
+    @gen.coroutine
+    def _fail_job(self, job, exc_info):
+        self.failed.append(job.id)
+
+
+class Counter(object):
+    instances = 0
+
+    def __init__(self):
+        Counter.instances += 1
+
+    @gen.coroutine
+    def echo(self, value):
+        raise gen.Return(value)
+
+    @gen.coroutine
+    def broken(self):
+        raise ValueError('broken job')
+
+    @util.job
+    @gen.coroutine
+    def broken_job(self):
+        raise ValueError('broken util.job')
+
+
+class Limited(object):
+    calls = []
+
+    @util.rate_limit('test-limited', rate=1, per=60)
+    @gen.coroutine
+    def echo(self, value):
+        self.calls.append(value)
+        raise gen.Return(value)
+
+
+class TestNativeWorker(AsyncTestCase):
+
+    @gen_test
+    def test_runs_jobs_concurrently_up_to_the_limit(self):
+        running = [0]
+        peak = [0]
+
+        @gen.coroutine
+        def sleepy(i):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            yield gen.sleep(0.01)
+            running[0] -= 1
+            raise gen.Return(i)
+
+        @gen.coroutine
+        def broken():
+            raise ValueError('broken job')
+
+        job_list = [StubJob(i, sleepy, i) for i in range(10)]
+        job_list.append(StubJob('broken', broken))
+
+        metrics.registry.reset()
+        stub = StubWorker(job_list, concurrency=3)
+        yield stub.work()
+
+        self.assertEqual(peak[0], 3)
+        self.assertEqual(sorted(stub.finished), [(i, i) for i in range(10)])
+        self.assertEqual(stub.failed, ['broken'])
+        self.assertEqual(stub.running, 0)
+        for prefix in ('jobs.test.', 'jobs.stub.'):
+            self.assertEqual(
+                metrics.registry.histogram(prefix + 'run.seconds').count, 11)
+            self.assertEqual(
+                metrics.registry.counter(prefix + 'failed').value, 1)
+
+    @gen_test
+    def test_timed_out_jobs_keep_their_slot_until_they_end(self):
+        running = [0]
+        peak = [0]
+
+        @gen.coroutine
+        def sleepy(seconds):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            yield gen.sleep(seconds)
+            running[0] -= 1
+
+        slow = StubJob('slow', sleepy, 0.2)
+        slow.timeout = 0.05
+        stub = StubWorker([slow, StubJob('quick', sleepy, 0)], concurrency=1)
+        yield stub.work()
+
+        self.assertEqual(stub.failed, ['slow'])
+        self.assertEqual(stub.finished, [('quick', None)])
+        self.assertEqual(peak[0], 1)
+        self.assertEqual(stub.running, 0)
+
+    @gen_test
+    def test_reuses_service_instances(self):
+        jobs._instances.pop(Counter, None)
+        Counter.instances = 0
+
+        for i in range(3):
+            res = yield jobs.im_wrapper(i, cls=Counter, f_name='echo')
+            self.assertEqual(res, i)
+
+        self.assertEqual(Counter.instances, 1)
+
+
+@unittest.skipUnless(redis_available(), 'needs a local redis-server')
+class TestNativeWorkerWithRedis(AsyncTestCase):
+
+    def setUp(self):
+        super(TestNativeWorkerWithRedis, self).setUp()
+        self.worker = worker.NativeWorker(['test-worker'], max_jobs=2)
+        self.queue = Queue('test-worker', connection=self.worker.client)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super(TestNativeWorkerWithRedis, self).tearDown()
+
+    @gen_test(timeout=10)
+    def test_runs_and_records_real_jobs(self):
+        done = self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(3,),
+            kwargs={'cls': Counter, 'f_name': 'echo'})
+        failed = self.queue.enqueue_call(
+            func=jobs.im_wrapper, kwargs={'cls': Counter, 'f_name': 'broken'})
+
+        yield self.worker.work()
+
+        client = self.worker.client
+        done = Job.fetch(done.id, connection=client)
+        self.assertEqual(done.get_status(), JobStatus.FINISHED)
+        self.assertEqual(done.result, 3)
+        self.assertIn(
+            done.id, FinishedJobRegistry('test-worker', client).get_job_ids())
+
+        failed = Job.fetch(failed.id, connection=client)
+        self.assertEqual(failed.get_status(), JobStatus.FAILED)
+        self.assertIn('broken job', failed.exc_info)
+        failed_queue = get_failed_queue(client)
+        self.assertIn(failed.id, failed_queue.job_ids)
+        failed_queue.remove(failed.id)
+
+        self.assertEqual(
+            StartedJobRegistry('test-worker', client).get_job_ids(), [])
+        self.assertEqual(self.queue.count, 0)
+
+    @gen_test(timeout=10)
+    def test_util_job_errors_fail_the_job(self):
+        self.worker.max_jobs = 1
+        job = self.queue.enqueue_call(
+            func=jobs.im_wrapper,
+            kwargs={'cls': Counter, 'f_name': 'broken_job'})
+
+        # the jobs service of a worker, util.job runs on its loop
+        service = application.get_application().service
+        immediate = service.jobs
+        service.jobs = jobs.JobService()
+        try:
+            yield self.worker.work()
+        finally:
+            service.jobs = immediate
+
+        client = self.worker.client
+        job = Job.fetch(job.id, connection=client)
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertIn('ValueError: broken util.job', job.exc_info)
+        get_failed_queue(client).remove(job.id)
+
+    @gen_test(timeout=10)
+    def test_requeues_jobs_it_could_not_start(self):
+        self.worker.max_jobs = 1
+
+        @gen.coroutine
+        def start_job(job):
+            raise RedisError('down')
+        self.worker._start_job = start_job
+
+        job = self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(3,),
+            kwargs={'cls': Counter, 'f_name': 'echo'})
+        self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(4,),
+            kwargs={'cls': Counter, 'f_name': 'echo'})
+
+        yield self.worker.work()
+
+        # back at the front of its queue
+        self.assertEqual(self.queue.job_ids[0], job.id)
+        self.assertEqual(self.queue.count, 2)
+
+    @gen_test(timeout=10)
+    def test_defers_jobs_over_their_rate_limit(self):
+        client = self.worker.client
+        client.delete('ratelimit:bucket:test-limited')
+        Limited.calls = []
+        metrics.registry.reset()
+
+        ran = self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(1,),
+            kwargs={'cls': Limited, 'f_name': 'echo'})
+        deferred = self.queue.enqueue_call(
+            func=jobs.im_wrapper, args=(2,),
+            kwargs={'cls': Limited, 'f_name': 'echo'})
+
+        yield self.worker.work()
+
+        self.assertEqual(Limited.calls, [1])
+        self.assertEqual(
+            Job.fetch(ran.id, connection=client).get_status(),
+            JobStatus.FINISHED)
+
+        # neither run nor failed, queued again once a token is free
+        self.assertEqual(
+            Job.fetch(deferred.id, connection=client).get_status(),
+            JobStatus.DEFERRED)
+        self.assertIsNotNone(client.zscore('job:delayed', deferred.id))
+        self.assertNotIn(deferred.id, get_failed_queue(client).job_ids)
+        self.assertEqual(metrics.registry.counter('jobs.deferred').value, 1)
+
+        client.zrem('job:delayed', deferred.id)
+        client.delete('ratelimit:bucket:test-limited')
+
+
+class TestWeightedScheduler(unittest.TestCase):
+
+    def test_queues_come_first_by_weight(self):
+        scheduler = worker.WeightedScheduler(
+            ['high', 'normal', 'low'], {'high': 6, 'normal': 3})
+
+        firsts = [scheduler.order()[0] for _ in range(100)]
+
+        self.assertEqual(firsts.count('high'), 60)
+        self.assertEqual(firsts.count('normal'), 30)
+        # no weight is a weight of 1
+        self.assertEqual(firsts.count('low'), 10)
+        # spread out, not in a row
+        self.assertNotIn(['high'] * 6, [firsts[i:i + 6] for i in range(95)])
+
+    def test_starved_queues_go_first(self):
+        scheduler = worker.WeightedScheduler(
+            ['high', 'normal', 'low'], {'high': 6, 'normal': 3, 'low': 1})
+
+        self.assertEqual(
+            scheduler.order(first=['low'])[0], 'low')
+        self.assertEqual(
+            sorted(scheduler.order(first=['low'])), ['high', 'low', 'normal'])